@@ -18,9 +18,10 @@ from PIL import Image
 
 import wan
 from wan.configs import MAX_AREA_CONFIGS, SIZE_CONFIGS, SUPPORTED_SIZES, WAN_CONFIGS
+from wan.distributed.shared_weights import SharedWeightStore
 from wan.distributed.util import init_distributed_group
-from wan.utils.prompt_extend import DashScopePromptExpander, QwenPromptExpander
-from wan.utils.utils import merge_video_audio, save_video, str2bool
+from wan.utils.utils import (configure_pipeline, merge_video_audio,
+                             preview_callback, save_video, str2bool)
 
 
 EXAMPLE_PROMPT = {
@@ -80,6 +81,14 @@ def _validate_args(args):
 
     if args.task == "i2v-A14B":
         assert args.image is not None, "Please specify the image path for i2v."
+    assert not args.t5_int8 or args.t5_cpu, \
+        "--t5_int8 only applies to T5 on the CPU, please add --t5_cpu."
+    assert args.t5_server is None or not (
+        args.t5_fsdp or args.t5_cpu or args.t5_int8 or args.t5_threads or
+        args.t5_cache_dir), \
+        "The T5 options are set on the server when using --t5_server."
+    assert not (args.carry_vae_state and args.vae_tile_size), \
+        "--carry_vae_state does not support a tiled VAE (--vae_tile_size)."
 
     cfg = WAN_CONFIGS[args.task]
 
@@ -95,6 +104,8 @@ def _validate_args(args):
     if args.frame_num is None:
         args.frame_num = cfg.frame_num
 
+    # the prompt extension is cached by seed, it only gets a chosen one
+    args.prompt_extend_seed = args.base_seed
     args.base_seed = args.base_seed if args.base_seed >= 0 else random.randint(
         0, sys.maxsize)
     # Size check
@@ -119,7 +130,9 @@ def _parse_args():
         type=str,
         default="1280*720",
         choices=list(SIZE_CONFIGS.keys()),
-        help="The area (width*height) of the generated video. For the I2V task, the aspect ratio of the output video will follow that of the input image."
+        help="The area (width*height) of the generated video. For the I2V "
+        "task, the aspect ratio of the output video will follow that of the "
+        "input image."
     )
     parser.add_argument(
         "--frame_num",
@@ -136,7 +149,8 @@ def _parse_args():
         "--offload_model",
         type=str2bool,
         default=None,
-        help="Whether to offload the model to CPU after each model forward, reducing GPU memory usage."
+        help="Whether to offload the model to CPU after each model forward, "
+        "reducing GPU memory usage."
     )
     parser.add_argument(
         "--ulysses_size",
@@ -190,6 +204,13 @@ def _parse_args():
         default="zh",
         choices=["zh", "en"],
         help="The target language of prompt extend.")
+    parser.add_argument(
+        "--prompt_extend_cache_dir",
+        type=str,
+        default=None,
+        help="Directory persisting the extended prompts across runs. Keyed "
+        "by the seed if --base_seed is given, runs without one share the "
+        "unseeded entry.")
     parser.add_argument(
         "--base_seed",
         type=int,
@@ -223,6 +244,119 @@ def _parse_args():
         action="store_true",
         default=False,
         help="Whether to convert model paramerters dtype.")
+    parser.add_argument(
+        "--share_weights",
+        action="store_true",
+        default=False,
+        help="Whether to share host weights across node workers through "
+        "/dev/shm/wan_weights, which takes as much memory as the weights, e.g. "
+        "over 100 GB for the A14B models in float32.")
+    parser.add_argument(
+        "--keep_shared_weights",
+        action="store_true",
+        default=False,
+        help="Keep the shared host weights of --share_weights in /dev/shm when "
+        "finished, so that later runs attach without loading the checkpoints.")
+    parser.add_argument(
+        "--vae_tile_size",
+        type=int,
+        default=None,
+        help="Decode and encode with the VAE in spatial tiles of this many "
+        "latent pixels."
+    )
+    parser.add_argument(
+        "--vae_tile_overlap",
+        type=int,
+        default=None,
+        help="Overlap of the VAE tiles in latent pixels, a quarter of the tile "
+        "size by default."
+    )
+    parser.add_argument(
+        "--t5_cache_dir",
+        type=str,
+        default=None,
+        help="Directory persisting the T5 prompt embeddings across runs."
+    )
+    parser.add_argument(
+        "--t5_int8",
+        action="store_true",
+        default=False,
+        help="Quantize the linear layers of the CPU T5 to int8, requires --t5_cpu."
+    )
+    parser.add_argument(
+        "--t5_threads",
+        type=int,
+        default=None,
+        help="Number of threads of the CPU T5, all cores by default."
+    )
+    parser.add_argument(
+        "--t5_server",
+        type=str,
+        default=None,
+        help="Socket of a running wan/utils/t5_server.py to encode the prompts "
+        "with instead of an own T5."
+    )
+    parser.add_argument(
+        "--vae_dtype",
+        type=str,
+        default=None,
+        choices=["bfloat16", "float16"],
+        help="Run the VAE in this precision instead of float32. Check the "
+        "error first with wan/utils/vae_accuracy.py."
+    )
+    parser.add_argument(
+        "--vae_channels_last",
+        action="store_true",
+        default=False,
+        help="Run the VAE convolutions in the channels-last memory format, "
+        "which is faster with --vae_dtype."
+    )
+    parser.add_argument(
+        "--vae_warmup_sizes",
+        type=str,
+        nargs='*',
+        default=None,
+        choices=list(SIZE_CONFIGS.keys()),
+        help="Warm up the VAE for these sizes (--size if none given) before "
+        "generating, so the first video runs at steady-state speed. Enables "
+        "cuDNN autotuning."
+    )
+    parser.add_argument(
+        "--preview_dir",
+        type=str,
+        default=None,
+        help="Write a cheap preview of the predicted video to this directory "
+        "every --preview_steps sampling steps."
+    )
+    parser.add_argument(
+        "--preview_weights",
+        type=str,
+        default=None,
+        help="The latent-to-RGB projection for --preview_dir, fitted with "
+        "wan/utils/fit_preview.py."
+    )
+    parser.add_argument(
+        "--preview_steps",
+        type=int,
+        default=5,
+        help="Sampling steps between two previews."
+    )
+    parser.add_argument(
+        "--vae_encode_segment",
+        type=int,
+        default=None,
+        help="Encode long conditioning videos in independent segments of this "
+        "many latent frames."
+    )
+    parser.add_argument(
+        "--vae_encode_warmup",
+        type=int,
+        default=None,
+        help="Latent frames encoded ahead of every segment to rebuild the "
+        "causal cache. Defaults to the temporal receptive field of the "
+        "encoder, which makes the segments exact. Shorter is faster but "
+        "approximate, measure it with wan/utils/vae_accuracy.py."
+    )
 
     # animate
     parser.add_argument(
@@ -252,7 +386,8 @@ def _parse_args():
         "--num_clip",
         type=int,
         default=None,
-        help="Number of video clips to generate, the whole video will not exceed the length of audio."
+        help="Number of video clips to generate, the whole video will not "
+        "exceed the length of audio."
     )
     parser.add_argument(
         "--audio",
@@ -268,12 +403,14 @@ def _parse_args():
         "--tts_prompt_audio",
         type=str,
         default=None,
-        help="Path to the tts prompt audio file, e.g. wav, mp3. Must be greater than 16khz, and between 5s to 15s.")
+        help="Path to the tts prompt audio file, e.g. wav, mp3. Must be "
+        "greater than 16khz, and between 5s to 15s.")
     parser.add_argument(
         "--tts_prompt_text",
         type=str,
         default=None,
-        help="Content to the tts prompt audio. If provided, must exactly match tts_prompt_audio")
+        help="Content to the tts prompt audio. If provided, must exactly match "
+        "tts_prompt_audio")
     parser.add_argument(
         "--tts_text",
         type=str,
@@ -290,11 +427,18 @@ def _parse_args():
         default=False,
         help="whether set the reference image as the starting point for generation"
     )
+    parser.add_argument(
+        "--carry_vae_state",
+        action="store_true",
+        default=False,
+        help="Decode each s2v clip by continuing the VAE state of the previous clip."
+    )
     parser.add_argument(
         "--infer_frames",
         type=int,
         default=80,
-        help="Number of frames per clip, 48 or 80 or others (must be multiple of 4) for 14B s2v"
+        help="Number of frames per clip, 48 or 80 or others (must be multiple "
+        "of 4) for 14B s2v"
     )
     parser.add_argument(
         "--num-workers",
@@ -365,16 +509,22 @@ def generate_on_worker(args, rank, master_addr, master_port):
         init_distributed_group()
 
     if args.use_prompt_extend:
+        from wan.utils.prompt_extend import (
+            DashScopePromptExpander,
+            QwenPromptExpander,
+        )
         if args.prompt_extend_method == "dashscope":
             prompt_expander = DashScopePromptExpander(
                 model_name=args.prompt_extend_model,
                 task=args.task,
-                is_vl=args.image is not None)
+                is_vl=args.image is not None,
+                cache_dir=args.prompt_extend_cache_dir)
         elif args.prompt_extend_method == "local_qwen":
             prompt_expander = QwenPromptExpander(
                 model_name=args.prompt_extend_model,
                 task=args.task,
                 is_vl=args.image is not None,
+                cache_dir=args.prompt_extend_cache_dir,
                 device=rank)
         else:
             raise NotImplementedError(
@@ -386,6 +536,7 @@ def generate_on_worker(args, rank, master_addr, master_port):
 
     logging.info(f"Generation job args: {args}")
     logging.info(f"Generation model config: {cfg}")
+    preview = preview_callback(args, cfg.sample_fps, rank)
 
     if dist.is_initialized():
         base_seed = [args.base_seed] if rank == 0 else [None]
@@ -406,7 +557,7 @@ def generate_on_worker(args, rank, master_addr, master_port):
                 args.prompt,
                 image=img,
                 tar_lang=args.prompt_extend_target_lang,
-                seed=args.base_seed)
+                seed=args.prompt_extend_seed)
             if prompt_output.status == False:
                 logging.info(
                     f"Extending prompt failed: {prompt_output.message}")
@@ -434,8 +585,11 @@ def generate_on_worker(args, rank, master_addr, master_port):
             use_sp=(args.ulysses_size > 1),
             t5_cpu=args.t5_cpu,
             convert_model_dtype=args.convert_model_dtype,
+            share_weights=args.share_weights,
+            t5_server=args.t5_server,
         )
 
+        configure_pipeline(wan_t2v, args)
         logging.info(f"Starting video generation...")
         video = wan_t2v.generate(
             args.prompt,
@@ -446,7 +600,9 @@ def generate_on_worker(args, rank, master_addr, master_port):
             sampling_steps=args.sample_steps,
             guide_scale=args.sample_guide_scale,
             seed=args.base_seed,
-            offload_model=args.offload_model)
+            offload_model=args.offload_model,
+            callback=preview,
+            callback_steps=args.preview_steps)
         logging.info(f"Finished video generation.")
     elif "ti2v" in args.task:
         logging.info("Creating WanTI2V pipeline.")
@@ -460,8 +616,11 @@ def generate_on_worker(args, rank, master_addr, master_port):
             use_sp=(args.ulysses_size > 1),
             t5_cpu=args.t5_cpu,
             convert_model_dtype=args.convert_model_dtype,
+            share_weights=args.share_weights,
+            t5_server=args.t5_server,
         )
 
+        configure_pipeline(wan_ti2v, args)
         logging.info(f"Starting video generation...")
         video = wan_ti2v.generate(
             args.prompt,
@@ -474,7 +633,9 @@ def generate_on_worker(args, rank, master_addr, master_port):
             sampling_steps=args.sample_steps,
             guide_scale=args.sample_guide_scale,
             seed=args.base_seed,
-            offload_model=args.offload_model)
+            offload_model=args.offload_model,
+            callback=preview,
+            callback_steps=args.preview_steps)
         logging.info(f"Finished video generation.")
     elif "animate" in args.task:
         logging.info("Creating Wan-Animate pipeline.")
@@ -488,9 +649,12 @@ def generate_on_worker(args, rank, master_addr, master_port):
             use_sp=(args.ulysses_size > 1),
             t5_cpu=args.t5_cpu,
             convert_model_dtype=args.convert_model_dtype,
+            share_weights=args.share_weights,
+            t5_server=args.t5_server,
             use_relighting_lora=args.use_relighting_lora
         )
 
+        configure_pipeline(wan_animate, args)
         logging.info(f"Starting video generation...")
         video = wan_animate.generate(
             src_root_path=args.src_root_path,
@@ -502,7 +666,9 @@ def generate_on_worker(args, rank, master_addr, master_port):
             sampling_steps=args.sample_steps,
             guide_scale=args.sample_guide_scale,
             seed=args.base_seed,
-            offload_model=args.offload_model)
+            offload_model=args.offload_model,
+            callback=preview,
+            callback_steps=args.preview_steps)
         logging.info(f"Finished video generation.")
     elif "s2v" in args.task:
         logging.info("Creating WanS2V pipeline.")
@@ -516,7 +682,10 @@ def generate_on_worker(args, rank, master_addr, master_port):
             use_sp=(args.ulysses_size > 1),
             t5_cpu=args.t5_cpu,
             convert_model_dtype=args.convert_model_dtype,
+            share_weights=args.share_weights,
+            t5_server=args.t5_server,
         )
+        configure_pipeline(wan_s2v, args)
         logging.info(f"Starting video generation...")
         video = wan_s2v.generate(
             input_prompt=args.prompt,
@@ -536,7 +705,10 @@ def generate_on_worker(args, rank, master_addr, master_port):
             guide_scale=args.sample_guide_scale,
             seed=args.base_seed,
             offload_model=args.offload_model,
+            callback=preview,
+            callback_steps=args.preview_steps,
             init_first_frame=args.start_from_ref,
+            carry_vae_state=args.carry_vae_state,
         )
         logging.info(f"Finished video generation.")
     else:
@@ -551,7 +723,10 @@ def generate_on_worker(args, rank, master_addr, master_port):
             use_sp=(args.ulysses_size > 1),
             t5_cpu=args.t5_cpu,
             convert_model_dtype=args.convert_model_dtype,
+            share_weights=args.share_weights,
+            t5_server=args.t5_server,
         )
+        configure_pipeline(wan_i2v, args)
         logging.info(f"Starting video generation...")
         video = wan_i2v.generate(
             args.prompt,
@@ -563,7 +738,9 @@ def generate_on_worker(args, rank, master_addr, master_port):
             sampling_steps=args.sample_steps,
             guide_scale=args.sample_guide_scale,
             seed=args.base_seed,
-            offload_model=args.offload_model)
+            offload_model=args.offload_model,
+            callback=preview,
+            callback_steps=args.preview_steps)
         logging.info(f"Finished video generation.")
 
     if rank == 0:
@@ -587,7 +764,14 @@ def generate_on_worker(args, rank, master_addr, master_port):
                 merge_video_audio(video_path=args.save_file, audio_path=args.audio)
             else:
                 merge_video_audio(video_path=args.save_file, audio_path="tts.wav")
-    
+
+    # once every worker has attached, the files can go; the workers may be on
+    # different nodes, so each clears its own
+    if args.share_weights and not args.keep_shared_weights:
+        if dist.is_initialized():
+            dist.barrier()
+        SharedWeightStore(pin=False).clear()
+
     return video
 
 
@@ -0,0 +1,30 @@
+# Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope="session")
+def vae21_checkpoint(tmp_path_factory):
+    """
+    A randomly initialised Wan2.1 VAE checkpoint with the layout
+    `Wan2_1_VAE` expects.
+    """
+    torch = pytest.importorskip("torch")
+    from wan.modules.vae2_1 import WanVAE_
+
+    torch.manual_seed(0)
+    model = WanVAE_(
+        dim=96,
+        z_dim=16,
+        dim_mult=[1, 2, 4, 4],
+        num_res_blocks=2,
+        attn_scales=[],
+        temperal_downsample=[False, True, True],
+        dropout=0.0)
+    path = str(tmp_path_factory.mktemp("vae") / "vae2_1.pth")
+    torch.save(model.state_dict(), path)
+    return path
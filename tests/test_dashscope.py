@@ -0,0 +1,87 @@
+# Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
+"""
+`DashScopePromptExpander` retries, backoff, rate limiting and session reuse
+against the stub server of `wan/utils/dashscope_stub.py`.
+
+Run with `python -m pytest tests/test_dashscope.py`.
+"""
+import threading
+import time
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+pytest.importorskip("requests")
+pytest.importorskip("torch")
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    from wan.utils.dashscope_stub import StubHandler
+
+    monkeypatch.setattr(StubHandler, 'latency', 0.0)
+    monkeypatch.setattr(StubHandler, 'failure_rate', 0.0)
+    monkeypatch.setattr(StubHandler, 'fail_first', 0)
+    monkeypatch.setattr(StubHandler, 'connections', set())
+    monkeypatch.setattr(StubHandler, 'requests', 0)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setenv('DASH_API_URL',
+                       f"http://127.0.0.1:{server.server_address[1]}/api/v1")
+    yield StubHandler
+    server.shutdown()
+    server.server_close()
+
+
+def _expander(**kwargs):
+    from wan.utils.prompt_extend import DashScopePromptExpander
+    return DashScopePromptExpander(api_key='stub', task='t2v-A14B', **kwargs)
+
+
+def test_retry_with_backoff(stub, monkeypatch):
+    from wan.utils import prompt_extend
+
+    bounds = []
+    monkeypatch.setattr(prompt_extend.random, 'uniform',
+                        lambda a, b: bounds.append(b) or 0.0)
+    stub.fail_first = 2
+    output = _expander(retry_times=4, backoff=0.5, max_backoff=0.75).extend(
+        'a prompt', 'system', seed=0)
+    assert output.status
+    assert output.prompt == 'A PROMPT'
+    assert stub.requests == 3
+    # full jitter up to the doubled backoff, capped
+    assert bounds == [0.5, 0.75]
+
+
+def test_retries_exhausted(stub):
+    stub.fail_first = 10
+    output = _expander(retry_times=3, backoff=0.01).extend(
+        'a prompt', 'system', seed=0)
+    assert not output.status
+    assert output.prompt == 'a prompt'
+    assert '429' in output.message
+    assert stub.requests == 3
+
+
+def test_multimodal(stub):
+    from PIL import Image
+
+    expander = _expander(is_vl=True)
+    output = expander.extend_with_img(
+        'a prompt', 'system', image=Image.new('RGB', (64, 32)), seed=0)
+    assert output.status
+    assert output.prompt == 'A PROMPT'
+
+
+def test_rate_limit_and_session_reuse(stub):
+    expander = _expander(max_workers=2, rate_limit=20.0)
+    start = time.perf_counter()
+    outputs = expander.extend_batch([f'prompt {i}' for i in range(6)], seed=0)
+    elapsed = time.perf_counter() - start
+    assert [u.prompt for u in outputs] == [f'PROMPT {i}' for i in range(6)]
+    # 6 requests started 1 / 20 s apart
+    assert elapsed >= 5 / 20
+    # one keep-alive connection per worker thread
+    assert len(stub.connections) <= 2
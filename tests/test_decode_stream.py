@@ -0,0 +1,26 @@
+# Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
+"""
+`decode_stream` against `decode`.
+
+Run with `python -m pytest tests/test_decode_stream.py`.
+"""
+import pytest
+
+torch = pytest.importorskip("torch")
+
+
+@pytest.fixture(scope='module')
+def vae(vae21_checkpoint):
+    from wan.modules.vae2_1 import Wan2_1_VAE
+    return Wan2_1_VAE(vae_pth=vae21_checkpoint, device='cpu')
+
+
+def test_decode_stream(vae):
+    torch.manual_seed(0)
+    z = torch.randn(16, 4, 8, 8)
+    chunks = list(vae.decode_stream(z))
+    # one frame for the first latent, four for each of the others
+    assert [c.shape[1] for c in chunks] == [1, 4, 4, 4]
+    # the same decoder steps, only written to the output chunk by chunk
+    torch.testing.assert_close(
+        torch.cat(chunks, dim=1), vae.decode([z])[0], atol=0, rtol=0)
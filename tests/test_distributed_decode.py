@@ -0,0 +1,66 @@
+# Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
+"""
+`distributed_decode` on 2 gloo ranks on the CPU against `vae.decode`.
+
+Run with `python -m pytest tests/test_distributed_decode.py`.
+"""
+import pytest
+
+torch = pytest.importorskip("torch")
+import torch.distributed as dist  # noqa: E402
+import torch.multiprocessing as mp  # noqa: E402
+
+WORLD_SIZE = 2
+# bands and tiles run the same kernels as the single-rank decode, only on
+# inputs of a different size, and the tiles are blended in a different float
+# summation order
+ATOL = 1e-4
+
+
+def _worker(rank, init_file, checkpoint, mode):
+    from wan.distributed.vae_decode import (
+        distributed_decode,
+        distributed_decode_clip,
+    )
+    from wan.modules.vae2_1 import Wan2_1_VAE
+    from wan.modules.vae_cache import CausalState
+
+    dist.init_process_group(
+        'gloo',
+        init_method=f'file://{init_file}',
+        rank=rank,
+        world_size=WORLD_SIZE)
+    try:
+        torch.manual_seed(0)
+        vae = Wan2_1_VAE(vae_pth=checkpoint, device='cpu')
+        # odd height, so the bands differ in size
+        zs = [torch.randn(16, 3, 7, 8) for _ in range(2)]
+        if mode == 'clips':
+            state, reference_state = CausalState(), CausalState()
+            for z in zs:
+                video = distributed_decode_clip(vae, z, state)
+                ref = vae.decode_clip(z, reference_state)
+                torch.testing.assert_close(video, ref, atol=ATOL, rtol=0)
+            return
+
+        if mode == 'tiles':
+            vae.enable_tiling(tile_size=4, tile_overlap=1)
+        videos = distributed_decode(vae, zs)
+        if rank != 0:
+            assert videos is None
+            return
+        reference = vae.decode(zs)
+        assert len(videos) == len(reference)
+        for video, ref in zip(videos, reference):
+            assert video.shape == ref.shape
+            torch.testing.assert_close(video, ref, atol=ATOL, rtol=0)
+    finally:
+        dist.destroy_process_group()
+
+
+@pytest.mark.parametrize('mode', ['bands', 'tiles', 'clips'])
+def test_distributed_decode(tmp_path, vae21_checkpoint, mode):
+    mp.spawn(
+        _worker,
+        args=(str(tmp_path / 'init'), vae21_checkpoint, mode),
+        nprocs=WORLD_SIZE)
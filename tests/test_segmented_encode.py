@@ -0,0 +1,42 @@
+# Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
+"""
+Segmented encoding (`enable_segmented_encode`) against the sequential encode.
+
+Run with `python -m pytest tests/test_segmented_encode.py`.
+"""
+import pytest
+
+torch = pytest.importorskip("torch")
+
+# same kernels on the same inputs, only batched differently
+ATOL = 1e-5
+
+
+@pytest.fixture(scope='module')
+def vae(vae21_checkpoint):
+    from wan.modules.vae2_1 import Wan2_1_VAE
+    return Wan2_1_VAE(vae_pth=vae21_checkpoint, device='cpu')
+
+
+@pytest.fixture(scope='module')
+def video():
+    torch.manual_seed(0)
+    return torch.rand(3, 1 + 4 * 63, 16, 16) * 2 - 1
+
+
+def test_segmented_encode_exact(vae, video):
+    from wan.utils.vae_accuracy import segmented_encode_error
+
+    # a warm-up covering the receptive field rebuilds the causal cache exactly
+    start, num_latents = vae._tail_start(video.shape[1], 1)
+    assert start + 8 < num_latents
+    max_abs, _ = segmented_encode_error(vae, video, 8, start)
+    assert max_abs <= ATOL
+
+
+def test_segmented_encode_default_warmup(vae, video):
+    from wan.utils.vae_accuracy import segmented_encode_error
+
+    # the default warm-up is the measured receptive field
+    max_abs, _ = segmented_encode_error(vae, video, 8, None)
+    assert max_abs <= ATOL
@@ -0,0 +1,42 @@
+# Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
+"""
+The scaled_dot_product_attention path of `T5Attention` against the einsum
+reference on padded prompts.
+
+Run with `python -m pytest tests/test_t5_attention.py`.
+"""
+import pytest
+
+torch = pytest.importorskip("torch")
+
+# the same attention, only with the kernels summing in a different order
+ATOL = 1e-5
+
+
+@pytest.mark.parametrize('shared_pos', [True, False])
+def test_sdpa_matches_einsum(monkeypatch, shared_pos):
+    from wan.modules.t5 import T5Attention, T5Encoder
+
+    torch.manual_seed(0)
+    encoder = T5Encoder(
+        vocab=128,
+        dim=64,
+        dim_attn=64,
+        dim_ffn=128,
+        num_heads=4,
+        num_layers=2,
+        num_buckets=32,
+        shared_pos=shared_pos,
+        dropout=0.0).eval()
+    ids = torch.randint(1, 128, (2, 12))
+    # the second prompt is padded after 5 tokens
+    mask = torch.ones(2, 12, dtype=torch.long)
+    mask[1, 5:] = 0
+    ids[1, 5:] = 0
+
+    with torch.no_grad():
+        monkeypatch.setattr(T5Attention, 'use_sdpa', True)
+        sdpa = encoder(ids, mask)
+        monkeypatch.setattr(T5Attention, 'use_sdpa', False)
+        einsum = encoder(ids, mask)
+    torch.testing.assert_close(sdpa, einsum, atol=ATOL, rtol=0)
@@ -0,0 +1,65 @@
+# Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
+"""
+`T5Server` and `T5Client` round trip on the CPU with a stub encoder.
+
+Run with `python -m pytest tests/test_t5_service.py`.
+"""
+import os
+import threading
+import time
+
+import pytest
+
+torch = pytest.importorskip("torch")
+
+
+def _stub_encoder(texts, device):
+    # one row per character, filled with the text length
+    return [
+        torch.full((len(u), 4), float(len(u)), device=device) for u in texts
+    ]
+
+
+@pytest.fixture
+def server(tmp_path):
+    from wan.distributed.t5_service import T5Server
+
+    server = T5Server(
+        _stub_encoder,
+        'cpu',
+        address=str(tmp_path / 't5.sock'),
+        root=str(tmp_path / 'embeddings'))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    deadline = time.monotonic() + 10
+    while not os.path.exists(server.address + '.key') or not os.path.exists(
+            server.address):
+        assert time.monotonic() < deadline, "the server did not start"
+        time.sleep(0.01)
+    return server
+
+
+def _check(client, texts):
+    context = client(texts, 'cpu')
+    assert len(context) == len(texts)
+    for u, e in zip(texts, context):
+        torch.testing.assert_close(e, torch.full((len(u), 4), float(len(u))))
+
+
+def test_round_trip(server):
+    from wan.distributed.t5_service import T5Client
+
+    client = T5Client(server.address)
+    _check(client, ['a', 'abc', 'ab'])
+    _check(client, ['abcd'])
+    # the client removes the embedding files it read
+    assert os.listdir(server.root) == []
+
+
+def test_reconnect(server):
+    from wan.distributed.t5_service import T5Client
+
+    client = T5Client(server.address)
+    _check(client, ['a'])
+    # a lost connection is reopened once
+    client._conn.close()
+    _check(client, ['abc'])
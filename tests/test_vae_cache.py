@@ -0,0 +1,57 @@
+# Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
+"""
+Memoized VAE encodes against encoding the full video.
+
+Run with `python -m pytest tests/test_vae_cache.py`.
+"""
+import pytest
+
+torch = pytest.importorskip("torch")
+
+# the head and the zero tail run the same kernels as the full encode on the
+# same inputs, only with a different number of frames
+ATOL = 1e-5
+
+
+@pytest.fixture(scope='module')
+def vae(vae21_checkpoint):
+    from wan.modules.vae2_1 import Wan2_1_VAE
+    return Wan2_1_VAE(vae_pth=vae21_checkpoint, device='cpu')
+
+
+def test_encode_zero_padded(vae):
+    # long enough for the zero tail to leave the receptive field of the image
+    num_frames = 1 + 4 * 63
+    torch.manual_seed(0)
+    frames = torch.rand(3, 1, 16, 16) * 2 - 1
+    start, num_latents = vae._tail_start(num_frames, 1)
+    assert 0 < start < num_latents == 64
+
+    latent = vae.encode_zero_padded(frames, num_frames)
+    video = torch.cat([frames, frames.new_zeros(3, num_frames - 1, 16, 16)],
+                      dim=1)
+    reference = vae.encode([video])[0]
+    assert latent.shape == reference.shape
+    torch.testing.assert_close(latent, reference, atol=ATOL, rtol=0)
+
+    # a second image reuses the zero tail
+    other = torch.rand(3, 1, 16, 16) * 2 - 1
+    video[:, :1] = other
+    torch.testing.assert_close(
+        vae.encode_zero_padded(other, num_frames),
+        vae.encode([video])[0],
+        atol=ATOL,
+        rtol=0)
+
+
+def test_encode_zero_padded_short(vae):
+    # shorter than the receptive field, encoded whole
+    num_frames = 9
+    frames = torch.rand(3, 1, 16, 16) * 2 - 1
+    video = torch.cat([frames, frames.new_zeros(3, num_frames - 1, 16, 16)],
+                      dim=1)
+    torch.testing.assert_close(
+        vae.encode_zero_padded(frames, num_frames),
+        vae.encode([video])[0],
+        atol=ATOL,
+        rtol=0)
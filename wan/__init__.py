@@ -1,7 +1,40 @@
 # Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
-from . import configs, distributed, modules
-from .image2video import WanI2V
-from .speech2video import WanS2V
-from .text2video import WanT2V
-from .textimage2video import WanTI2V
-from .animate import WanAnimate
\ No newline at end of file
+import importlib
+from typing import TYPE_CHECKING
+
+from . import configs, distributed
+
+if TYPE_CHECKING:
+    from . import modules
+    from .animate import WanAnimate
+    from .image2video import WanI2V
+    from .speech2video import WanS2V
+    from .text2video import WanT2V
+    from .textimage2video import WanTI2V
+
+# Pipelines are imported on first attribute access, so that e.g. t2v does not
+# pay for the s2v (librosa, wav2vec2) and animate (decord, cv2, peft) imports.
+_LAZY_ATTRS = {
+    'modules': ('.modules', None),
+    'WanI2V': ('.image2video', 'WanI2V'),
+    'WanS2V': ('.speech2video', 'WanS2V'),
+    'WanT2V': ('.text2video', 'WanT2V'),
+    'WanTI2V': ('.textimage2video', 'WanTI2V'),
+    'WanAnimate': ('.animate', 'WanAnimate'),
+}
+
+__all__ = ['configs', 'distributed', *_LAZY_ATTRS]
+
+
+def __getattr__(name):
+    if name not in _LAZY_ATTRS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    module_name, attr = _LAZY_ATTRS[name]
+    module = importlib.import_module(module_name, __name__)
+    value = module if attr is None else getattr(module, attr)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY_ATTRS))
@@ -17,7 +17,10 @@ from tqdm import tqdm
 import torch.nn.functional as F
 from .distributed.fsdp import shard_model
 from .distributed.sequence_parallel import sp_attn_forward, sp_dit_forward
+from .distributed.shared_weights import SharedWeightStore
+from .distributed.t5_service import T5Client
 from .distributed.util import get_world_size
+from .distributed.vae_decode import distributed_decode
 
 from .modules.animate import WanAnimateModel
 from .modules.animate import CLIPModel
@@ -30,6 +33,8 @@ from .utils.fm_solvers import (
     retrieve_timesteps,
 )
 from .utils.fm_solvers_unipc import FlowUniPCMultistepScheduler
+from .utils.pinned_memory import PinnedMemoryPool
+from .utils.utils import load_in_parallel
 
 
 
@@ -47,7 +52,10 @@ class WanAnimate:
         t5_cpu=False,
         init_on_cpu=True,
         convert_model_dtype=False,
-        use_relighting_lora=False
+        use_relighting_lora=False,
+        parallel_load=True,
+        share_weights=False,
+        t5_server=None,
     ):
         r"""
         Initializes the generation model components.
@@ -76,12 +84,22 @@ class WanAnimate:
                 Only works without FSDP.
             use_relighting_lora (`bool`, *optional*, defaults to False):
                Whether to use relighting lora for character replacement. 
+            parallel_load (`bool`, *optional*, defaults to True):
+                Load the model components concurrently on a thread pool.
+            share_weights (`bool`, *optional*, defaults to False):
+                Keep the host copies of T5 and CPU-resident DiT weights in a
+                node-local shared-memory store used by all workers on the node.
+            t5_server (`str`, *optional*, defaults to None):
+                Address of a node-local `T5Server` encoding the prompts in
+                place of an own T5 model.
         """
         self.device = torch.device(f"cuda:{device_id}")
         self.config = config
         self.rank = rank
-        self.t5_cpu = t5_cpu
+        # a T5 server leaves no local model to move to the GPU
+        self.t5_cpu = t5_cpu or t5_server is not None
         self.init_on_cpu = init_on_cpu
+        self.offload_pool = PinnedMemoryPool()
 
         self.num_train_timesteps = config.num_train_timesteps
         self.param_dtype = config.param_dtype
@@ -90,39 +108,62 @@ class WanAnimate:
             self.init_on_cpu = False
 
         shard_fn = partial(shard_model, device_id=device_id)
-        self.text_encoder = T5EncoderModel(
-            text_len=config.text_len,
-            dtype=config.t5_dtype,
-            device=torch.device('cpu'),
-            checkpoint_path=os.path.join(checkpoint_dir, config.t5_checkpoint),
-            tokenizer_path=os.path.join(checkpoint_dir, config.t5_tokenizer),
-            shard_fn=shard_fn if t5_fsdp else None,
-        )
-
-        self.clip = CLIPModel(
-            dtype=torch.float16,
-            device=self.device,
-            checkpoint_path=os.path.join(checkpoint_dir,
-                                         config.clip_checkpoint),
-            tokenizer_path=os.path.join(checkpoint_dir, config.clip_tokenizer))
-
-        self.vae = Wan2_1_VAE(
-            vae_pth=os.path.join(checkpoint_dir, config.vae_checkpoint),
-            device=self.device)
-
-        logging.info(f"Creating WanAnimate from {checkpoint_dir}")
 
         if not dit_fsdp:
-            self.noise_model = WanAnimateModel.from_pretrained(
+            load_dit = partial(
+                WanAnimateModel.from_pretrained,
                 checkpoint_dir,
                 torch_dtype=self.param_dtype,
                 device_map=self.device)
         else:
-            self.noise_model = WanAnimateModel.from_pretrained(
-                checkpoint_dir, torch_dtype=self.param_dtype)
+            load_dit = partial(
+                WanAnimateModel.from_pretrained,
+                checkpoint_dir,
+                torch_dtype=self.param_dtype)
+
+        logging.info(f"Creating WanAnimate from {checkpoint_dir}")
+        components = load_in_parallel(
+            {
+                'text_encoder':
+                    partial(T5Client, t5_server) if t5_server is not None
+                    else partial(
+                        T5EncoderModel,
+                        text_len=config.text_len,
+                        dtype=config.t5_dtype,
+                        device=torch.device('cpu'),
+                        checkpoint_path=os.path.join(checkpoint_dir,
+                                                     config.t5_checkpoint),
+                        tokenizer_path=os.path.join(checkpoint_dir,
+                                                    config.t5_tokenizer)),
+                'clip':
+                    partial(
+                        CLIPModel,
+                        dtype=torch.float16,
+                        device=self.device,
+                        checkpoint_path=os.path.join(checkpoint_dir,
+                                                     config.clip_checkpoint),
+                        tokenizer_path=os.path.join(checkpoint_dir,
+                                                    config.clip_tokenizer)),
+                'vae':
+                    partial(
+                        Wan2_1_VAE,
+                        vae_pth=os.path.join(checkpoint_dir,
+                                             config.vae_checkpoint),
+                        device=self.device),
+                'noise_model':
+                    load_dit,
+            },
+            parallel=parallel_load,
+            device=self.device)
+        self.text_encoder = components['text_encoder']
+        # FSDP wrapping runs collectives, keep it on this thread
+        if t5_fsdp:
+            self.text_encoder.shard(shard_fn)
+        self.clip = components['clip']
+        self.vae = components['vae']
 
         self.noise_model = self._configure_model(
-            model=self.noise_model,
+            model=components['noise_model'],
             use_sp=use_sp,
             dit_fsdp=dit_fsdp,
             shard_fn=shard_fn,
@@ -132,6 +173,14 @@ class WanAnimate:
             config=config
             )
 
+        if share_weights:
+            store = SharedWeightStore()
+            if t5_server is None:
+                store.share(
+                    self.text_encoder.model,
+                    os.path.join(checkpoint_dir, config.t5_checkpoint))
+            store.share(self.noise_model, checkpoint_dir)
+
         if use_sp:
             self.sp_size = get_world_size()
         else:
@@ -308,6 +357,8 @@ class WanAnimate:
         n_prompt="",
         seed=-1,
         offload_model=True,
+        callback=None,
+        callback_steps=1,
     ):
         r"""
         Generates video frames from input image using diffusion process.
@@ -339,6 +390,13 @@ class WanAnimate:
                 Random seed for noise generation. If -1, use random seed
             offload_model (`bool`, *optional*, defaults to True):
                 If True, offloads models to CPU during generation to save VRAM
+            callback (callable, *optional*, defaults to None):
+                Called as `callback(step, timestep, latent)` with the predicted
+                clean latent of the current clip, without the reference frame,
+                every `callback_steps` steps. The step counts restart with
+                every clip. See `WanT2V.generate`.
+            callback_steps (`int`, *optional*, defaults to 1):
+                Sampling steps between two calls of `callback`.
 
         Returns:
             torch.Tensor:
@@ -365,17 +423,21 @@ class WanAnimate:
 
         cond_images, face_images, refer_images = self.prepare_source(src_pose_path=src_pose_path, src_face_path=src_face_path, src_ref_path=src_ref_path)
         
-        if not self.t5_cpu:
-            self.text_encoder.model.to(self.device)
-            context = self.text_encoder([input_prompt], self.device)
-            context_null = self.text_encoder([n_prompt], self.device)
+        # cached prompts need neither the model nor its transfer to the GPU
+        if not self.t5_cpu and not self.text_encoder.is_cached(
+            [input_prompt, n_prompt]):
+            self.offload_pool.load(
+                self.text_encoder.model, self.device, stage='t5')
+            context, context_null = self.text_encoder(
+                [input_prompt, n_prompt], self.device)
             if offload_model:
-                self.text_encoder.model.cpu()
+                self.offload_pool.offload(self.text_encoder.model, stage='t5')
         else:
-            context = self.text_encoder([input_prompt], torch.device('cpu'))
-            context_null = self.text_encoder([n_prompt], torch.device('cpu'))
-            context = [t.to(self.device) for t in context]
-            context_null = [t.to(self.device) for t in context_null]
+            context, context_null = self.text_encoder(
+                [input_prompt, n_prompt], torch.device('cpu'))
+            context = context.to(self.device)
+            context_null = context_null.to(self.device)
+        context, context_null = [context], [context_null]
 
         real_frame_len = len(cond_images)
         target_len = self.get_valid_len(real_frame_len, clip_len, overlap=refert_num)
@@ -505,46 +567,32 @@ class WanAnimate:
 
                 latents = noise
 
-                pose_latents_no_ref =  self.vae.encode(conditioning_pixel_values.to(torch.bfloat16))
-                pose_latents_no_ref = torch.stack(pose_latents_no_ref)
-                pose_latents = torch.cat([pose_latents_no_ref], dim=2)
-
                 ref_pixel_values = rearrange(ref_pixel_values, "t c h w -> 1 c t h w")
-                ref_latents =  self.vae.encode(ref_pixel_values.to(torch.bfloat16))
-                ref_latents = torch.stack(ref_latents)
 
                 mask_ref = self.get_i2v_mask(1, lat_h, lat_w, 1, device=self.device)
-                y_ref = torch.concat([mask_ref, ref_latents[0]]).to(dtype=torch.bfloat16, device=self.device)
 
                 img = ref_pixel_values[0, :, 0]
                 clip_context = self.clip.visual([img[:, None, :, :]]).to(dtype=torch.bfloat16, device=self.device)
 
+                reft_pixel_values = None
                 if mask_reft_len > 0:
                     if replace_flag:
                         bg_pixel_values = batch["bg_pixel_values"]
-                        y_reft = self.vae.encode(
-                            [
-                                torch.concat([refer_t_pixel_values[0, :, :mask_reft_len], bg_pixel_values[0, :, mask_reft_len:]], dim=1).to(self.device)
-                            ]
-                        )[0]
+                        reft_pixel_values = torch.concat([refer_t_pixel_values[0, :, :mask_reft_len], bg_pixel_values[0, :, mask_reft_len:]], dim=1)
                         mask_pixel_values = 1 - batch["mask_pixel_values"]
                         mask_pixel_values = rearrange(mask_pixel_values, "b t c h w -> (b t) c h w")
                         mask_pixel_values = F.interpolate(mask_pixel_values, size=(H//8, W//8), mode='nearest')
                         mask_pixel_values = rearrange(mask_pixel_values, "(b t) c h w -> b t c h w", b=1)[:,:,0]
                         msk_reft = self.get_i2v_mask(lat_t, lat_h, lat_w, mask_reft_len, mask_pixel_values=mask_pixel_values, device=self.device)
                     else:
-                        y_reft = self.vae.encode(
+                        reft_pixel_values = torch.concat(
                             [
-                                torch.concat(
-                                    [
-                                        torch.nn.functional.interpolate(refer_t_pixel_values[0, :, :mask_reft_len].cpu(),
-                                                                        size=(H, W), mode="bicubic"),
-                                        torch.zeros(3, T - mask_reft_len, H, W),
-                                    ],
-                                    dim=1,
-                                ).to(self.device)
-                            ]
-                        )[0]
+                                torch.nn.functional.interpolate(refer_t_pixel_values[0, :, :mask_reft_len].cpu(),
+                                                                size=(H, W), mode="bicubic"),
+                                torch.zeros(3, T - mask_reft_len, H, W),
+                            ],
+                            dim=1,
+                        )
                         msk_reft = self.get_i2v_mask(lat_t, lat_h, lat_w, mask_reft_len, device=self.device)
                 else:
                     if replace_flag:
@@ -553,30 +601,29 @@ class WanAnimate:
                         mask_pixel_values = rearrange(mask_pixel_values, "b t c h w -> (b t) c h w")
                         mask_pixel_values = F.interpolate(mask_pixel_values, size=(H//8, W//8), mode='nearest')
                         mask_pixel_values = rearrange(mask_pixel_values, "(b t) c h w -> b t c h w", b=1)[:,:,0]
-                        y_reft = self.vae.encode(
-                            [
-                                torch.concat(
-                                    [
-                                        bg_pixel_values[0],
-                                    ],
-                                    dim=1,
-                                ).to(self.device)
-                            ]
-                        )[0]
+                        reft_pixel_values = bg_pixel_values[0]
                         msk_reft = self.get_i2v_mask(lat_t, lat_h, lat_w, mask_reft_len, mask_pixel_values=mask_pixel_values, device=self.device)
                     else:
-                        y_reft = self.vae.encode(
-                            [
-                                torch.concat(
-                                    [
-                                        torch.zeros(3, T - mask_reft_len, H, W),
-                                    ],
-                                    dim=1,
-                                ).to(self.device)
-                            ]
-                        )[0]
                         msk_reft = self.get_i2v_mask(lat_t, lat_h, lat_w, mask_reft_len, device=self.device)
 
+                # pose and reft videos have the same shape and are encoded in
+                # one batch, the pixel values are bfloat16 already so the cast
+                # does not change them
+                pose_videos = list(conditioning_pixel_values)
+                reft_videos = [] if reft_pixel_values is None else [reft_pixel_values]
+                encoded = self.vae.encode([
+                    v.to(device=self.device, dtype=torch.bfloat16)
+                    for v in pose_videos + [ref_pixel_values[0]] + reft_videos
+                ])
+                pose_latents = torch.stack(encoded[:len(pose_videos)])
+                ref_latents = encoded[len(pose_videos)]
+                if reft_pixel_values is None:
+                    y_reft = self.vae.encode_constant([3, T - mask_reft_len, H, W], 0.0)
+                else:
+                    y_reft = encoded[-1]
+
+                y_ref = torch.concat([mask_ref, ref_latents]).to(dtype=torch.bfloat16, device=self.device)
+
                 y_reft = torch.concat([msk_reft, y_reft]).to(dtype=torch.bfloat16, device=self.device)
                 y = torch.concat([y_ref, y_reft], dim=1)
 
@@ -622,6 +669,12 @@ class WanAnimate:
                     else:
                         noise_pred = noise_pred_cond
 
+                    if callback is not None and (i + 1) % callback_steps == 0:
+                        # flow matching, x_t = (1 - sigma) * x_0 + sigma * noise
+                        callback(
+                            i, t, (latents[0] - t / self.num_train_timesteps *
+                                   noise_pred[0])[:, 1:])
+
                     temp_x0 = sample_scheduler.step(
                         noise_pred[0].unsqueeze(0),
                         t,
@@ -634,15 +687,24 @@ class WanAnimate:
                     x0 = latents
 
                 x0 = [x.to(dtype=torch.float32) for x in x0]
-                out_frames = torch.stack(self.vae.decode([x0[0][:, 1:]]))
+                if self.sp_size > 1:
+                    # latents are identical on all ranks, share the decode
+                    # among them
+                    out_frames = torch.stack(
+                        distributed_decode(self.vae, [x0[0][:, 1:]], dst=None))
+                else:
+                    out_frames = torch.stack(self.vae.decode([x0[0][:, 1:]]))
                 
                 if start != 0:
                     out_frames = out_frames[:, :, refert_num:]
 
-                all_out_frames.append(out_frames.cpu())
+                all_out_frames.append(
+                    self.offload_pool.to_host(out_frames, stage='frames'))
 
                 start += clip_len - refert_num
                 end += clip_len - refert_num
 
+        self.offload_pool.synchronize()
+        self.offload_pool.log_stats()
         videos = torch.cat(all_out_frames, dim=2)[:, :, :real_frame_len]
         return videos[0] if self.rank == 0 else None
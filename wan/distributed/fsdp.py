@@ -18,7 +18,8 @@ def shard_model(
     process_group=None,
     sharding_strategy=ShardingStrategy.FULL_SHARD,
     sync_module_states=True,
-    use_lora=False
+    use_lora=False,
+    param_init_fn=None,
 ):
     model = FSDP(
         module=model,
@@ -32,6 +33,7 @@ def shard_model(
             buffer_dtype=buffer_dtype),
         device_id=device_id,
         sync_module_states=sync_module_states,
+        param_init_fn=param_init_fn,
         use_orig_params=True if use_lora else False)
     return model
 
@@ -0,0 +1,259 @@
+# Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
+"""
+Pre-sharded per-rank checkpoints for FSDP.
+
+`write_fsdp_shards` flattens every FSDP unit of a DiT (the root module and each
+block in `model.blocks`, matching the wrap policy of `shard_model`) exactly the
+way FSDP builds its `FlatParameter`, and writes the slice owned by every rank
+to its own file. `load_sharded_model` wraps an empty (meta) model with FSDP and
+copies only the local slice into each flat parameter, so every rank reads 1/N
+of the weights and no `sync_module_states` broadcast is needed.
+
+Usage:
+    python -m wan.distributed.sharded_checkpoint \
+        --ckpt_dir ./Wan2.2-T2V-A14B --subfolder low_noise_model --world_size 8
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import sys
+from functools import partial
+
+import torch
+import torch.distributed as dist
+
+__all__ = [
+    'find_fsdp_shards',
+    'init_empty_model',
+    'load_sharded_model',
+    'write_fsdp_shards',
+]
+
+SHARD_DIR = 'fsdp_shards'
+META_FILE = 'meta.json'
+
+
+def _shard_dir(model_dir, world_size):
+    return os.path.join(model_dir, SHARD_DIR, f'world_size_{world_size}')
+
+
+def _shard_file(shard_dir, rank):
+    return os.path.join(shard_dir, f'rank_{rank:05d}.pt')
+
+
+def _fsdp_units(model):
+    """
+    Returns `(name, module, params)` for every FSDP unit in wrapping order.
+    Params follow `module.named_parameters()` order with the parameters of
+    nested units removed, which is how FSDP orders a `FlatParameter`.
+    """
+    root_params = [(n, p)
+                   for n, p in model.named_parameters()
+                   if not n.startswith('blocks.')]
+    units = [('', model, root_params)]
+    units += [(f'blocks.{i}', block, list(block.named_parameters()))
+              for i, block in enumerate(model.blocks)]
+    return units
+
+
+def write_fsdp_shards(model, model_dir, world_size, dtype=None):
+    """
+    Writes per-rank FSDP flat-parameter shards of `model` for `world_size`.
+
+    Args:
+        model (torch.nn.Module):
+            Fully loaded model with a `blocks` ModuleList.
+        model_dir (`str`):
+            Model directory, shards go to `<model_dir>/fsdp_shards/world_size_<N>`.
+        world_size (`int`):
+            Number of ranks the shards are written for.
+        dtype (torch.dtype, *optional*, defaults to None):
+            Storage dtype. Keep the parameter dtype if None.
+
+    Returns:
+        `str`: The directory containing the shards.
+    """
+    out_dir = _shard_dir(model_dir, world_size)
+    os.makedirs(out_dir, exist_ok=True)
+
+    meta = {'world_size': world_size, 'units': {}}
+    shards = [{} for _ in range(world_size)]
+    for name, _, params in _fsdp_units(model):
+        flat = torch.cat([p.detach().reshape(-1) for _, p in params])
+        if dtype is not None:
+            flat = flat.to(dtype)
+        chunk = math.ceil(flat.numel() / world_size)
+        for rank in range(world_size):
+            shard = flat[rank * chunk:(rank + 1) * chunk]
+            if shard.numel() < chunk:
+                shard = torch.cat(
+                    [shard, shard.new_zeros(chunk - shard.numel())])
+            shards[rank][name] = shard.clone()
+        meta['units'][name] = {
+            'fqns': [n for n, _ in params],
+            'numel': flat.numel(),
+        }
+
+    for rank, shard in enumerate(shards):
+        logging.info(f'writing {_shard_file(out_dir, rank)}')
+        torch.save(shard, _shard_file(out_dir, rank))
+    with open(os.path.join(out_dir, META_FILE), 'w') as f:
+        json.dump(meta, f)
+    return out_dir
+
+
+def find_fsdp_shards(model_dir, world_size=None):
+    """
+    Returns the shard directory for `world_size` under `model_dir`, or None
+    if no complete set of shards was written for it.
+    """
+    if world_size is None:
+        if not dist.is_initialized():
+            return None
+        world_size = dist.get_world_size()
+    shard_dir = _shard_dir(model_dir, world_size)
+    if not os.path.isfile(os.path.join(shard_dir, META_FILE)):
+        return None
+    return shard_dir
+
+
+def init_empty_model(model_cls, checkpoint_dir, subfolder=None, dtype=None):
+    """
+    Builds `model_cls` from its config with parameters on the meta device.
+    """
+    from accelerate import init_empty_weights
+
+    config = model_cls.load_config(checkpoint_dir, subfolder=subfolder)
+    with init_empty_weights():
+        model = model_cls.from_config(config)
+    if dtype is not None:
+        model.to(dtype)
+    return model
+
+
+def _clean_name(name):
+    return name.replace('_fsdp_wrapped_module.',
+                        '').replace('._fsdp_wrapped_module',
+                                    '').replace('_fsdp_wrapped_module', '')
+
+
+def load_sharded_model(model, shard_dir, shard_fn, device_id):
+    """
+    Wraps an empty model with FSDP and loads the local shard of every unit.
+
+    Args:
+        model (torch.nn.Module):
+            Model built by `init_empty_model`.
+        shard_dir (`str`):
+            Directory returned by `find_fsdp_shards`.
+        shard_fn (callable):
+            The function to apply FSDP sharding.
+        device_id (`int`):
+            Id of target GPU device.
+
+    Returns:
+        torch.nn.Module:
+            The FSDP-wrapped model holding the local shards.
+    """
+    from torch.distributed.fsdp import FullyShardedDataParallel as FSDP
+
+    rank = dist.get_rank()
+    with open(os.path.join(shard_dir, META_FILE)) as f:
+        meta = json.load(f)
+    if meta['world_size'] != dist.get_world_size():
+        raise ValueError(
+            f"shards in {shard_dir} are for world size {meta['world_size']}, "
+            f"got {dist.get_world_size()}")
+
+    device = torch.device(f'cuda:{device_id}')
+    model = shard_fn(
+        model,
+        sync_module_states=False,
+        param_init_fn=partial(_materialize, device=device))
+
+    try:
+        shards = torch.load(
+            _shard_file(shard_dir, rank), map_location='cpu', mmap=True)
+    except TypeError:
+        shards = torch.load(_shard_file(shard_dir, rank), map_location='cpu')
+
+    for name, module in model.named_modules():
+        if not isinstance(module, FSDP) or module._handle is None:
+            continue
+        name = _clean_name(name)
+        flat_param = module._handle.flat_param
+        unit = meta['units'].get(name)
+        fqns = getattr(flat_param, '_fqns', None)
+        if unit is None or (fqns is not None and
+                            [_clean_name(n) for n in fqns] != unit['fqns']):
+            raise ValueError(
+                f"FSDP unit '{name}' does not match the shards in {shard_dir}")
+        shard = shards[name]
+        if shard.numel() != flat_param.numel():
+            raise ValueError(
+                f"FSDP unit '{name}' expects {flat_param.numel()} elements, "
+                f"shard has {shard.numel()}")
+        flat_param.data.copy_(shard)
+    del shards
+    return model
+
+
+def _materialize(module, device):
+    module.to_empty(device=device, recurse=False)
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(
+        description="Write per-rank FSDP shards of a Wan DiT checkpoint")
+    parser.add_argument(
+        "--ckpt_dir",
+        type=str,
+        required=True,
+        help="The path to the checkpoint directory.")
+    parser.add_argument(
+        "--subfolder",
+        type=str,
+        default=None,
+        help="Model subfolder, e.g. low_noise_model or high_noise_model.")
+    parser.add_argument(
+        "--model_type",
+        type=str,
+        default="wan",
+        choices=["wan", "s2v", "animate"],
+        help="The DiT class stored in the checkpoint.")
+    parser.add_argument(
+        "--world_size",
+        type=int,
+        required=True,
+        help="Number of ranks to write shards for.")
+    parser.add_argument(
+        "--dtype",
+        type=str,
+        default=None,
+        choices=["bfloat16", "float16", "float32"],
+        help="Storage dtype of the shards.")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="[%(asctime)s] %(levelname)s: %(message)s",
+        handlers=[logging.StreamHandler(stream=sys.stdout)])
+    args = _parse_args()
+
+    if args.model_type == "s2v":
+        from ..modules.s2v.model_s2v import WanModel_S2V as model_cls
+    elif args.model_type == "animate":
+        from ..modules.animate import WanAnimateModel as model_cls
+    else:
+        from ..modules.model import WanModel as model_cls
+
+    dtype = getattr(torch, args.dtype) if args.dtype else None
+    model = model_cls.from_pretrained(
+        args.ckpt_dir, subfolder=args.subfolder, torch_dtype=dtype)
+    model_dir = os.path.join(args.ckpt_dir, args.subfolder or '')
+    out_dir = write_fsdp_shards(model, model_dir, args.world_size, dtype)
+    logging.info(f"Finished writing shards to {out_dir}")
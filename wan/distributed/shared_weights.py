@@ -0,0 +1,210 @@
+# Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
+"""
+Node-local shared-memory store for host copies of model weights.
+
+Co-located workers (torchrun ranks, Ray tasks) that keep models on the CPU
+between offloads each hold a private copy of the same weights. `SharedWeightStore`
+writes the parameters and buffers of a module once into a file under
+`/dev/shm` and maps it into every worker, so all of them share one physical
+copy. The mapping is optionally registered as pinned memory, and
+`PinnedMemoryPool` then copies to the GPU straight from it.
+
+The shared tensors are read-only by contract: modifying them in one worker
+changes the weights of all workers on the node.
+
+The files take as much memory as the weights on the host, e.g. over 100 GB
+for the two A14B experts and T5 in float32, and outlive the workers until
+removed with `SharedWeightStore.clear`. `generate.py` removes them when it
+finishes unless `--keep_shared_weights` is given, in which case later runs
+attach without loading the checkpoints. They are keyed on the sizes and
+modification times of the loaded weight files, a changed checkpoint replaces
+the files of the old one.
+"""
+import fcntl
+import fnmatch
+import glob
+import hashlib
+import json
+import logging
+import os
+
+import torch
+
+__all__ = ['SharedWeightStore']
+
+ALIGNMENT = 64
+
+# the files `from_pretrained` reads from a model directory
+WEIGHT_FILES = ['config.json', 'diffusion_pytorch_model*']
+
+
+def _dtype_name(dtype):
+    return str(dtype).replace('torch.', '')
+
+
+def _module_tensors(module):
+    tensors = list(module.named_parameters()) + list(module.named_buffers())
+    return [(name, t) for name, t in tensors if t is not None]
+
+
+def _checkpoint_stamp(path):
+    """
+    Sizes and modification times of a checkpoint file or of the weight files
+    of a model directory, so that the weights are rewritten when the
+    checkpoint changes. Subdirectories, e.g. other models or FSDP shards, are
+    not part of the weights.
+    """
+    if os.path.isfile(path):
+        files = [path]
+    else:
+        files = sorted(
+            os.path.join(path, name)
+            for name in os.listdir(path)
+            if any(fnmatch.fnmatch(name, p) for p in WEIGHT_FILES) and
+            os.path.isfile(os.path.join(path, name)))
+    stamp = []
+    for name in files:
+        st = os.stat(name)
+        stamp.append((os.path.relpath(name, path), st.st_size, st.st_mtime_ns))
+    return stamp
+
+
+class SharedWeightStore:
+
+    def __init__(self, root='/dev/shm/wan_weights', pin=True):
+        r"""
+        Args:
+            root (`str`, *optional*, defaults to '/dev/shm/wan_weights'):
+                Directory holding the shared weight files, should be on tmpfs.
+            pin (`bool`, *optional*, defaults to True):
+                Register the mappings as pinned memory with CUDA.
+        """
+        self.root = root
+        self.pin = pin and torch.cuda.is_available()
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key, tensors):
+        signature = [key, _checkpoint_stamp(key)] + [
+            (name, _dtype_name(t.dtype), list(t.shape)) for name, t in tensors
+        ]
+        digest = hashlib.sha1(json.dumps(signature).encode()).hexdigest()
+        return os.path.join(self.root, digest[:16])
+
+    @staticmethod
+    def _layout(tensors):
+        index, offset = [], 0
+        for name, t in tensors:
+            nbytes = t.numel() * t.element_size()
+            index.append({
+                'name': name,
+                'dtype': _dtype_name(t.dtype),
+                'shape': list(t.shape),
+                'offset': offset,
+                'nbytes': nbytes,
+            })
+            offset += (nbytes + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+        return index, max(offset, ALIGNMENT)
+
+    def _remove(self, path):
+        for name in [path, f'{path}.json', f'{path}.lock']:
+            try:
+                os.remove(name)
+            except FileNotFoundError:
+                pass
+
+    def _remove_stale(self, key, path):
+        """
+        Removes the files of earlier versions of the weights of `key`. Workers
+        that still map them keep their memory until they exit.
+        """
+        for meta_path in glob.glob(os.path.join(self.root, '*.json')):
+            other = meta_path[:-len('.json')]
+            if other == path:
+                continue
+            try:
+                with open(meta_path) as f:
+                    stale = json.load(f).get('key') == key
+            except (OSError, ValueError):
+                continue
+            if stale:
+                logging.info(f"Removing outdated shared weights {other}")
+                self._remove(other)
+
+    def clear(self):
+        """
+        Removes all shared weight files. Workers that still map them keep
+        their memory until they exit.
+        """
+        for path in glob.glob(os.path.join(self.root, '*')):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        logging.info(f"Cleared the shared weights under {self.root}")
+
+    def _write(self, path, key, tensors):
+        index, total = self._layout(tensors)
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as f:
+            f.truncate(total)
+        buf = torch.from_file(tmp, shared=True, size=total, dtype=torch.uint8)
+        for entry, (_, t) in zip(index, tensors):
+            buf[entry['offset']:entry['offset'] + entry['nbytes']].copy_(
+                t.detach().reshape(-1).view(torch.uint8))
+        del buf
+        with open(f'{tmp}.json', 'w') as f:
+            json.dump({'key': key, 'nbytes': total, 'tensors': index}, f)
+        os.rename(f'{tmp}.json', f'{path}.json')
+        os.rename(tmp, path)
+        logging.info(f"Wrote {total / 2**30:.2f} GiB of shared weights to "
+                     f"{path}")
+
+    def _pin(self, buf):
+        ret = torch.cuda.cudart().cudaHostRegister(buf.data_ptr(),
+                                                   buf.numel(), 0)
+        if int(ret) != 0:
+            logging.warning(
+                f"cudaHostRegister failed ({ret}), shared weights are pageable")
+
+    def share(self, module, key):
+        """
+        Replaces the CPU parameters and buffers of `module` with views of the
+        node-local shared copy, writing it first if no worker has yet.
+
+        Args:
+            module (torch.nn.Module):
+                Model whose parameters and buffers are all on the CPU.
+            key (`str`):
+                Path of the checkpoint file or model directory of the
+                weights.
+
+        Returns:
+            torch.nn.Module: `module`, now backed by shared memory.
+        """
+        tensors = _module_tensors(module)
+        if any(t.device.type != 'cpu' for _, t in tensors):
+            logging.info(f"Not sharing {key}, it is not on the CPU")
+            return module
+        path = self._path(key, tensors)
+
+        with open(f'{path}.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if not os.path.exists(path):
+                self._write(path, key, tensors)
+                self._remove_stale(key, path)
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+        with open(f'{path}.json') as f:
+            meta = json.load(f)
+        buf = torch.from_file(
+            path, shared=True, size=meta['nbytes'], dtype=torch.uint8)
+        if self.pin:
+            self._pin(buf)
+        for entry, (name, t) in zip(meta['tensors'], tensors):
+            if entry['name'] != name:
+                raise ValueError(f"shared weights {path} do not match {key}")
+            view = buf[entry['offset']:entry['offset'] + entry['nbytes']]
+            t.data = view.view(getattr(torch, entry['dtype'])).view(
+                entry['shape'])
+        logging.info(f"Attached {key} to shared weights {path}")
+        return module
@@ -0,0 +1,293 @@
+# Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
+"""
+Node-local text-encoding service.
+
+One `T5Server` process holds the umt5-xxl encoder and its embedding cache for
+all pipelines on a node, which then use a `T5Client` in place of their own
+`T5EncoderModel`. Requests arrive over a local socket, the texts of requests
+arriving within `max_wait` seconds are encoded in one forward, and the
+embeddings of every request are returned in a file under `/dev/shm` that the
+client maps, copies and removes. The server removes the files of clients that
+died before reading them after `ttl` seconds.
+
+Only clients that can read the random key the server writes next to its
+socket, i.e. processes of the same user, may connect.
+
+Start the server with `python wan/utils/t5_server.py` and pass its address to
+the pipelines, e.g. `generate.py --t5_server /tmp/wan_t5.sock`.
+"""
+import glob
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+from multiprocessing.connection import Client, Listener
+
+import torch
+
+__all__ = ['T5Client', 'T5Server']
+
+ALIGNMENT = 64
+
+
+def _dtype_name(dtype):
+    return str(dtype).replace('torch.', '')
+
+
+def _write_embeddings(root, tensors):
+    """
+    Writes `tensors` to one new file under `root`.
+
+    Returns:
+        `dict`: The path, total size and per-tensor layout of the file.
+    """
+    index, offset = [], 0
+    for t in tensors:
+        nbytes = t.numel() * t.element_size()
+        index.append({
+            'dtype': _dtype_name(t.dtype),
+            'shape': list(t.shape),
+            'offset': offset,
+            'nbytes': nbytes,
+        })
+        offset += (nbytes + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+    total = max(offset, ALIGNMENT)
+
+    path = os.path.join(root, uuid.uuid4().hex)
+    with open(path, 'wb') as f:
+        f.truncate(total)
+    buf = torch.from_file(path, shared=True, size=total, dtype=torch.uint8)
+    for entry, t in zip(index, tensors):
+        buf[entry['offset']:entry['offset'] + entry['nbytes']].copy_(
+            t.detach().cpu().contiguous().reshape(-1).view(torch.uint8))
+    return {'path': path, 'nbytes': total, 'tensors': index}
+
+
+def _key_path(address):
+    return f'{address}.key'
+
+
+def _read_authkey(address):
+    with open(_key_path(address), 'rb') as f:
+        return f.read()
+
+
+def _read_embeddings(meta):
+    """
+    Copies the tensors written by `_write_embeddings` and removes the file.
+    """
+    try:
+        buf = torch.from_file(
+            meta['path'], shared=True, size=meta['nbytes'], dtype=torch.uint8)
+        return [
+            buf[e['offset']:e['offset'] + e['nbytes']].view(
+                getattr(torch, e['dtype'])).view(e['shape']).clone()
+            for e in meta['tensors']
+        ]
+    finally:
+        os.remove(meta['path'])
+
+
+class T5Server:
+
+    def __init__(self,
+                 text_encoder,
+                 device,
+                 address='/tmp/wan_t5.sock',
+                 authkey=None,
+                 max_batch=16,
+                 max_wait=0.01,
+                 root='/dev/shm/wan_t5',
+                 ttl=600):
+        r"""
+        Args:
+            text_encoder (`wan.modules.t5.T5EncoderModel`):
+                The encoder, on `device`.
+            device (`torch.device`):
+                Device to encode on.
+            address (`str`, *optional*, defaults to '/tmp/wan_t5.sock'):
+                Unix socket the clients connect to.
+            authkey (`bytes`, *optional*, defaults to None):
+                Shared secret of server and clients. By default a random key,
+                written to `address + '.key'` readable by the owner only.
+            max_batch (`int`, *optional*, defaults to 16):
+                Maximum number of texts encoded in one forward.
+            max_wait (`float`, *optional*, defaults to 0.01):
+                Seconds to wait for further requests to batch with.
+            root (`str`, *optional*, defaults to '/dev/shm/wan_t5'):
+                Directory of the returned embeddings, should be on tmpfs.
+            ttl (`float`, *optional*, defaults to 600):
+                Seconds after which unread embedding files are removed.
+        """
+        self.text_encoder = text_encoder
+        self.device = device
+        self.address = address
+        self.authkey = authkey
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.root = root
+        self.ttl = ttl
+        self._requests = queue.Queue()
+        os.makedirs(root, exist_ok=True)
+
+    def _next_batch(self):
+        batch = [self._requests.get()]
+        num_texts = len(batch[0][0])
+        deadline = time.monotonic() + self.max_wait
+        while num_texts < self.max_batch:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self._requests.get(timeout=timeout))
+            except queue.Empty:
+                break
+            num_texts += len(batch[-1][0])
+        return batch
+
+    @torch.no_grad()
+    def _encode_loop(self):
+        while True:
+            batch = self._next_batch()
+            texts = [u for request, _ in batch for u in request]
+            try:
+                context = self.text_encoder(texts, self.device)
+            except Exception as e:
+                logging.exception("Encoding failed")
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            logging.info(f"Encoded {len(texts)} texts of {len(batch)} "
+                         f"requests")
+            start = 0
+            for request, future in batch:
+                try:
+                    future.set_result(
+                        _write_embeddings(self.root,
+                                          context[start:start + len(request)]))
+                except Exception as e:
+                    logging.exception("Writing the embeddings failed")
+                    future.set_exception(e)
+                start += len(request)
+
+    def _cleanup_loop(self):
+        while True:
+            time.sleep(self.ttl / 2)
+            self._remove_files(time.time() - self.ttl)
+
+    def _remove_files(self, before=None):
+        """
+        Removes the embedding files last modified before `before`, all of
+        them if None.
+        """
+        for path in glob.glob(os.path.join(self.root, '*')):
+            try:
+                if before is None or os.path.getmtime(path) < before:
+                    os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _serve(self, conn):
+        with conn:
+            while True:
+                try:
+                    texts = conn.recv()
+                except EOFError:
+                    return
+                future = Future()
+                self._requests.put((texts, future))
+                try:
+                    meta = future.result()
+                except Exception as e:
+                    conn.send(('error', repr(e)))
+                    continue
+                try:
+                    conn.send(('ok', meta))
+                except OSError:
+                    # the client is gone and will not remove the file
+                    os.remove(meta['path'])
+                    return
+
+    def serve_forever(self):
+        """
+        Accepts clients until the process is stopped.
+        """
+        if os.path.exists(self.address):
+            os.remove(self.address)
+        # files of clients of an earlier server
+        self._remove_files()
+        if self.authkey is None:
+            self.authkey = os.urandom(32)
+            fd = os.open(
+                _key_path(self.address), os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+                0o600)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(self.authkey)
+        threading.Thread(target=self._encode_loop, daemon=True).start()
+        threading.Thread(target=self._cleanup_loop, daemon=True).start()
+        with Listener(self.address, 'AF_UNIX', authkey=self.authkey) as lst:
+            os.chmod(self.address, 0o600)
+            logging.info(f"Serving T5 on {self.address}")
+            while True:
+                conn = lst.accept()
+                threading.Thread(
+                    target=self._serve, args=(conn,), daemon=True).start()
+
+
+class T5Client:
+
+    def __init__(self, address='/tmp/wan_t5.sock', authkey=None):
+        r"""
+        Stands in for `T5EncoderModel` in the pipelines.
+
+        Args:
+            address (`str`, *optional*, defaults to '/tmp/wan_t5.sock'):
+                Unix socket of the `T5Server`.
+            authkey (`bytes`, *optional*, defaults to None):
+                Shared secret of server and clients, read from
+                `address + '.key'` by default.
+        """
+        self.address = address
+        self.authkey = authkey
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _close(self):
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except OSError:
+                pass
+            self._conn = None
+
+    def __call__(self, texts, device):
+        """
+        Encodes `texts` on the server, reconnecting once if the connection
+        is lost.
+
+        Returns:
+            `list[torch.Tensor]`: The trimmed embedding of every text.
+        """
+        with self._lock:
+            for attempt in range(2):
+                try:
+                    if self._conn is None:
+                        self._conn = Client(
+                            self.address,
+                            'AF_UNIX',
+                            authkey=self.authkey or
+                            _read_authkey(self.address))
+                    self._conn.send(list(texts))
+                    status, result = self._conn.recv()
+                    break
+                except (OSError, EOFError):
+                    # e.g. the server restarted, reconnect once
+                    self._close()
+                    if attempt > 0:
+                        raise
+        if status != 'ok':
+            raise RuntimeError(f"T5 server failed to encode: {result}")
+        return [u.to(device) for u in _read_embeddings(result)]
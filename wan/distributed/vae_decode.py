@@ -0,0 +1,253 @@
+# Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
+"""
+VAE decode spread over all ranks.
+
+Every rank holds the same latents after sampling. By default each latent is
+split into height bands, one per rank, and every rank runs the decoder on its
+own band only. The band edges are exchanged with the neighbouring ranks
+before every convolution that reads across them (the rows of the causal
+cache included), and each attention block sees the whole frame, so the
+decoded bands are exactly the rows of `vae.decode`. If tiling is enabled with
+`enable_tiling`, the tiles are spread over the ranks instead and blended as in
+the single-rank tiled decode. Works with any backend, including gloo on CPU.
+"""
+import math
+
+import torch
+import torch.distributed as dist
+import torch.nn as nn
+import torch.nn.functional as F
+
+from ..modules.vae2_1 import AttentionBlock as AttentionBlock2_1
+from ..modules.vae2_2 import AttentionBlock as AttentionBlock2_2
+from ..modules.vae_tiling import TileBlender, plan_tiles
+
+__all__ = ['distributed_decode', 'distributed_decode_clip']
+
+
+def _gather(tensor, dst, group):
+    """
+    Gathers equally shaped tensors to `dst`, or to all ranks if `dst` is None.
+    Returns the list on the receiving ranks and None on the others.
+    """
+    world_size = dist.get_world_size(group)
+    if dst is None:
+        gathered = [torch.empty_like(tensor) for _ in range(world_size)]
+        dist.all_gather(gathered, tensor.contiguous(), group=group)
+        return gathered
+    is_dst = dist.get_rank() == dst
+    gathered = [torch.empty_like(tensor) for _ in range(world_size)
+               ] if is_dst else None
+    dist.gather(tensor.contiguous(), gathered, dst=dst, group=group)
+    return gathered
+
+
+class _BandHalo:
+    """
+    Forward hooks on a VAE decoder that let each rank decode only its band of
+    latent rows, `rows[r]` rows for rank r, top to bottom.
+
+    Convolutions padding p > 0 rows get the p edge rows of the neighbouring
+    bands appended before and the matching output rows cropped after, so the
+    kernel sees the same inputs as on the full frame. All other decoder ops
+    but attention are row-local. Attention blocks get the whole frame
+    gathered before and return the own rows after.
+    """
+
+    def __init__(self, decoder, rows, group):
+        self.decoder = decoder
+        self.rows = rows
+        self.group = group
+        self.rank = dist.get_rank(group)
+        self.ranks = [
+            r if group is None else dist.get_global_rank(group, r)
+            for r in range(len(rows))
+        ]
+        self._crops = {}
+        self._handles = []
+
+    def __enter__(self):
+        for m in self.decoder.modules():
+            if isinstance(m, (AttentionBlock2_1, AttentionBlock2_2)):
+                pre, post = self._attn_pre_hook, self._attn_post_hook
+            elif isinstance(m, (nn.Conv2d, nn.Conv3d)) and self._pad(m) > 0:
+                assert m.stride[-2] == 1, "strided convolutions are not split"
+                pre, post = self._conv_pre_hook, self._conv_post_hook
+            else:
+                continue
+            self._handles += [
+                m.register_forward_pre_hook(pre),
+                m.register_forward_hook(post)
+            ]
+        return self
+
+    def __exit__(self, *exc):
+        for handle in self._handles:
+            handle.remove()
+        self._handles = []
+        self._crops = {}
+
+    @staticmethod
+    def _pad(conv):
+        # `CausalConv3d` pads in `forward` and keeps the padding in `_padding`
+        padding = getattr(conv, '_padding', None)
+        return padding[2] if padding is not None else conv.padding[-2]
+
+    def _exchange(self, x, p):
+        """
+        Extends `x` [..., H, W] by the p edge rows of the neighbouring bands,
+        returns it and the number of rows added on top and at the bottom.
+        """
+        top = bottom = None
+        sent, reqs = [], []
+        if self.rank > 0:
+            src = self.ranks[self.rank - 1]
+            top = x.new_empty(*x.shape[:-2], p, x.shape[-1])
+            sent.append(x[..., :p, :].contiguous())
+            reqs += [
+                dist.isend(sent[-1], src, group=self.group),
+                dist.irecv(top, src, group=self.group)
+            ]
+        if self.rank < len(self.rows) - 1:
+            src = self.ranks[self.rank + 1]
+            bottom = x.new_empty(*x.shape[:-2], p, x.shape[-1])
+            sent.append(x[..., -p:, :].contiguous())
+            reqs += [
+                dist.isend(sent[-1], src, group=self.group),
+                dist.irecv(bottom, src, group=self.group)
+            ]
+        for req in reqs:
+            req.wait()
+        parts = [t for t in (top, x, bottom) if t is not None]
+        added = (0 if top is None else p, 0 if bottom is None else p)
+        return torch.cat(parts, dim=-2), added
+
+    def _conv_pre_hook(self, module, args):
+        x, *rest = args
+        p = self._pad(module)
+        cache_x = rest[0] if rest else None
+        if isinstance(cache_x, torch.Tensor) and module._padding[4] > 0:
+            # the cached frames are read across the band edges as well
+            t = cache_x.shape[2]
+            x, added = self._exchange(
+                torch.cat([cache_x.to(x.device), x], dim=2), p)
+            rest = [x[:, :, :t]] + rest[1:]
+            x = x[:, :, t:]
+        else:
+            x, added = self._exchange(x, p)
+        self._crops[module] = added
+        return (x, *rest)
+
+    def _conv_post_hook(self, module, args, out):
+        top, bottom = self._crops.pop(module)
+        return out[..., top:out.shape[-2] - bottom, :]
+
+    def _attn_pre_hook(self, module, args):
+        x, = args
+        # the decoder upsamples all bands by the same factor
+        factor = x.shape[-2] // self.rows[self.rank]
+        sizes = [n * factor for n in self.rows]
+        gathered = _gather(
+            F.pad(x, (0, 0, 0, max(sizes) - x.shape[-2])), None, self.group)
+        offset = sum(sizes[:self.rank])
+        self._crops[module] = (offset, offset + sizes[self.rank])
+        return (torch.cat([g[..., :n, :] for g, n in zip(gathered, sizes)],
+                          dim=-2),)
+
+    def _attn_post_hook(self, module, args, out):
+        start, end = self._crops.pop(module)
+        return out[..., start:end, :]
+
+
+def _band_decode(vae, z, dst, group, state=None):
+    world_size = dist.get_world_size(group)
+    h = z.shape[-2]
+    if h < world_size:
+        # too few rows to give every rank a band
+        with vae.autocast():
+            video = vae.model.decode(z[None], vae.scale,
+                                     state).float().clamp_(-1, 1)[0]
+        return video if dst is None or dist.get_rank() == dst else None
+
+    rank = dist.get_rank(group)
+    bounds = [h * r // world_size for r in range(world_size + 1)]
+    rows = [end - start for start, end in zip(bounds, bounds[1:])]
+    with _BandHalo(vae.model.decoder, rows, group), vae.autocast():
+        band = vae.model.decode(z[None, ..., bounds[rank]:bounds[rank + 1], :],
+                                vae.scale, state).float().clamp_(-1, 1)[0]
+
+    stride = band.shape[-2] // rows[rank]
+    gathered = _gather(
+        F.pad(band, (0, 0, 0, (max(rows) - rows[rank]) * stride)), dst, group)
+    if gathered is None:
+        return None
+    return torch.cat([g[..., :n * stride, :] for g, n in zip(gathered, rows)],
+                     dim=-2)
+
+
+def _tiled_decode(vae, z, dst, group):
+    rank = dist.get_rank(group)
+    world_size = dist.get_world_size(group)
+    h, w = z.shape[-2:]
+    tile_size = vae.tiling['tile_size']
+    tile_overlap = vae.tiling['tile_overlap']
+    tiles, th, tw = plan_tiles(h, w, tile_size, tile_overlap)
+
+    # round-robin the tiles, ranks short of tiles repeat their last one so all
+    # ranks send equally shaped tensors
+    per_rank = math.ceil(len(tiles) / world_size)
+    mine = tiles[rank::world_size] or tiles[-1:]
+    mine += mine[-1:] * (per_rank - len(mine))
+    with vae.autocast():
+        local = torch.cat([
+            vae.model.decode(z[None, ..., y:y + th, x:x + tw],
+                             vae.scale).float() for y, x in mine
+        ])
+
+    gathered = _gather(local, dst, group)
+    del local
+    if gathered is None:
+        return None
+    blender = TileBlender(h, w, th, tw, tile_overlap, vae.spatial_stride)
+    for r in range(world_size):
+        for i, (y, x) in enumerate(tiles[r::world_size]):
+            blender.add(gathered[r][i:i + 1], y, x)
+    return blender.result().clamp_(-1, 1).squeeze(0)
+
+
+@torch.no_grad()
+def distributed_decode(vae, zs, dst=0, group=None):
+    """
+    Decodes a list of latents [C, T, H, W] on all ranks of `group`.
+
+    Args:
+        vae (`Wan2_1_VAE` or `Wan2_2_VAE`):
+            The VAE wrapper, identical on all ranks.
+        zs (`list[torch.Tensor]`):
+            Latents, identical on all ranks.
+        dst (`int`, *optional*, defaults to 0):
+            Global rank receiving the decoded videos, all ranks if None.
+        group (ProcessGroup, *optional*, defaults to None):
+            Process group, the default group if None.
+
+    Returns:
+        `list[torch.Tensor]` on the receiving ranks, None on the others.
+    """
+    decode = _band_decode if vae.tiling is None else _tiled_decode
+    videos = [decode(vae, z, dst, group) for z in zs]
+    return videos if dst is None or dist.get_rank() == dst else None
+
+
+@torch.no_grad()
+def distributed_decode_clip(vae, z, state, group=None):
+    """
+    `vae.decode_clip` on all ranks of `group`: decodes the latent [C, T, H, W]
+    of one clip of a long video in height bands, continuing the causal cache
+    of the own band in `state` (a `CausalState`, updated in place). Each rank
+    keeps the cache of its band, so `state` must not be shared between ranks.
+
+    Returns:
+        `torch.Tensor` of the clip on all ranks.
+    """
+    assert vae.tiling is None, "clip-wise decoding does not tile"
+    return _band_decode(vae, z, None, group, state)
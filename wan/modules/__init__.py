@@ -1,10 +1,27 @@
 # Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
-from .attention import flash_attention
-from .model import WanModel
-from .t5 import T5Decoder, T5Encoder, T5EncoderModel, T5Model
-from .tokenizers import HuggingfaceTokenizer
-from .vae2_1 import Wan2_1_VAE
-from .vae2_2 import Wan2_2_VAE
+import importlib
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .attention import flash_attention
+    from .model import WanModel
+    from .t5 import T5Decoder, T5Encoder, T5EncoderModel, T5Model
+    from .tokenizers import HuggingfaceTokenizer
+    from .vae2_1 import Wan2_1_VAE
+    from .vae2_2 import Wan2_2_VAE
+
+# Submodules are imported on first attribute access.
+_LAZY_ATTRS = {
+    'Wan2_1_VAE': '.vae2_1',
+    'Wan2_2_VAE': '.vae2_2',
+    'WanModel': '.model',
+    'T5Model': '.t5',
+    'T5Encoder': '.t5',
+    'T5Decoder': '.t5',
+    'T5EncoderModel': '.t5',
+    'HuggingfaceTokenizer': '.tokenizers',
+    'flash_attention': '.attention',
+}
 
 __all__ = [
     'Wan2_1_VAE',
@@ -17,3 +34,15 @@ __all__ = [
     'HuggingfaceTokenizer',
     'flash_attention',
 ]
+
+
+def __getattr__(name):
+    if name not in _LAZY_ATTRS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_LAZY_ATTRS[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY_ATTRS))
@@ -7,6 +7,7 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 
+from .t5_cache import EmbeddingCache, checkpoint_digest
 from .tokenizers import HuggingfaceTokenizer
 
 __all__ = [
@@ -24,6 +25,18 @@ def fp16_clamp(x):
     return x
 
 
+def mask_bias(mask, dtype):
+    """
+    Additive attention bias [B, 1, 1, L2] or [B, 1, L1, L2] of a 0/1 `mask`
+    [B, L2] or [B, L1, L2].
+    """
+    mask = mask.view(mask.size(0), 1, 1,
+                     -1) if mask.ndim == 2 else mask.unsqueeze(1)
+    return torch.zeros(
+        mask.shape, dtype=dtype, device=mask.device).masked_fill_(
+            mask == 0, torch.finfo(dtype).min)
+
+
 def init_weights(m):
     if isinstance(m, T5LayerNorm):
         nn.init.ones_(m.weight)
@@ -67,6 +80,8 @@ class T5LayerNorm(nn.Module):
 
 
 class T5Attention(nn.Module):
+    # scaled_dot_product_attention, False selects the einsum reference
+    use_sdpa = True
 
     def __init__(self, dim, dim_attn, num_heads, dropout=0.1):
         assert dim_attn % num_heads == 0
@@ -98,20 +113,38 @@ class T5Attention(nn.Module):
         k = self.k(context).view(b, -1, n, c)
         v = self.v(context).view(b, -1, n, c)
 
-        # attention bias
-        attn_bias = x.new_zeros(b, n, q.size(1), k.size(1))
-        if pos_bias is not None:
-            attn_bias += pos_bias
         if mask is not None:
             assert mask.ndim in [2, 3]
-            mask = mask.view(b, 1, 1,
-                             -1) if mask.ndim == 2 else mask.unsqueeze(1)
-            attn_bias.masked_fill_(mask == 0, torch.finfo(x.dtype).min)
 
-        # compute attention (T5 does not use scaling)
-        attn = torch.einsum('binc,bjnc->bnij', q, k) + attn_bias
-        attn = F.softmax(attn.float(), dim=-1).type_as(attn)
-        x = torch.einsum('bnij,bjnc->binc', attn, v)
+        if self.use_sdpa:
+            # additive bias broadcast over batch and heads, T5 does not use
+            # scaling
+            bias = None if pos_bias is None else pos_bias.to(q.dtype)
+            if mask is not None:
+                bias = mask_bias(mask, q.dtype) if bias is None else (
+                    bias + mask_bias(mask, q.dtype))
+            x = F.scaled_dot_product_attention(
+                q.transpose(1, 2),
+                k.transpose(1, 2),
+                v.transpose(1, 2),
+                attn_mask=bias,
+                scale=1.0).transpose(1, 2)
+        else:
+            if mask is not None:
+                mask = mask.view(b, 1, 1,
+                                 -1) if mask.ndim == 2 else mask.unsqueeze(1)
+
+            # attention bias
+            attn_bias = x.new_zeros(b, n, q.size(1), k.size(1))
+            if pos_bias is not None:
+                attn_bias += pos_bias
+            if mask is not None:
+                attn_bias.masked_fill_(mask == 0, torch.finfo(x.dtype).min)
+
+            # compute attention (T5 does not use scaling)
+            attn = torch.einsum('binc,bjnc->bnij', q, k) + attn_bias
+            attn = F.softmax(attn.float(), dim=-1).type_as(attn)
+            x = torch.einsum('bnij,bjnc->binc', attn, v)
 
         # output
         x = x.reshape(b, -1, n * c)
@@ -167,9 +200,15 @@ class T5SelfAttention(nn.Module):
         self.pos_embedding = None if shared_pos else T5RelativeEmbedding(
             num_buckets, num_heads, bidirectional=True)
 
-    def forward(self, x, mask=None, pos_bias=None):
+    def forward(self, x, mask=None, pos_bias=None, attn_bias=None):
+        """
+        attn_bias:  Additive mask bias [B, 1, 1, L], added to the own position
+                    bias of the layer in place of `mask`.
+        """
         e = pos_bias if self.shared_pos else self.pos_embedding(
             x.size(1), x.size(1))
+        if attn_bias is not None:
+            e = attn_bias if e is None else e.to(attn_bias.dtype) + attn_bias
         x = fp16_clamp(x + self.attn(self.norm1(x), mask=mask, pos_bias=e))
         x = fp16_clamp(x + self.ffn(self.norm2(x)))
         return x
@@ -219,6 +258,8 @@ class T5CrossAttention(nn.Module):
 
 
 class T5RelativeEmbedding(nn.Module):
+    # number of cached (lq, lk) biases, one [1, N, Lq, Lk] tensor each
+    cache_size = 4
 
     def __init__(self, num_buckets, num_heads, bidirectional, max_dist=128):
         super(T5RelativeEmbedding, self).__init__()
@@ -230,7 +271,34 @@ class T5RelativeEmbedding(nn.Module):
         # layers
         self.embedding = nn.Embedding(num_buckets, num_heads)
 
+        # bias per (lq, lk), valid while the frozen weight stays in place
+        self._cache = {}
+        self._cache_state = None
+
     def forward(self, lq, lk):
+        weight = self.embedding.weight
+        if weight.requires_grad or not self.cache_size:
+            return self._bias(lq, lk)
+
+        # moving or updating the weight drops the old biases with it
+        state = (weight.device, weight.dtype, weight.data_ptr(),
+                 weight._version)
+        if state != self._cache_state or (
+            (lq, lk) not in self._cache and
+                len(self._cache) >= self.cache_size):
+            self._cache.clear()
+            self._cache_state = state
+        if (lq, lk) not in self._cache:
+            self._cache[(lq, lk)] = self._bias(lq, lk)
+        return self._cache[(lq, lk)]
+
+    def _apply(self, fn, *args, **kwargs):
+        # do not keep biases on the device the model is offloaded from
+        self._cache.clear()
+        self._cache_state = None
+        return super()._apply(fn, *args, **kwargs)
+
+    def _bias(self, lq, lk):
         device = self.embedding.weight.device
         # rel_pos = torch.arange(lk).unsqueeze(0).to(device) - \
         #     torch.arange(lq).unsqueeze(1).to(device)
@@ -303,10 +371,17 @@ class T5Encoder(nn.Module):
     def forward(self, ids, mask=None):
         x = self.token_embedding(ids)
         x = self.dropout(x)
-        e = self.pos_embedding(x.size(1),
-                               x.size(1)) if self.shared_pos else None
-        for block in self.blocks:
-            x = block(x, mask, pos_bias=e)
+        # the mask bias is built once per forward, and with a shared position
+        # bias combined with it once for all layers
+        bias = None if mask is None else mask_bias(mask, x.dtype)
+        if self.shared_pos:
+            e = self.pos_embedding(x.size(1), x.size(1)).to(x.dtype)
+            e = e if bias is None else e + bias
+            for block in self.blocks:
+                x = block(x, pos_bias=e)
+        else:
+            for block in self.blocks:
+                x = block(x, attn_bias=bias)
         x = self.norm(x)
         x = self.dropout(x)
         return x
@@ -479,8 +554,11 @@ class T5EncoderModel:
         checkpoint_path=None,
         tokenizer_path=None,
         shard_fn=None,
+        cache_size=64,
+        length_bucket=64,
     ):
         self.text_len = text_len
+        self.length_bucket = length_bucket
         self.dtype = dtype
         self.device = device
         self.checkpoint_path = checkpoint_path
@@ -495,19 +573,119 @@ class T5EncoderModel:
         logging.info(f'loading {checkpoint_path}')
         model.load_state_dict(torch.load(checkpoint_path, map_location='cpu'))
         self.model = model
+        self.sharded = False
         if shard_fn is not None:
-            self.model = shard_fn(self.model, sync_module_states=False)
+            self.shard(shard_fn)
         else:
             self.model.to(self.device)
         # init tokenizer
         self.tokenizer = HuggingfaceTokenizer(
             name=tokenizer_path, seq_len=text_len, clean='whitespace')
 
-    def __call__(self, texts, device):
+        # prompt embeddings, see `enable_disk_cache` for persistence
+        self.checkpoint_id = checkpoint_digest(checkpoint_path)
+        self.cache = EmbeddingCache(max_entries=cache_size)
+        self.num_threads = None
+        self.quantized = False
+
+    def shard(self, shard_fn):
+        """
+        Wraps the model with `shard_fn`, e.g. FSDP. Call it on the thread that
+        runs the collectives of the process group.
+        """
+        self.model = shard_fn(self.model, sync_module_states=False)
+        self.sharded = True
+
+    def quantize(self):
+        """
+        Converts the linear layers of the CPU model to dynamically quantized
+        int8, the blocks then run in float32 around the int8 GEMMs. The token
+        embedding and the final norm keep their precision so the embeddings
+        are returned in `dtype` as before.
+        """
+        assert not self.sharded and torch.device(self.device).type == 'cpu', \
+            "Only T5 on the CPU can be quantized"
+        if self.quantized:
+            return
+        from torch.ao.quantization import quantize_dynamic
+
+        # one block at a time, a float32 copy of the whole encoder would
+        # need twice the memory of the bf16 one
+        for block in self.model.blocks:
+            quantize_dynamic(
+                block.float(), {nn.Linear}, dtype=torch.qint8, inplace=True)
+        self.quantized = True
+        # int8 embeddings differ slightly, keep them apart in the cache
+        self.checkpoint_id = f'{self.checkpoint_id}:int8'
+        logging.info("Quantized the T5 linear layers to int8")
+
+    def set_num_threads(self, num_threads):
+        """
+        Number of threads of the CPU GEMMs while encoding, the process wide
+        setting is restored afterwards. None leaves it untouched.
+        """
+        self.num_threads = num_threads
+
+    def enable_disk_cache(self, root):
+        """
+        Backs the embedding cache with the directory `root`.
+        """
+        if self.sharded:
+            # sharded ranks must agree on every cache miss, which a store
+            # written by other processes does not guarantee
+            logging.info("Sharded T5 keeps its embedding cache in memory")
+            return
+        self.cache = EmbeddingCache(root, max_entries=self.cache.max_entries)
+
+    def _cache_key(self, text):
+        return EmbeddingCache.key(self.checkpoint_id,
+                                  self.tokenizer._clean(text), self.text_len)
+
+    def is_cached(self, texts):
+        """
+        Whether all `texts` are served from the cache without the model.
+        """
+        return all(self._cache_key(u) in self.cache for u in texts)
+
+    def _encode(self, texts, device):
         ids, mask = self.tokenizer(
             texts, return_mask=True, add_special_tokens=True)
-        ids = ids.to(device)
-        mask = mask.to(device)
         seq_lens = mask.gt(0).sum(dim=1).long()
-        context = self.model(ids, mask)
+        # run on the longest text rounded up to `length_bucket` rather than
+        # text_len, the valid tokens never attend to the padding and the
+        # relative position bias only depends on the distance
+        length = min(
+            self.text_len,
+            math.ceil(seq_lens.max().item() / self.length_bucket) *
+            self.length_bucket)
+        ids = ids[:, :length].to(device)
+        mask = mask[:, :length].to(device)
+        if self.num_threads is None or torch.device(device).type != 'cpu':
+            context = self.model(ids, mask)
+        else:
+            num_threads = torch.get_num_threads()
+            torch.set_num_threads(self.num_threads)
+            try:
+                context = self.model(ids, mask)
+            finally:
+                torch.set_num_threads(num_threads)
         return [u[:v] for u, v in zip(context, seq_lens)]
+
+    def __call__(self, texts, device):
+        """
+        Encodes all `texts`, e.g. the prompts and negative prompts of one or
+        more requests, in a single forward. Cached and repeated texts are
+        encoded only once.
+
+        Returns:
+            `list[torch.Tensor]`: The trimmed embedding of every text.
+        """
+        keys = [self._cache_key(u) for u in texts]
+        found = {k: self.cache.get(k) for k in keys}
+        missing = {k: u for k, u in zip(keys, texts) if found[k] is None}
+        if missing:
+            encoded = self._encode(list(missing.values()), device)
+            for k, u in zip(missing, encoded):
+                self.cache.put(k, u)
+                found[k] = u
+        return [found[k].to(device) for k in keys]
@@ -0,0 +1,93 @@
+# Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
+"""
+Cache of T5 prompt embeddings.
+
+Entries are keyed by the checkpoint, the cleaned prompt and the text length
+and hold the trimmed [seq_len, dim] embeddings on the CPU. An in-memory LRU
+sits in front of an optional directory with one file per entry, which
+survives restarts and is shared by all processes pointing to it.
+"""
+import hashlib
+import logging
+import os
+from collections import OrderedDict
+
+import torch
+
+__all__ = ['EmbeddingCache', 'checkpoint_digest']
+
+
+def checkpoint_digest(path, sample_bytes=1 << 20):
+    """
+    Cheap identity of a checkpoint file from its name, size and the first and
+    last `sample_bytes` bytes.
+    """
+    size = os.path.getsize(path)
+    h = hashlib.sha1(f'{os.path.basename(path)}:{size}'.encode())
+    with open(path, 'rb') as f:
+        h.update(f.read(sample_bytes))
+        f.seek(max(size - sample_bytes, 0))
+        h.update(f.read(sample_bytes))
+    return h.hexdigest()
+
+
+class EmbeddingCache:
+
+    def __init__(self, root=None, max_entries=64):
+        r"""
+        Args:
+            root (`str`, *optional*, defaults to None):
+                Directory of the on-disk store, in memory only if None.
+            max_entries (`int`, *optional*, defaults to 64):
+                Number of embeddings kept in memory.
+        """
+        self.root = root
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        if root is not None:
+            os.makedirs(root, exist_ok=True)
+
+    @staticmethod
+    def key(*fields):
+        return hashlib.sha1(repr(fields).encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.root, key[:2], f'{key}.pt')
+
+    def _remember(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get(self, key):
+        """
+        Returns the embedding stored under `key` or None.
+        """
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return self._entries[key]
+        if self.root is None or not os.path.exists(self._path(key)):
+            return None
+        try:
+            value = torch.load(self._path(key), map_location='cpu')
+        except Exception as e:
+            logging.warning(f"Ignoring unreadable embedding {key}: {e}")
+            return None
+        self._remember(key, value)
+        return value
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def put(self, key, value):
+        # a compact CPU copy, saving a view would store its whole base
+        value = value.detach().cpu().clone()
+        self._remember(key, value)
+        if self.root is not None:
+            path = self._path(key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f'{path}.{os.getpid()}.tmp'
+            torch.save(value, tmp)
+            os.replace(tmp, path)
+        return value
@@ -1,9 +1,12 @@
 # Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
 import html
 import string
+from collections import OrderedDict
+from functools import lru_cache
 
 import ftfy
 import regex as re
+import torch
 from transformers import AutoTokenizer
 
 __all__ = ['HuggingfaceTokenizer']
@@ -34,14 +37,33 @@ def canonicalize(text, keep_punctuation_exact_string=None):
     return text.strip()
 
 
+@lru_cache(maxsize=4096)
+def clean_text(text, clean):
+    """
+    Memoized cleaning, prompts repeat across requests and ftfy is slow.
+    """
+    if clean == 'whitespace':
+        text = whitespace_clean(basic_clean(text))
+    elif clean == 'lower':
+        text = whitespace_clean(basic_clean(text)).lower()
+    elif clean == 'canonicalize':
+        text = canonicalize(basic_clean(text))
+    return text
+
+
 class HuggingfaceTokenizer:
 
-    def __init__(self, name, seq_len=None, clean=None, **kwargs):
+    def __init__(self, name, seq_len=None, clean=None, cache_size=256,
+                 **kwargs):
         assert clean in (None, 'whitespace', 'lower', 'canonicalize')
         self.name = name
         self.seq_len = seq_len
         self.clean = clean
 
+        # token ids of recent texts, see `__call__`
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+
         # init tokenizer
         self.tokenizer = AutoTokenizer.from_pretrained(name, **kwargs)
         self.vocab_size = self.tokenizer.vocab_size
@@ -62,21 +84,48 @@ class HuggingfaceTokenizer:
         # tokenization
         if isinstance(sequence, str):
             sequence = [sequence]
-        if self.clean:
-            sequence = [self._clean(u) for u in sequence]
-        ids = self.tokenizer(sequence, **_kwargs)
+        if _kwargs.get('padding') != 'max_length' or \
+                _kwargs['return_tensors'] != 'pt' or \
+                not _kwargs.get('return_attention_mask', True) or \
+                not self.cache_size:
+            # rows depend on the rest of the batch, nothing to cache
+            ids = self._tokenize(sequence, _kwargs)
+            input_ids, attention_mask = ids.input_ids, ids.get(
+                'attention_mask')
+        else:
+            input_ids, attention_mask = self._tokenize_cached(
+                sequence, _kwargs)
 
         # output
         if return_mask:
-            return ids.input_ids, ids.attention_mask
+            return input_ids, attention_mask
         else:
-            return ids.input_ids
+            return input_ids
+
+    def _tokenize(self, sequence, kwargs):
+        if self.clean:
+            sequence = [self._clean(u) for u in sequence]
+        # one call on the whole batch, fast tokenizers run it in parallel
+        return self.tokenizer(sequence, **kwargs)
+
+    def _tokenize_cached(self, sequence, kwargs):
+        # fixed-length rows only depend on the raw text and the arguments
+        config = tuple(sorted(kwargs.items()))
+        keys = [(u, config) for u in sequence]
+        missing = list(dict.fromkeys(k for k in keys if k not in self._cache))
+        if missing:
+            ids = self._tokenize([u for u, _ in missing], kwargs)
+            for i, k in enumerate(missing):
+                self._cache[k] = (ids.input_ids[i].clone(),
+                                  ids.attention_mask[i].clone())
+        rows = []
+        for k in keys:
+            self._cache.move_to_end(k)
+            rows.append(self._cache[k])
+        while len(self._cache) > max(self.cache_size, len(set(keys))):
+            self._cache.popitem(last=False)
+        return (torch.stack([u for u, _ in rows]),
+                torch.stack([v for _, v in rows]))
 
     def _clean(self, text):
-        if self.clean == 'whitespace':
-            text = whitespace_clean(basic_clean(text))
-        elif self.clean == 'lower':
-            text = whitespace_clean(basic_clean(text)).lower()
-        elif self.clean == 'canonicalize':
-            text = canonicalize(basic_clean(text))
-        return text
+        return clean_text(text, self.clean)
@@ -7,6 +7,8 @@ import torch.nn as nn
 import torch.nn.functional as F
 from einops import rearrange
 
+from .vae_tiling import VAEWrapperMixin
+
 __all__ = [
     'Wan2_1_VAE',
 ]
@@ -18,6 +20,8 @@ class CausalConv3d(nn.Conv3d):
     """
     Causal 3d convolusion.
     """
+    # set by `set_precision`, inputs are converted to it when not None
+    memory_format = None
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -32,6 +36,8 @@ class CausalConv3d(nn.Conv3d):
             x = torch.cat([cache_x, x], dim=2)
             padding[4] -= cache_x.shape[2]
         x = F.pad(x, padding)
+        if self.memory_format is not None:
+            x = x.contiguous(memory_format=self.memory_format)
 
         return super().forward(x)
 
@@ -49,9 +55,10 @@ class RMS_norm(nn.Module):
         self.bias = nn.Parameter(torch.zeros(shape)) if bias else 0.
 
     def forward(self, x):
-        return F.normalize(
-            x, dim=(1 if self.channel_first else
-                    -1)) * self.scale * self.gamma + self.bias
+        # the norm is computed in float32 under autocast, return the input
+        # dtype so that the following ops stay in reduced precision
+        return (F.normalize(x, dim=(1 if self.channel_first else -1)) *
+                self.scale * self.gamma + self.bias).type_as(x)
 
 
 class Upsample(nn.Upsample):
@@ -60,6 +67,10 @@ class Upsample(nn.Upsample):
         """
         Fix bfloat16 support for nearest neighbor interpolation.
         """
+        if x.is_cuda and x.dtype in (torch.float16, torch.bfloat16):
+            # supported natively on the GPU, and nearest neighbor only copies
+            # values, so the round trip through float32 is not needed
+            return super().forward(x)
         return super().forward(x.float()).type_as(x)
 
 
@@ -506,6 +517,9 @@ class WanVAE_(nn.Module):
         self.conv2 = CausalConv3d(z_dim, z_dim, 1)
         self.decoder = Decoder3d(dim, z_dim, dim_mult, num_res_blocks,
                                  attn_scales, self.temperal_upsample, dropout)
+        # the module tree is fixed, count the causal convs only once
+        self._conv_num = count_conv3d(self.decoder)
+        self._enc_conv_num = count_conv3d(self.encoder)
 
     def forward(self, x):
         mu, log_var = self.encode(x)
@@ -517,21 +531,21 @@ class WanVAE_(nn.Module):
         self.clear_cache()
         ## cache
         t = x.shape[2]
-        iter_ = 1 + (t - 1) // 4
         ## 对encode输入的x，按时间拆分为1、4、4、4....
-        for i in range(iter_):
+        chunks = [(0, 1)] + [(1 + 4 * i, 5 + 4 * i)
+                             for i in range((t - 1) // 4)]
+        for i, (start, end) in enumerate(chunks):
             self._enc_conv_idx = [0]
+            out_ = self.encoder(
+                x[:, :, start:end, :, :],
+                feat_cache=self._enc_feat_map,
+                feat_idx=self._enc_conv_idx)
             if i == 0:
-                out = self.encoder(
-                    x[:, :, :1, :, :],
-                    feat_cache=self._enc_feat_map,
-                    feat_idx=self._enc_conv_idx)
-            else:
-                out_ = self.encoder(
-                    x[:, :, 1 + 4 * (i - 1):1 + 4 * i, :, :],
-                    feat_cache=self._enc_feat_map,
-                    feat_idx=self._enc_conv_idx)
-                out = torch.cat([out, out_], 2)
+                # every chunk yields one latent frame, fill a preallocated
+                # buffer instead of growing the output with torch.cat
+                out = out_.new_empty(*out_.shape[:2], len(chunks),
+                                     *out_.shape[3:])
+            out[:, :, i:i + 1] = out_
         mu, log_var = self.conv1(out).chunk(2, dim=1)
         if isinstance(scale[0], torch.Tensor):
             mu = (mu - scale[0].view(1, self.z_dim, 1, 1, 1)) * scale[1].view(
@@ -541,8 +555,16 @@ class WanVAE_(nn.Module):
         self.clear_cache()
         return mu
 
-    def decode(self, z, scale):
+    def decode_stream(self, z, scale, state=None):
+        """
+        Decodes `z` one latent frame at a time and yields the pixel frames of
+        every causal step as soon as it is done. With a `CausalState`,
+        continues its temporal stream and updates it once all frames are out.
+        """
         self.clear_cache()
+        resume = state is not None and state.started
+        if resume:
+            self._feat_map = list(state.feats)
         # z: [b,c,t,h,w]
         if isinstance(scale[0], torch.Tensor):
             z = z / scale[1].view(1, self.z_dim, 1, 1, 1) + scale[0].view(
@@ -551,20 +573,32 @@ class WanVAE_(nn.Module):
             z = z / scale[1] + scale[0]
         iter_ = z.shape[2]
         x = self.conv2(z)
-        for i in range(iter_):
-            self._conv_idx = [0]
-            if i == 0:
-                out = self.decoder(
+        try:
+            for i in range(iter_):
+                self._conv_idx = [0]
+                yield self.decoder(
                     x[:, :, i:i + 1, :, :],
                     feat_cache=self._feat_map,
                     feat_idx=self._conv_idx)
-            else:
-                out_ = self.decoder(
-                    x[:, :, i:i + 1, :, :],
-                    feat_cache=self._feat_map,
-                    feat_idx=self._conv_idx)
-                out = torch.cat([out, out_], 2)
-        self.clear_cache()
+            if state is not None:
+                state.feats = self._feat_map
+        finally:
+            self.clear_cache()
+
+    def decode(self, z, scale, state=None):
+        # the first latent frame of a stream decodes to one frame, the others
+        # to 2**num_temporal_upsamples frames each
+        num_frames = z.shape[2] * 2**sum(self.temperal_upsample)
+        if state is None or not state.started:
+            num_frames -= 2**sum(self.temperal_upsample) - 1
+        pos = 0
+        for out_ in self.decode_stream(z, scale, state):
+            if pos == 0:
+                out = out_.new_empty(*out_.shape[:2], num_frames,
+                                     *out_.shape[3:])
+            out[:, :, pos:pos + out_.shape[2]] = out_
+            pos += out_.shape[2]
+        assert pos == num_frames
         return out
 
     def reparameterize(self, mu, log_var):
@@ -580,11 +614,9 @@ class WanVAE_(nn.Module):
         return mu + std * torch.randn_like(std)
 
     def clear_cache(self):
-        self._conv_num = count_conv3d(self.decoder)
         self._conv_idx = [0]
         self._feat_map = [None] * self._conv_num
         #cache encode
-        self._enc_conv_num = count_conv3d(self.encoder)
         self._enc_conv_idx = [0]
         self._enc_feat_map = [None] * self._enc_conv_num
 
@@ -616,7 +648,10 @@ def _video_vae(pretrained_path=None, z_dim=None, device='cpu', **kwargs):
     return model
 
 
-class Wan2_1_VAE:
+class Wan2_1_VAE(VAEWrapperMixin):
+    # spatial compression, and default tile size in latent pixels
+    spatial_stride = 8
+    tile_size = 32
 
     def __init__(self,
                  z_dim=16,
@@ -643,21 +678,4 @@ class Wan2_1_VAE:
             pretrained_path=vae_pth,
             z_dim=z_dim,
         ).eval().requires_grad_(False).to(device)
-
-    def encode(self, videos):
-        """
-        videos: A list of videos each with shape [C, T, H, W].
-        """
-        with amp.autocast(dtype=self.dtype):
-            return [
-                self.model.encode(u.unsqueeze(0), self.scale).float().squeeze(0)
-                for u in videos
-            ]
-
-    def decode(self, zs):
-        with amp.autocast(dtype=self.dtype):
-            return [
-                self.model.decode(u.unsqueeze(0),
-                                  self.scale).float().clamp_(-1, 1).squeeze(0)
-                for u in zs
-            ]
+        self._init_modes()
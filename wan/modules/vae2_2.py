@@ -7,6 +7,8 @@ import torch.nn as nn
 import torch.nn.functional as F
 from einops import rearrange
 
+from .vae_tiling import VAEWrapperMixin
+
 __all__ = [
     "Wan2_2_VAE",
 ]
@@ -18,6 +20,8 @@ class CausalConv3d(nn.Conv3d):
     """
     Causal 3d convolusion.
     """
+    # set by `set_precision`, inputs are converted to it when not None
+    memory_format = None
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -38,6 +42,8 @@ class CausalConv3d(nn.Conv3d):
             x = torch.cat([cache_x, x], dim=2)
             padding[4] -= cache_x.shape[2]
         x = F.pad(x, padding)
+        if self.memory_format is not None:
+            x = x.contiguous(memory_format=self.memory_format)
 
         return super().forward(x)
 
@@ -55,8 +61,10 @@ class RMS_norm(nn.Module):
         self.bias = nn.Parameter(torch.zeros(shape)) if bias else 0.0
 
     def forward(self, x):
+        # the norm is computed in float32 under autocast, return the input
+        # dtype so that the following ops stay in reduced precision
         return (F.normalize(x, dim=(1 if self.channel_first else -1)) *
-                self.scale * self.gamma + self.bias)
+                self.scale * self.gamma + self.bias).type_as(x)
 
 
 class Upsample(nn.Upsample):
@@ -65,6 +73,10 @@ class Upsample(nn.Upsample):
         """
         Fix bfloat16 support for nearest neighbor interpolation.
         """
+        if x.is_cuda and x.dtype in (torch.float16, torch.bfloat16):
+            # supported natively on the GPU, and nearest neighbor only copies
+            # values, so the round trip through float32 is not needed
+            return super().forward(x)
         return super().forward(x.float()).type_as(x)
 
 
@@ -774,6 +786,9 @@ class WanVAE_(nn.Module):
             self.temperal_upsample,
             dropout,
         )
+        # the module tree is fixed, count the causal convs only once
+        self._conv_num = count_conv3d(self.decoder)
+        self._enc_conv_num = count_conv3d(self.encoder)
 
     def forward(self, x, scale=[0, 1]):
         mu = self.encode(x, scale)
@@ -784,22 +799,21 @@ class WanVAE_(nn.Module):
         self.clear_cache()
         x = patchify(x, patch_size=2)
         t = x.shape[2]
-        iter_ = 1 + (t - 1) // 4
-        for i in range(iter_):
+        chunks = [(0, 1)] + [(1 + 4 * i, 5 + 4 * i)
+                             for i in range((t - 1) // 4)]
+        for i, (start, end) in enumerate(chunks):
             self._enc_conv_idx = [0]
+            out_ = self.encoder(
+                x[:, :, start:end, :, :],
+                feat_cache=self._enc_feat_map,
+                feat_idx=self._enc_conv_idx,
+            )
             if i == 0:
-                out = self.encoder(
-                    x[:, :, :1, :, :],
-                    feat_cache=self._enc_feat_map,
-                    feat_idx=self._enc_conv_idx,
-                )
-            else:
-                out_ = self.encoder(
-                    x[:, :, 1 + 4 * (i - 1):1 + 4 * i, :, :],
-                    feat_cache=self._enc_feat_map,
-                    feat_idx=self._enc_conv_idx,
-                )
-                out = torch.cat([out, out_], 2)
+                # every chunk yields one latent frame, fill a preallocated
+                # buffer instead of growing the output with torch.cat
+                out = out_.new_empty(*out_.shape[:2], len(chunks),
+                                     *out_.shape[3:])
+            out[:, :, i:i + 1] = out_
         mu, log_var = self.conv1(out).chunk(2, dim=1)
         if isinstance(scale[0], torch.Tensor):
             mu = (mu - scale[0].view(1, self.z_dim, 1, 1, 1)) * scale[1].view(
@@ -809,8 +823,16 @@ class WanVAE_(nn.Module):
         self.clear_cache()
         return mu
 
-    def decode(self, z, scale):
+    def decode_stream(self, z, scale, state=None):
+        """
+        Decodes `z` one latent frame at a time and yields the pixel frames of
+        every causal step as soon as it is done. With a `CausalState`,
+        continues its temporal stream and updates it once all frames are out.
+        """
         self.clear_cache()
+        resume = state is not None and state.started
+        if resume:
+            self._feat_map = list(state.feats)
         if isinstance(scale[0], torch.Tensor):
             z = z / scale[1].view(1, self.z_dim, 1, 1, 1) + scale[0].view(
                 1, self.z_dim, 1, 1, 1)
@@ -818,24 +840,35 @@ class WanVAE_(nn.Module):
             z = z / scale[1] + scale[0]
         iter_ = z.shape[2]
         x = self.conv2(z)
-        for i in range(iter_):
-            self._conv_idx = [0]
-            if i == 0:
+        try:
+            for i in range(iter_):
+                self._conv_idx = [0]
                 out = self.decoder(
                     x[:, :, i:i + 1, :, :],
                     feat_cache=self._feat_map,
                     feat_idx=self._conv_idx,
-                    first_chunk=True,
+                    first_chunk=(i == 0 and not resume),
                 )
-            else:
-                out_ = self.decoder(
-                    x[:, :, i:i + 1, :, :],
-                    feat_cache=self._feat_map,
-                    feat_idx=self._conv_idx,
-                )
-                out = torch.cat([out, out_], 2)
-        out = unpatchify(out, patch_size=2)
-        self.clear_cache()
+                yield unpatchify(out, patch_size=2)
+            if state is not None:
+                state.feats = self._feat_map
+        finally:
+            self.clear_cache()
+
+    def decode(self, z, scale, state=None):
+        # the first latent frame of a stream decodes to one frame, the others
+        # to 2**num_temporal_upsamples frames each
+        num_frames = z.shape[2] * 2**sum(self.temperal_upsample)
+        if state is None or not state.started:
+            num_frames -= 2**sum(self.temperal_upsample) - 1
+        pos = 0
+        for out_ in self.decode_stream(z, scale, state):
+            if pos == 0:
+                out = out_.new_empty(*out_.shape[:2], num_frames,
+                                     *out_.shape[3:])
+            out[:, :, pos:pos + out_.shape[2]] = out_
+            pos += out_.shape[2]
+        assert pos == num_frames
         return out
 
     def reparameterize(self, mu, log_var):
@@ -851,11 +884,9 @@ class WanVAE_(nn.Module):
         return mu + std * torch.randn_like(std)
 
     def clear_cache(self):
-        self._conv_num = count_conv3d(self.decoder)
         self._conv_idx = [0]
         self._feat_map = [None] * self._conv_num
         # cache encode
-        self._enc_conv_num = count_conv3d(self.encoder)
         self._enc_conv_idx = [0]
         self._enc_feat_map = [None] * self._enc_conv_num
 
@@ -885,7 +916,10 @@ def _video_vae(pretrained_path=None, z_dim=16, dim=160, device="cpu", **kwargs):
     return model
 
 
-class Wan2_2_VAE:
+class Wan2_2_VAE(VAEWrapperMixin):
+    # spatial compression, and default tile size in latent pixels
+    spatial_stride = 16
+    tile_size = 16
 
     def __init__(
         self,
@@ -1020,32 +1054,22 @@ class Wan2_2_VAE:
                 dim_mult=dim_mult,
                 temperal_downsample=temperal_downsample,
             ).eval().requires_grad_(False).to(device))
+        self._init_modes()
 
-    def encode(self, videos):
+    def encode(self, videos, max_batch=None):
         try:
             if not isinstance(videos, list):
                 raise TypeError("videos should be a list")
-            with amp.autocast(dtype=self.dtype):
-                return [
-                    self.model.encode(u.unsqueeze(0),
-                                      self.scale).float().squeeze(0)
-                    for u in videos
-                ]
+            return super().encode(videos, max_batch)
         except TypeError as e:
             logging.info(e)
             return None
 
-    def decode(self, zs):
+    def decode(self, zs, max_batch=None):
         try:
             if not isinstance(zs, list):
                 raise TypeError("zs should be a list")
-            with amp.autocast(dtype=self.dtype):
-                return [
-                    self.model.decode(u.unsqueeze(0),
-                                      self.scale).float().clamp_(-1,
-                                                                 1).squeeze(0)
-                    for u in zs
-                ]
+            return super().decode(zs, max_batch)
         except TypeError as e:
             logging.info(e)
             return None
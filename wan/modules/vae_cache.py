@@ -0,0 +1,76 @@
+# Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
+import hashlib
+from collections import OrderedDict
+
+import torch
+
+__all__ = ['CausalState', 'LatentCache', 'tensor_digest']
+
+
+def tensor_digest(tensor):
+    """
+    Returns a content hash of `tensor` including its shape and dtype.
+    """
+    data = tensor.detach().contiguous().cpu()
+    h = hashlib.sha1(f'{tuple(data.shape)}:{data.dtype}'.encode())
+    h.update(data.reshape(-1).view(torch.uint8).numpy().tobytes())
+    return h.hexdigest()
+
+
+class LatentCache:
+    """
+    LRU cache of VAE latents for deterministic encoder inputs.
+    """
+
+    def __init__(self, max_entries=16):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+
+    def __call__(self, key, encode_fn):
+        """
+        Returns the latent stored under `key`, calling `encode_fn` on a miss.
+        """
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return self._entries[key]
+        latent = encode_fn()
+        self._entries[key] = latent
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return latent
+
+    def clear(self):
+        self._entries.clear()
+
+
+class CausalState:
+    """
+    Temporal cache of a causal VAE decoder between two calls.
+
+    Holds the per-conv feature caches (tensors, None or the 'Rep' marker) left
+    by the last call, so the next call continues the temporal stream of a long
+    video instead of starting from an empty cache. The decode calls update it
+    in place. `state_dict` is savable with `torch.save`.
+    """
+
+    def __init__(self, feats=None):
+        self.feats = feats
+
+    @property
+    def started(self):
+        return self.feats is not None
+
+    def to(self, device):
+        if self.started:
+            self.feats = [
+                f.to(device) if isinstance(f, torch.Tensor) else f
+                for f in self.feats
+            ]
+        return self
+
+    def state_dict(self):
+        return {'feats': self.feats}
+
+    @classmethod
+    def from_state_dict(cls, state_dict):
+        return cls(state_dict['feats'])
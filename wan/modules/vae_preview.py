@@ -0,0 +1,123 @@
+# Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
+"""
+Cheap latent-to-RGB previews.
+
+Every latent pixel is mapped to a colour by a linear projection of its
+channels, fitted against the VAE with `wan/utils/fit_preview.py`. This gives a
+coarse RGB video at latent resolution (16 channels for Wan2.1, 48 for Wan2.2)
+without running the VAE decoder, which is enough for progress previews while
+sampling.
+"""
+import torch
+import torch.nn.functional as F
+
+__all__ = ['LatentPreviewer', 'fit_previewer']
+
+
+class LatentPreviewer:
+
+    def __init__(self, weight, bias, upscale=1):
+        r"""
+        Args:
+            weight (`torch.Tensor`):
+                Projection of shape [3, C] from latent channels to RGB.
+            bias (`torch.Tensor`):
+                RGB offset of shape [3].
+            upscale (`int`, *optional*, defaults to 1):
+                Nearest-neighbour upsampling of the preview frames.
+        """
+        self.weight = weight.float()
+        self.bias = bias.float()
+        self.upscale = upscale
+
+    @classmethod
+    def load(cls, path, upscale=None):
+        """
+        Loads a previewer saved by `save`, optionally overriding its upscale.
+        """
+        state = torch.load(path, map_location='cpu')
+        if upscale is None:
+            upscale = state.get('upscale', 1)
+        return cls(state['weight'], state['bias'], upscale=upscale)
+
+    def save(self, path):
+        torch.save(
+            {
+                'weight': self.weight,
+                'bias': self.bias,
+                'upscale': self.upscale
+            }, path)
+
+    @torch.no_grad()
+    def __call__(self, latent):
+        """
+        Projects a latent [C, T, h, w] to a preview [3, T, h', w'] in [-1, 1].
+        """
+        weight = self.weight.to(latent.device)
+        bias = self.bias.to(latent.device)
+        video = torch.einsum('oc,cthw->othw', weight, latent.float())
+        video = (video + bias.view(3, 1, 1, 1)).clamp_(-1, 1)
+        if self.upscale > 1:
+            video = F.interpolate(
+                video[None],
+                scale_factor=(1, self.upscale, self.upscale),
+                mode='nearest')[0]
+        return video
+
+    def callback(self, fn):
+        """
+        Wraps `fn(step, preview)` into a sampling callback, see the `callback`
+        argument of the pipelines' `generate`.
+        """
+
+        def _callback(step, timestep, latent):
+            fn(step, self(latent))
+
+        return _callback
+
+
+def _pool_video(video, temporal_stride, spatial_stride):
+    # the first frame has its own latent, every later latent covers
+    # `temporal_stride` frames
+    first, rest = video[:, :1], video[:, 1:]
+    c, t, h, w = rest.shape
+    frames = [first]
+    if t > 0:
+        frames.append(
+            rest.reshape(c, t // temporal_stride, temporal_stride, h,
+                         w).mean(2))
+    video = torch.cat(frames, dim=1)
+    return F.avg_pool2d(video, spatial_stride)
+
+
+@torch.no_grad()
+def fit_previewer(vae, videos, temporal_stride=4, max_batch=1):
+    """
+    Fits a `LatentPreviewer` to `vae` by least squares between the latents of
+    `videos` and the videos pooled to the latent grid.
+
+    Args:
+        vae (`Wan2_1_VAE` or `Wan2_2_VAE`):
+            The VAE whose latents are previewed.
+        videos (`list[torch.Tensor]`):
+            Videos [3, 1 + 4n, H, W] in [-1, 1], H and W multiples of the
+            spatial stride.
+        temporal_stride (`int`, *optional*, defaults to 4):
+            Temporal compression of the VAE.
+        max_batch (`int`, *optional*, defaults to 1):
+            Number of equally shaped videos encoded together.
+
+    Returns:
+        `LatentPreviewer`: Previewer upsampling to the video resolution.
+    """
+    inputs, targets = [], []
+    for video, latent in zip(videos, vae.encode(videos, max_batch)):
+        target = _pool_video(video.float(), temporal_stride,
+                             vae.spatial_stride)
+        inputs.append(latent.float().flatten(1).t().cpu())
+        targets.append(target.flatten(1).t().cpu())
+    x = torch.cat(inputs)
+    x = torch.cat([x, x.new_ones(x.shape[0], 1)], dim=1)
+    solution = torch.linalg.lstsq(x, torch.cat(targets)).solution
+    return LatentPreviewer(
+        solution[:-1].t(), solution[-1], upscale=vae.spatial_stride)
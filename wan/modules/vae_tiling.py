@@ -0,0 +1,511 @@
+# Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
+"""
+Spatial tiling for the causal video VAEs.
+
+The latent grid is split into overlapping tiles of equal size (the last tile
+of a row / column is shifted back to end at the border), every tile runs the
+full causal pass with its own temporal cache, and the outputs are blended with
+linear feathering over the overlaps. Peak activation memory then depends on
+the tile size only, and equally sized tiles can be batched.
+
+`batch_by_shape` applies the same batching to whole videos: equally shaped
+inputs run through the model in one call, every sample keeping its own slice
+of the batched causal caches.
+
+`segmented_encode` splits long videos in time instead. Every segment starts a
+fresh causal stream a few latents early to rebuild the cache, so the segments
+are independent and equally long ones are encoded as one batch.
+
+`VAEWrapperMixin` puts these modes, the latent caches and the clip-wise and
+streaming calls behind the common interface of `Wan2_1_VAE` and `Wan2_2_VAE`.
+"""
+import logging
+import math
+
+import torch
+import torch.nn as nn
+
+from .vae_cache import LatentCache, tensor_digest
+
+__all__ = [
+    'TileBlender', 'VAEWrapperMixin', 'batch_by_shape', 'plan_tiles',
+    'segmented_encode', 'tiled_decode', 'tiled_encode'
+]
+
+
+def _pair(v):
+    return (v, v) if isinstance(v, int) else tuple(v)
+
+
+def _tile_starts(size, tile, overlap):
+    if size <= tile:
+        return [0], size
+    stride = tile - overlap
+    num = math.ceil((size - overlap) / stride)
+    return sorted({min(i * stride, size - tile) for i in range(num)}), tile
+
+
+def _ramp(length, ramp, left, right, device):
+    w = torch.ones(length, device=device)
+    ramp = min(ramp, length)
+    if ramp > 0:
+        r = (torch.arange(ramp, device=device, dtype=torch.float32) +
+             0.5) / ramp
+        if left:
+            w[:ramp] = r
+        if right:
+            w[-ramp:] = torch.minimum(w[-ramp:], r.flip(0))
+    return w
+
+
+def plan_tiles(h, w, tile_size, tile_overlap):
+    """
+    Splits an `h` x `w` grid into equally sized overlapping tiles. Size and
+    overlap are an int or a `(height, width)` pair.
+
+    Returns:
+        `tuple[list, int, int]`: Tile origins `(y, x)`, tile height and width.
+    """
+    (tile_h, tile_w), (overlap_h, overlap_w) = _pair(tile_size), _pair(
+        tile_overlap)
+    assert 0 <= overlap_h < tile_h and 0 <= overlap_w < tile_w
+    ys, th = _tile_starts(h, tile_h, overlap_h)
+    xs, tw = _tile_starts(w, tile_w, overlap_w)
+    return [(y, x) for y in ys for x in xs], th, tw
+
+
+class TileBlender:
+    """
+    Accumulates tile outputs with linear feathering over the overlaps.
+    """
+
+    def __init__(self, h, w, th, tw, tile_overlap, scale):
+        self.h, self.w, self.th, self.tw = h, w, th, tw
+        self.ramp_h, self.ramp_w = (o * scale for o in _pair(tile_overlap))
+        self.scale = scale
+        self.out = self.weight = None
+
+    def add(self, res, y, x):
+        """
+        Adds the output `res` [B, C, T, th * scale, tw * scale] of tile `(y, x)`.
+        """
+        s = self.scale
+        if self.out is None:
+            self.out = res.new_zeros(*res.shape[:-2], self.h * s, self.w * s,
+                                     dtype=torch.float32)
+            self.weight = self.out.new_zeros(self.h * s, self.w * s)
+        mask = _ramp(self.th * s, self.ramp_h, y > 0, y + self.th < self.h,
+                     res.device)[:, None] * _ramp(
+                         self.tw * s, self.ramp_w, x > 0, x + self.tw < self.w,
+                         res.device)[None, :]
+        ys, xs = slice(y * s, (y + self.th) * s), slice(x * s,
+                                                        (x + self.tw) * s)
+        self.out[..., ys, xs] += res.float() * mask
+        self.weight[ys, xs] += mask
+
+    def result(self):
+        return self.out / self.weight
+
+
+def _tiled(fn, x, in_scale, out_scale, tile_size, tile_overlap, tile_batch):
+    b = x.shape[0]
+    h, w = x.shape[-2] // in_scale, x.shape[-1] // in_scale
+    tiles, th, tw = plan_tiles(h, w, tile_size, tile_overlap)
+    blender = TileBlender(h, w, th, tw, tile_overlap, out_scale)
+
+    for i in range(0, len(tiles), tile_batch):
+        group = tiles[i:i + tile_batch]
+        batch = torch.cat([
+            x[..., y * in_scale:(y + th) * in_scale,
+              x_ * in_scale:(x_ + tw) * in_scale] for y, x_ in group
+        ])
+        res = fn(batch)
+        for j, (y, x_) in enumerate(group):
+            blender.add(res[j * b:(j + 1) * b], y, x_)
+        del res
+    return blender.result()
+
+
+def tiled_decode(decode_fn,
+                 z,
+                 scale_factor,
+                 tile_size=32,
+                 tile_overlap=8,
+                 tile_batch=1):
+    """
+    Decodes `z` tile by tile.
+
+    Args:
+        decode_fn (callable):
+            Maps a latent batch [B, C, T, h, w] to videos
+            [B, 3, T', h * scale_factor, w * scale_factor].
+        z (torch.Tensor):
+            Latent of shape [B, C, T, H, W].
+        scale_factor (`int`):
+            Spatial compression of the VAE.
+        tile_size (`int` or `tuple[int]`, *optional*, defaults to 32):
+            Tile height and width in latent pixels.
+        tile_overlap (`int` or `tuple[int]`, *optional*, defaults to 8):
+            Minimum overlap of neighbouring tiles in latent pixels.
+        tile_batch (`int`, *optional*, defaults to 1):
+            Number of tiles decoded in one call of `decode_fn`.
+
+    Returns:
+        torch.Tensor: The float32 video.
+    """
+    return _tiled(decode_fn, z, 1, scale_factor, tile_size, tile_overlap,
+                  tile_batch)
+
+
+def tiled_encode(encode_fn,
+                 x,
+                 scale_factor,
+                 tile_size=32,
+                 tile_overlap=8,
+                 tile_batch=1):
+    """
+    Encodes `x` tile by tile, the counterpart of `tiled_decode`. Tile size and
+    overlap are given in latent pixels as well.
+    """
+    return _tiled(encode_fn, x, scale_factor, 1, tile_size, tile_overlap,
+                  tile_batch)
+
+
+def batch_by_shape(fn, tensors, max_batch=None):
+    """
+    Applies `fn` to a list of tensors, stacking equally shaped ones.
+
+    Args:
+        fn (callable):
+            Maps a batch [B, ...] to outputs [B, ...].
+        tensors (`list[torch.Tensor]`):
+            Unbatched inputs, e.g. videos [C, T, H, W].
+        max_batch (`int`, *optional*, defaults to None):
+            Largest batch passed to `fn`, unlimited if None.
+
+    Returns:
+        `list[torch.Tensor]`: The outputs in the order of `tensors`.
+    """
+    groups = {}
+    for i, t in enumerate(tensors):
+        groups.setdefault((tuple(t.shape), t.dtype, t.device), []).append(i)
+
+    outputs = [None] * len(tensors)
+    for indices in groups.values():
+        step = max_batch or len(indices)
+        for i in range(0, len(indices), step):
+            chunk = indices[i:i + step]
+            out = fn(torch.stack([tensors[j] for j in chunk]))
+            for j, o in zip(chunk, out):
+                outputs[j] = o
+    return outputs
+
+
+def segmented_encode(encode_fn,
+                     x,
+                     segment_latents=16,
+                     warmup_latents=4,
+                     segment_batch=None,
+                     temporal_stride=4):
+    """
+    Encodes a long video in independent temporal segments.
+
+    Latent `i > 0` covers frames `1 + 4 * (i - 1)` to `4 * i`. A segment of
+    latents `[start, end)` is encoded as a fresh stream that starts with the
+    last frame of latent `start - warmup_latents - 1`, so the warm-up latents
+    rebuild the causal cache and are dropped afterwards. The result equals
+    the sequential encode once the warm-up covers the temporal receptive field
+    of the encoder (`Wan2_1_VAE._tail_start`, checked by
+    `tests/test_segmented_encode.py`). A shorter warm-up misses the frames
+    before it, the resulting error depends on the weights and the video;
+    measure it with `wan/utils/vae_accuracy.py --segmented_encode`.
+
+    Args:
+        encode_fn (callable):
+            Maps videos [B, C, 1 + 4n, H, W] to latents [B, C', 1 + n, h, w].
+        x (torch.Tensor):
+            Video of shape [B, C, 1 + 4n, H, W].
+        segment_latents (`int`, *optional*, defaults to 16):
+            Latent frames per segment.
+        warmup_latents (`int`, *optional*, defaults to 4):
+            Latent frames encoded ahead of every segment but the first.
+        segment_batch (`int`, *optional*, defaults to None):
+            Largest number of segments encoded together, unlimited if None.
+        temporal_stride (`int`, *optional*, defaults to 4):
+            Temporal compression of the VAE.
+
+    Returns:
+        torch.Tensor: The latent [B, C', 1 + n, h, w].
+    """
+    s = temporal_stride
+    num_latents = 1 + (x.shape[2] - 1) // s
+    if num_latents <= segment_latents:
+        return encode_fn(x)
+
+    # equally long segment inputs are encoded as one batch
+    groups = {}
+    for start in range(0, num_latents, segment_latents):
+        end = min(start + segment_latents, num_latents)
+        warm = max(start - warmup_latents, 1) if start > 0 else 0
+        first = 0 if warm == 0 else s * (warm - 1)
+        segment = x[:, :, first:s * (end - 1) + 1]
+        groups.setdefault(segment.shape[2], []).append(
+            (start, end, segment))
+
+    b = x.shape[0]
+    latents = {}
+    for segments in groups.values():
+        step = segment_batch or len(segments)
+        for i in range(0, len(segments), step):
+            chunk = segments[i:i + step]
+            out = encode_fn(torch.cat([seg for _, _, seg in chunk]))
+            for j, (start, end, _) in enumerate(chunk):
+                latents[start] = out[j * b:(j + 1) * b, :, start - end:]
+            del out
+    return torch.cat([latents[start] for start in sorted(latents)], dim=2)
+
+
+class VAEWrapperMixin:
+    """
+    Encode / decode modes and latent caches shared by `Wan2_1_VAE` and
+    `Wan2_2_VAE`.
+
+    The wrappers provide `model`, `scale`, `dtype`, `device`,
+    `spatial_stride` (spatial compression of the VAE) and `tile_size` (default
+    tile size in latent pixels), and call `_init_modes` at the end of their
+    `__init__`.
+    """
+
+    def _init_modes(self):
+        self.tiling = None
+        self.segments = None
+        self.latent_cache = LatentCache()
+        self._warm = set()
+        self._tail_starts = {}
+
+    def enable_tiling(self, tile_size=None, tile_overlap=None, tile_batch=1):
+        """
+        Encode and decode in overlapping spatial tiles, so peak memory depends
+        on the tile size rather than the resolution. Sizes are in latent
+        pixels, the tile size defaults to `self.tile_size`, the overlap to a
+        quarter of the tile size, and `tile_batch` tiles are processed per
+        forward.
+        """
+        if tile_size is None:
+            tile_size = self.tile_size
+        if tile_overlap is None:
+            tile_overlap = tile_size // 4
+        self.tiling = dict(
+            tile_size=tile_size, tile_overlap=tile_overlap,
+            tile_batch=tile_batch)
+
+    def set_precision(self, dtype=torch.bfloat16, channels_last=False):
+        """
+        Runs the VAE with weights and autocast in `dtype`, float32 is the
+        default, on the device type of the VAE (see `autocast`). With
+        `channels_last` the convolutions use the channels-last memory format,
+        which has faster cuDNN kernels in half precision. Check a mode against
+        float32 with `wan/utils/vae_accuracy.py`.
+        """
+        self.dtype = dtype
+        self.model.to(dtype)
+        format_3d = torch.channels_last_3d if channels_last else None
+        format_2d = torch.channels_last if channels_last else None
+        for m in self.model.modules():
+            # every 3d convolution of the VAEs is a `CausalConv3d`
+            if isinstance(m, nn.Conv3d):
+                m.memory_format = format_3d
+                m.to(memory_format=format_3d or torch.contiguous_format)
+            elif isinstance(m, nn.Conv2d):
+                m.to(memory_format=format_2d or torch.contiguous_format)
+        self.latent_cache.clear()
+
+    def autocast(self):
+        """
+        Autocast context in `self.dtype` on the device of the VAE, off in
+        float32.
+        """
+        return torch.autocast(
+            device_type=torch.device(self.device).type,
+            dtype=self.dtype,
+            enabled=self.dtype != torch.float32)
+
+    def disable_tiling(self):
+        self.tiling = None
+
+    @torch.no_grad()
+    def warmup(self, sizes):
+        """
+        Runs encode and decode once per size, e.g. at server startup, so that
+        the CUDA kernels, cuDNN plans and allocator blocks for those shapes
+        exist before the first request. A 9-frame video already covers every
+        causal step shape, whatever the video length. With
+        `torch.backends.cudnn.benchmark` set by the caller, the autotuned
+        plans are the ones cached.
+
+        Args:
+            sizes (`list[tuple[int]]`):
+                Video sizes as (width, height) in pixels.
+        """
+        for width, height in sizes:
+            key = self._cache_key('warmup', width, height, self.dtype)
+            if key in self._warm:
+                continue
+            video = torch.zeros(3, 9, height, width, device=self.device)
+            self.decode(self.encode([video]))
+            self._warm.add(key)
+            logging.info(f"Warmed up the VAE for {width}x{height}.")
+
+    def enable_segmented_encode(self,
+                                segment_latents=16,
+                                warmup_latents=None,
+                                segment_batch=None):
+        """
+        Encode long videos in independent temporal segments of
+        `segment_latents` latent frames, each warmed up on the preceding
+        `warmup_latents` latents, so that the segments run as one batch. The
+        warm-up defaults to the temporal receptive field of the encoder
+        (`_tail_start`), with which the segments equal the sequential encode.
+        """
+        self.segments = dict(
+            segment_latents=segment_latents,
+            warmup_latents=warmup_latents,
+            segment_batch=segment_batch)
+
+    def disable_segmented_encode(self):
+        self.segments = None
+
+    def _cache_key(self, *key):
+        tiling = tuple(sorted(self.tiling.items())) if self.tiling else None
+        segments = tuple(sorted(
+            self.segments.items())) if self.segments else None
+        return key + (tiling, segments)
+
+    def encode_constant(self, shape, value, dtype=torch.float32):
+        """
+        Encodes a video of shape [C, T, H, W] filled with `value`. The latent
+        is memoized and must not be modified in place.
+        """
+        key = self._cache_key('constant', tuple(shape), float(value), dtype)
+        return self.latent_cache(
+            key, lambda: self.encode(
+                [torch.full(shape, value, dtype=dtype, device=self.device)])[0])
+
+    @torch.no_grad()
+    def _tail_start(self, num_frames, num_cond):
+        """
+        Returns the index of the first latent of a `num_frames` video that
+        does not depend on its first `num_cond` frames, and the number of
+        latents. Found once per length by encoding a small video whose first
+        frames are NaN: the causal convolutions carry the NaNs into exactly
+        the latents within their receptive field.
+        """
+        key = (num_frames, num_cond, self.dtype)
+        if key not in self._tail_starts:
+            size = 2 * self.spatial_stride
+            video = torch.zeros(
+                1, 3, num_frames, size, size, device=self.device)
+            video[:, :, :num_cond] = float('nan')
+            with self.autocast():
+                z = self.model.encode(video, self.scale)
+            clean = (~z.isnan().flatten(3).any(-1).any(1))[0].tolist()
+            start = clean.index(True) if True in clean else len(clean)
+            assert all(clean[start:])
+            self._tail_starts[key] = (start, len(clean))
+        return self._tail_starts[key]
+
+    def encode_zero_padded(self, frames, num_frames):
+        """
+        Encodes `frames` [C, F, H, W] followed by zero frames up to
+        `num_frames`, memoized by the content of `frames`. Only the frames up
+        to the end of the causal receptive field of `frames` are encoded, the
+        later latents are those of an all-zero video of the same shape, which
+        are memoized by the shape alone. Without segmented encoding this
+        equals encoding the padded video, see `tests/test_vae_cache.py`.
+        """
+        key = self._cache_key('zero_padded', num_frames, tensor_digest(frames))
+
+        def encode():
+            c, f, h, w = frames.shape
+            start, num_latents = self._tail_start(num_frames, f)
+            if self.segments is not None or start >= num_latents:
+                video = torch.cat(
+                    [frames, frames.new_zeros(c, num_frames - f, h, w)], dim=1)
+                return self.encode([video.to(self.device)])[0]
+            # the first `start` latents only see the first 1 + 4 * (start - 1)
+            # frames
+            head = torch.cat([
+                frames,
+                frames.new_zeros(c, 1 + 4 * (start - 1) - f, h, w)
+            ], dim=1)
+            head = self.encode([head.to(self.device)])[0]
+            tail = self.encode_constant((c, num_frames, h, w), 0.0,
+                                        frames.dtype)[:, start:]
+            return torch.cat([head, tail], dim=1)
+
+        return self.latent_cache(key, encode)
+
+    def _encode(self, x, segmented=True):
+        if segmented and self.segments is not None:
+            segments = dict(self.segments)
+            if segments['warmup_latents'] is None:
+                # a segment starts a fresh stream, its first frame reaches
+                # exactly as far as the first frame of the video
+                segments['warmup_latents'] = self._tail_start(x.shape[2], 1)[0]
+            return segmented_encode(
+                lambda u: self._encode(u, segmented=False), x, **segments)
+        if self.tiling is None:
+            return self.model.encode(x, self.scale)
+        return tiled_encode(lambda u: self.model.encode(u, self.scale), x,
+                            self.spatial_stride, **self.tiling)
+
+    def _decode(self, z):
+        if self.tiling is None:
+            return self.model.decode(z, self.scale)
+        return tiled_decode(lambda u: self.model.decode(u, self.scale), z,
+                            self.spatial_stride, **self.tiling)
+
+    def encode(self, videos, max_batch=None):
+        """
+        videos: A list of videos each with shape [C, T, H, W]. Videos of the
+        same shape are encoded together, at most `max_batch` at a time.
+        """
+        with self.autocast():
+            return batch_by_shape(lambda x: self._encode(x).float(),
+                                  list(videos), max_batch)
+
+    def decode(self, zs, max_batch=None):
+        with self.autocast():
+            return batch_by_shape(
+                lambda z: self._decode(z).float().clamp_(-1, 1), list(zs),
+                max_batch)
+
+    def decode_clip(self, z, state):
+        """
+        Decodes the latent [C, T, H, W] of one clip of a long video, continuing
+        the causal cache of the previous clips in `state` (a `CausalState`,
+        updated in place). Only the first clip starts with a single frame.
+        """
+        assert self.tiling is None, "clip-wise decoding does not tile"
+        with self.autocast():
+            return self.model.decode(z.unsqueeze(0), self.scale,
+                                     state).float().clamp_(-1, 1).squeeze(0)
+
+    def decode_stream(self, z):
+        """
+        Decodes a latent of shape [C, T, H, W] and yields its frames chunk by
+        chunk as [3, t, H, W] tensors while decoding continues. With tiling
+        enabled the whole video is yielded as a single chunk.
+        """
+        if self.tiling is not None:
+            yield self.decode([z])[0]
+            return
+        stream = self.model.decode_stream(z.unsqueeze(0), self.scale)
+        while True:
+            # keep autocast off while the caller holds a chunk, and grad mode
+            # is the caller's outside of the pipeline
+            with torch.no_grad(), self.autocast():
+                out = next(stream, None)
+            if out is None:
+                return
+            yield out.float().clamp_(-1, 1).squeeze(0)
@@ -23,10 +23,19 @@ from tqdm import tqdm
 
 from .distributed.fsdp import shard_model
 from .distributed.sequence_parallel import sp_attn_forward, sp_dit_forward
+from .distributed.sharded_checkpoint import (
+    find_fsdp_shards,
+    init_empty_model,
+    load_sharded_model,
+)
+from .distributed.shared_weights import SharedWeightStore
+from .distributed.vae_decode import distributed_decode, distributed_decode_clip
+from .distributed.t5_service import T5Client
 from .distributed.util import get_world_size
 from .modules.s2v.audio_encoder import AudioEncoder
 from .modules.s2v.model_s2v import WanModel_S2V, sp_attn_forward_s2v
 from .modules.t5 import T5EncoderModel
+from .modules.vae_cache import CausalState
 from .modules.vae2_1 import Wan2_1_VAE
 from .utils.fm_solvers import (
     FlowDPMSolverMultistepScheduler,
@@ -34,6 +43,8 @@ from .utils.fm_solvers import (
     retrieve_timesteps,
 )
 from .utils.fm_solvers_unipc import FlowUniPCMultistepScheduler
+from .utils.pinned_memory import PinnedMemoryPool
+from .utils.utils import load_in_parallel
 
 
 def load_safetensors(path):
@@ -58,6 +69,9 @@ class WanS2V:
         t5_cpu=False,
         init_on_cpu=True,
         convert_model_dtype=False,
+        parallel_load=True,
+        share_weights=False,
+        t5_server=None,
     ):
         r"""
         Initializes the image-to-video generation model components.
@@ -84,12 +98,22 @@ class WanS2V:
             convert_model_dtype (`bool`, *optional*, defaults to False):
                 Convert DiT model parameters dtype to 'config.param_dtype'.
                 Only works without FSDP.
+            parallel_load (`bool`, *optional*, defaults to True):
+                Load the model components concurrently on a thread pool.
+            share_weights (`bool`, *optional*, defaults to False):
+                Keep the host copies of T5 and CPU-resident DiT weights in a
+                node-local shared-memory store used by all workers on the node.
+            t5_server (`str`, *optional*, defaults to None):
+                Address of a node-local `T5Server` encoding the prompts in
+                place of an own T5 model.
         """
         self.device = torch.device(f"cuda:{device_id}")
         self.config = config
         self.rank = rank
-        self.t5_cpu = t5_cpu
+        # a T5 server leaves no local model to move to the GPU
+        self.t5_cpu = t5_cpu or t5_server is not None
         self.init_on_cpu = init_on_cpu
+        self.offload_pool = PinnedMemoryPool()
 
         self.num_train_timesteps = config.num_train_timesteps
         self.param_dtype = config.param_dtype
@@ -98,39 +122,78 @@ class WanS2V:
             self.init_on_cpu = False
 
         shard_fn = partial(shard_model, device_id=device_id)
-        self.text_encoder = T5EncoderModel(
-            text_len=config.text_len,
-            dtype=config.t5_dtype,
-            device=torch.device('cpu'),
-            checkpoint_path=os.path.join(checkpoint_dir, config.t5_checkpoint),
-            tokenizer_path=os.path.join(checkpoint_dir, config.t5_tokenizer),
-            shard_fn=shard_fn if t5_fsdp else None,
-        )
-
-        self.vae = Wan2_1_VAE(
-            vae_pth=os.path.join(checkpoint_dir, config.vae_checkpoint),
-            device=self.device)
 
-        logging.info(f"Creating WanModel from {checkpoint_dir}")
+        shard_dir = find_fsdp_shards(checkpoint_dir) if dit_fsdp else None
         if not dit_fsdp:
-            self.noise_model = WanModel_S2V.from_pretrained(
+            load_dit = partial(
+                WanModel_S2V.from_pretrained,
                 checkpoint_dir,
                 torch_dtype=self.param_dtype,
                 device_map=self.device)
+        elif shard_dir is not None:
+            load_dit = partial(
+                init_empty_model,
+                WanModel_S2V,
+                checkpoint_dir,
+                dtype=self.param_dtype)
         else:
-            self.noise_model = WanModel_S2V.from_pretrained(
-                checkpoint_dir, torch_dtype=self.param_dtype)
+            load_dit = partial(
+                WanModel_S2V.from_pretrained,
+                checkpoint_dir,
+                torch_dtype=self.param_dtype)
+
+        logging.info(f"Creating WanModel from {checkpoint_dir}")
+        components = load_in_parallel(
+            {
+                'text_encoder':
+                    partial(T5Client, t5_server) if t5_server is not None
+                    else partial(
+                        T5EncoderModel,
+                        text_len=config.text_len,
+                        dtype=config.t5_dtype,
+                        device=torch.device('cpu'),
+                        checkpoint_path=os.path.join(checkpoint_dir,
+                                                     config.t5_checkpoint),
+                        tokenizer_path=os.path.join(checkpoint_dir,
+                                                    config.t5_tokenizer)),
+                'vae':
+                    partial(
+                        Wan2_1_VAE,
+                        vae_pth=os.path.join(checkpoint_dir,
+                                             config.vae_checkpoint),
+                        device=self.device),
+                'noise_model':
+                    load_dit,
+                'audio_encoder':
+                    partial(
+                        AudioEncoder,
+                        model_id=os.path.join(
+                            checkpoint_dir, "wav2vec2-large-xlsr-53-english")),
+            },
+            parallel=parallel_load,
+            device=self.device)
+        self.text_encoder = components['text_encoder']
+        # FSDP wrapping runs collectives, keep it on this thread
+        if t5_fsdp:
+            self.text_encoder.shard(shard_fn)
+        self.vae = components['vae']
+        self.audio_encoder = components['audio_encoder']
 
         self.noise_model = self._configure_model(
-            model=self.noise_model,
+            model=components['noise_model'],
             use_sp=use_sp,
             dit_fsdp=dit_fsdp,
             shard_fn=shard_fn,
-            convert_model_dtype=convert_model_dtype)
+            convert_model_dtype=convert_model_dtype,
+            shard_dir=shard_dir)
 
-        self.audio_encoder = AudioEncoder(
-            model_id=os.path.join(checkpoint_dir,
-                                  "wav2vec2-large-xlsr-53-english"))
+        if share_weights:
+            store = SharedWeightStore()
+            if t5_server is None:
+                store.share(
+                    self.text_encoder.model,
+                    os.path.join(checkpoint_dir, config.t5_checkpoint))
+            store.share(self.noise_model, checkpoint_dir)
 
         if use_sp:
             self.sp_size = get_world_size()
@@ -143,8 +206,13 @@ class WanS2V:
         self.fps = config.sample_fps
         self.audio_sample_m = 0
 
-    def _configure_model(self, model, use_sp, dit_fsdp, shard_fn,
-                         convert_model_dtype):
+    def _configure_model(self,
+                         model,
+                         use_sp,
+                         dit_fsdp,
+                         shard_fn,
+                         convert_model_dtype,
+                         shard_dir=None):
         """
         Configures a model object. This includes setting evaluation modes,
         applying distributed parallel strategy, and handling device placement.
@@ -161,6 +229,9 @@ class WanS2V:
             convert_model_dtype (`bool`):
                 Convert DiT model parameters dtype to 'config.param_dtype'.
                 Only works without FSDP.
+            shard_dir (`str`, *optional*, defaults to None):
+                Directory of pre-sharded per-rank FSDP checkpoints. If given,
+                `model` must be empty and only the local shard is loaded.
 
         Returns:
             torch.nn.Module:
@@ -176,7 +247,11 @@ class WanS2V:
         if dist.is_initialized():
             dist.barrier()
 
-        if dit_fsdp:
+        if dit_fsdp and shard_dir is not None:
+            logging.info(f"Loading pre-sharded checkpoint from {shard_dir}")
+            model = load_sharded_model(model, shard_dir, shard_fn,
+                                       self.device.index)
+        elif dit_fsdp:
             model = shard_fn(model)
         else:
             if convert_model_dtype:
@@ -261,17 +336,13 @@ class WanS2V:
         cond = []
         for d, c in zip(default_value, cond_enable):
             if c:
-                map_value = torch.ones(
-                    map_shape, dtype=self.param_dtype, device=self.device) * d
-                cond_lat = torch.cat([
-                    map_value[:, :, 0:1].repeat(1, 1, motion_frames, 1, 1),
-                    map_value
-                ],
-                                     dim=2)
-                cond_lat = torch.stack(
-                    self.vae.encode(cond_lat.to(
-                        self.param_dtype)))[:, :, lat_motion_frames:].to(
-                            self.param_dtype)
+                # the map is constant, so is the motion prefix repeating its
+                # first frame
+                ch, t, h, w = map_shape
+                cond_lat = self.vae.encode_constant(
+                    [ch, motion_frames + t, h, w], d,
+                    dtype=self.param_dtype)[None, :, lat_motion_frames:].to(
+                        self.param_dtype)
 
                 cond.append(cond_lat)
         if len(cond) >= 1:
@@ -333,7 +404,12 @@ class WanS2V:
 
         return vr.get_batch(sampled_indices).asnumpy()
 
-    def load_pose_cond(self, pose_video, num_repeat, infer_frames, size):
+    def load_pose_cond(self,
+                       pose_video,
+                       num_repeat,
+                       infer_frames,
+                       size,
+                       max_batch=4):
         HEIGHT, WIDTH = size
         if not pose_video is None:
             pose_seq = self.read_last_n_frames(
@@ -360,19 +436,26 @@ class WanS2V:
 
             cond_tensors = torch.chunk(cond_tensor, num_repeat, dim=2)
         else:
-            cond_tensors = [-torch.ones([1, 3, infer_frames, HEIGHT, WIDTH])]
-
+            # constant -1 pose, with the repeated first frame prepended below
+            return [
+                self.vae.encode_constant(
+                    [3, infer_frames + 1, HEIGHT, WIDTH],
+                    -1.0,
+                    dtype=self.param_dtype)[None, :, 1:].cpu()
+            ]
+
+        # all clips have the same shape, encode them in batches of
+        # `max_batch` and keep only the current batch on the device
         COND = []
-        for r in range(len(cond_tensors)):
-            cond = cond_tensors[r]
-            cond = torch.cat([cond[:, :, 0:1].repeat(1, 1, 1, 1, 1), cond],
-                             dim=2)
-            cond_lat = torch.stack(
-                self.vae.encode(
-                    cond.to(dtype=self.param_dtype,
-                            device=self.device)))[:, :,
-                                                  1:].cpu()  # for mem save
-            COND.append(cond_lat)
+        for r in range(0, len(cond_tensors), max_batch):
+            conds = [
+                torch.cat([cond[0, :, 0:1], cond[0]], dim=1).to(
+                    dtype=self.param_dtype, device=self.device)
+                for cond in cond_tensors[r:r + max_batch]
+            ]
+            COND.extend(
+                cond_lat[None, :, 1:].cpu()  # for mem save
+                for cond_lat in self.vae.encode(conds))
         return COND
 
     def get_gen_size(self, size, max_area, ref_image_path, pre_video_path):
@@ -410,6 +493,9 @@ class WanS2V:
         seed=-1,
         offload_model=True,
         init_first_frame=False,
+        carry_vae_state=False,
+        callback=None,
+        callback_steps=1,
     ):
         r"""
         Generates video frames from input image and text prompt using diffusion process.
@@ -448,6 +534,16 @@ class WanS2V:
                 If True, offloads models to CPU during generation to save VRAM
             init_first_frame (`bool`, *optional*, defaults to False):
                 Whether to use the reference image as the first frame (i.e., standard image-to-video generation)
+            carry_vae_state (`bool`, *optional*, defaults to False):
+                Decode every clip after the first by continuing the causal VAE decoder state of the previous
+                clip instead of decoding the motion frames again. Faster, but the clip boundaries are decoded
+                from the generated latents rather than the re-encoded motion frames
+            callback (callable, *optional*, defaults to None):
+                Called as `callback(step, timestep, latent)` with the predicted
+                clean latent of the current clip every `callback_steps` steps,
+                the step counts restart with every clip. See `WanT2V.generate`.
+            callback_steps (`int`, *optional*, defaults to 1):
+                Sampling steps between two calls of `callback`.
 
         Returns:
             torch.Tensor:
@@ -496,9 +592,8 @@ class WanS2V:
             0) * 2 - 1.0  # b c 1 h w
         ref_pixel_values = ref_pixel_values.to(
             dtype=self.vae.dtype, device=self.vae.device)
-        ref_latents = torch.stack(self.vae.encode(ref_pixel_values))
 
-        # encode the motion latents
+        ref_latents = torch.stack(self.vae.encode(ref_pixel_values))
         videos_last_frames = motion_latents.detach()
         drop_first_motion = self.drop_first_motion
         if init_first_frame:
@@ -519,19 +614,30 @@ class WanS2V:
             n_prompt = self.sample_neg_prompt
 
         # preprocess
-        if not self.t5_cpu:
-            self.text_encoder.model.to(self.device)
-            context = self.text_encoder([input_prompt], self.device)
-            context_null = self.text_encoder([n_prompt], self.device)
+        # cached prompts need neither the model nor its transfer to the GPU
+        if not self.t5_cpu and not self.text_encoder.is_cached(
+            [input_prompt, n_prompt]):
+            self.offload_pool.load(
+                self.text_encoder.model, self.device, stage='t5')
+            context, context_null = self.text_encoder(
+                [input_prompt, n_prompt], self.device)
             if offload_model:
-                self.text_encoder.model.cpu()
+                self.offload_pool.offload(self.text_encoder.model, stage='t5')
         else:
-            context = self.text_encoder([input_prompt], torch.device('cpu'))
-            context_null = self.text_encoder([n_prompt], torch.device('cpu'))
-            context = [t.to(self.device) for t in context]
-            context_null = [t.to(self.device) for t in context_null]
+            context, context_null = self.text_encoder(
+                [input_prompt, n_prompt], torch.device('cpu'))
+            context = context.to(self.device)
+            context_null = context_null.to(self.device)
+        context, context_null = [context], [context_null]
 
         out = []
+        vae_state = CausalState() if carry_vae_state else None
+        if self.sp_size > 1:
+            # latents are identical on all ranks, share the decode among them
+            vae_decode = partial(distributed_decode, self.vae, dst=None)
+            vae_decode_clip = partial(distributed_decode_clip, self.vae)
+        else:
+            vae_decode, vae_decode_clip = self.vae.decode, self.vae.decode_clip
         # evaluation mode
         with (
                 torch.amp.autocast('cuda', dtype=self.param_dtype),
@@ -611,7 +717,8 @@ class WanS2V:
                         "drop_motion_frames": drop_first_motion and r == 0,
                     }
                 if offload_model or self.init_on_cpu:
-                    self.noise_model.to(self.device)
+                    self.offload_pool.load(
+                        self.noise_model, self.device, stage='dit')
                     torch.cuda.empty_cache()
 
                 for i, t in enumerate(tqdm(timesteps)):
@@ -633,6 +740,12 @@ class WanS2V:
                     else:
                         noise_pred = noise_pred_cond
 
+                    if callback is not None and (i + 1) % callback_steps == 0:
+                        # flow matching, x_t = (1 - sigma) * x_0 + sigma * noise
+                        callback(
+                            i, t, latents[0] -
+                            t / self.num_train_timesteps * noise_pred[0])
+
                     temp_x0 = sample_scheduler.step(
                         noise_pred[0].unsqueeze(0),
                         t,
@@ -642,7 +755,7 @@ class WanS2V:
                     latents[0] = temp_x0.squeeze(0)
 
                 if offload_model:
-                    self.noise_model.cpu()
+                    self.offload_pool.offload(self.noise_model, stage='dit')
                     torch.cuda.synchronize()
                     torch.cuda.empty_cache()
                 latents = torch.stack(latents)
@@ -650,7 +763,17 @@ class WanS2V:
                     decode_latents = torch.cat([motion_latents, latents], dim=2)
                 else:
                     decode_latents = torch.cat([ref_latents, latents], dim=2)
-                image = torch.stack(self.vae.decode(decode_latents))
+                if vae_state is None:
+                    image = torch.stack(vae_decode(list(decode_latents)))
+                elif vae_state.started:
+                    # continue the decoder stream of the previous clip, the
+                    # motion frames are not decoded again
+                    image = vae_decode_clip(latents[0],
+                                            vae_state.to(self.device))[None]
+                else:
+                    image = vae_decode_clip(decode_latents[0], vae_state)[None]
+                if vae_state is not None and offload_model:
+                    vae_state.to('cpu')
                 image = image[:, :, -(infer_frames):]
                 if (drop_first_motion and r == 0):
                     image = image[:, :, 3:]
@@ -665,14 +788,16 @@ class WanS2V:
                     dtype=motion_latents.dtype, device=motion_latents.device)
                 motion_latents = torch.stack(
                     self.vae.encode(videos_last_frames))
-                out.append(image.cpu())
+                out.append(self.offload_pool.to_host(image, stage='frames'))
 
+        self.offload_pool.synchronize()
         videos = torch.cat(out, dim=2)
         del noise, latents
         del sample_scheduler
         if offload_model:
             gc.collect()
             torch.cuda.synchronize()
+        self.offload_pool.log_stats()
         if dist.is_initialized():
             dist.barrier()
 
@@ -18,7 +18,15 @@ from tqdm import tqdm
 
 from .distributed.fsdp import shard_model
 from .distributed.sequence_parallel import sp_attn_forward, sp_dit_forward
+from .distributed.sharded_checkpoint import (
+    find_fsdp_shards,
+    init_empty_model,
+    load_sharded_model,
+)
+from .distributed.shared_weights import SharedWeightStore
+from .distributed.t5_service import T5Client
 from .distributed.util import get_world_size
+from .distributed.vae_decode import distributed_decode
 from .modules.model import WanModel
 from .modules.t5 import T5EncoderModel
 from .modules.vae2_2 import Wan2_2_VAE
@@ -28,7 +36,8 @@ from .utils.fm_solvers import (
     retrieve_timesteps,
 )
 from .utils.fm_solvers_unipc import FlowUniPCMultistepScheduler
-from .utils.utils import best_output_size, masks_like
+from .utils.pinned_memory import PinnedMemoryPool
+from .utils.utils import best_output_size, load_in_parallel, masks_like
 
 
 class WanTI2V:
@@ -45,6 +54,9 @@ class WanTI2V:
         t5_cpu=False,
         init_on_cpu=True,
         convert_model_dtype=False,
+        parallel_load=True,
+        share_weights=False,
+        t5_server=None,
     ):
         r"""
         Initializes the Wan text-to-video generation model components.
@@ -71,12 +83,22 @@ class WanTI2V:
             convert_model_dtype (`bool`, *optional*, defaults to False):
                 Convert DiT model parameters dtype to 'config.param_dtype'.
                 Only works without FSDP.
+            parallel_load (`bool`, *optional*, defaults to True):
+                Load the model components concurrently on a thread pool.
+            share_weights (`bool`, *optional*, defaults to False):
+                Keep the host copies of T5 and CPU-resident DiT weights in a
+                node-local shared-memory store used by all workers on the node.
+            t5_server (`str`, *optional*, defaults to None):
+                Address of a node-local `T5Server` encoding the prompts in
+                place of an own T5 model.
         """
         self.device = torch.device(f"cuda:{device_id}")
         self.config = config
         self.rank = rank
-        self.t5_cpu = t5_cpu
+        # a T5 server leaves no local model to move to the GPU
+        self.t5_cpu = t5_cpu or t5_server is not None
         self.init_on_cpu = init_on_cpu
+        self.offload_pool = PinnedMemoryPool()
 
         self.num_train_timesteps = config.num_train_timesteps
         self.param_dtype = config.param_dtype
@@ -85,28 +107,61 @@ class WanTI2V:
             self.init_on_cpu = False
 
         shard_fn = partial(shard_model, device_id=device_id)
-        self.text_encoder = T5EncoderModel(
-            text_len=config.text_len,
-            dtype=config.t5_dtype,
-            device=torch.device('cpu'),
-            checkpoint_path=os.path.join(checkpoint_dir, config.t5_checkpoint),
-            tokenizer_path=os.path.join(checkpoint_dir, config.t5_tokenizer),
-            shard_fn=shard_fn if t5_fsdp else None)
-
         self.vae_stride = config.vae_stride
         self.patch_size = config.patch_size
-        self.vae = Wan2_2_VAE(
-            vae_pth=os.path.join(checkpoint_dir, config.vae_checkpoint),
-            device=self.device)
+
+        shard_dir = find_fsdp_shards(checkpoint_dir) if dit_fsdp else None
+        if shard_dir is not None:
+            load_dit = partial(init_empty_model, WanModel, checkpoint_dir)
+        else:
+            load_dit = partial(WanModel.from_pretrained, checkpoint_dir)
 
         logging.info(f"Creating WanModel from {checkpoint_dir}")
-        self.model = WanModel.from_pretrained(checkpoint_dir)
+        components = load_in_parallel(
+            {
+                'text_encoder':
+                    partial(T5Client, t5_server) if t5_server is not None
+                    else partial(
+                        T5EncoderModel,
+                        text_len=config.text_len,
+                        dtype=config.t5_dtype,
+                        device=torch.device('cpu'),
+                        checkpoint_path=os.path.join(checkpoint_dir,
+                                                     config.t5_checkpoint),
+                        tokenizer_path=os.path.join(checkpoint_dir,
+                                                    config.t5_tokenizer)),
+                'vae':
+                    partial(
+                        Wan2_2_VAE,
+                        vae_pth=os.path.join(checkpoint_dir,
+                                             config.vae_checkpoint),
+                        device=self.device),
+                'model':
+                    load_dit,
+            },
+            parallel=parallel_load,
+            device=self.device)
+        self.text_encoder = components['text_encoder']
+        # FSDP wrapping runs collectives, keep it on this thread
+        if t5_fsdp:
+            self.text_encoder.shard(shard_fn)
+        self.vae = components['vae']
+
         self.model = self._configure_model(
-            model=self.model,
+            model=components['model'],
             use_sp=use_sp,
             dit_fsdp=dit_fsdp,
             shard_fn=shard_fn,
-            convert_model_dtype=convert_model_dtype)
+            convert_model_dtype=convert_model_dtype,
+            shard_dir=shard_dir)
+
+        if share_weights:
+            store = SharedWeightStore()
+            if t5_server is None:
+                store.share(
+                    self.text_encoder.model,
+                    os.path.join(checkpoint_dir, config.t5_checkpoint))
+            store.share(self.model, checkpoint_dir)
 
         if use_sp:
             self.sp_size = get_world_size()
@@ -115,8 +170,13 @@ class WanTI2V:
 
         self.sample_neg_prompt = config.sample_neg_prompt
 
-    def _configure_model(self, model, use_sp, dit_fsdp, shard_fn,
-                         convert_model_dtype):
+    def _configure_model(self,
+                         model,
+                         use_sp,
+                         dit_fsdp,
+                         shard_fn,
+                         convert_model_dtype,
+                         shard_dir=None):
         """
         Configures a model object. This includes setting evaluation modes,
         applying distributed parallel strategy, and handling device placement.
@@ -133,6 +193,9 @@ class WanTI2V:
             convert_model_dtype (`bool`):
                 Convert DiT model parameters dtype to 'config.param_dtype'.
                 Only works without FSDP.
+            shard_dir (`str`, *optional*, defaults to None):
+                Directory of pre-sharded per-rank FSDP checkpoints. If given,
+                `model` must be empty and only the local shard is loaded.
 
         Returns:
             torch.nn.Module:
@@ -149,7 +212,11 @@ class WanTI2V:
         if dist.is_initialized():
             dist.barrier()
 
-        if dit_fsdp:
+        if dit_fsdp and shard_dir is not None:
+            logging.info(f"Loading pre-sharded checkpoint from {shard_dir}")
+            model = load_sharded_model(model, shard_dir, shard_fn,
+                                       self.device.index)
+        elif dit_fsdp:
             model = shard_fn(model)
         else:
             if convert_model_dtype:
@@ -171,7 +238,10 @@ class WanTI2V:
                  guide_scale=5.0,
                  n_prompt="",
                  seed=-1,
-                 offload_model=True):
+                 offload_model=True,
+                 callback=None,
+                 callback_steps=1,
+                 stream=False):
         r"""
         Generates video frames from text prompt using diffusion process.
 
@@ -200,6 +270,18 @@ class WanTI2V:
                 Random seed for noise generation. If -1, use random seed.
             offload_model (`bool`, *optional*, defaults to True):
                 If True, offloads models to CPU during generation to save VRAM
+            callback (callable, *optional*, defaults to None):
+                Called as `callback(step, timestep, latent)` with the predicted
+                clean latent every `callback_steps` steps, e.g. the callback of
+                a `LatentPreviewer` for progress previews.
+            callback_steps (`int`, *optional*, defaults to 1):
+                Sampling steps between two calls of `callback`.
+            stream (`bool`, *optional*, defaults to False):
+                Return an iterator over frame chunks [C, t, H, W] that decodes
+                the video while it is consumed, e.g. by `save_video`, so the
+                whole decoded video is never held in memory. With sequence
+                parallelism the video is decoded at once and is the only
+                chunk.
 
         Returns:
             torch.Tensor:
@@ -222,7 +304,10 @@ class WanTI2V:
                 guide_scale=guide_scale,
                 n_prompt=n_prompt,
                 seed=seed,
-                offload_model=offload_model)
+                offload_model=offload_model,
+                callback=callback,
+                callback_steps=callback_steps,
+                stream=stream)
         # t2v
         return self.t2v(
             input_prompt=input_prompt,
@@ -234,7 +319,10 @@ class WanTI2V:
             guide_scale=guide_scale,
             n_prompt=n_prompt,
             seed=seed,
-            offload_model=offload_model)
+            offload_model=offload_model,
+            callback=callback,
+            callback_steps=callback_steps,
+            stream=stream)
 
     def t2v(self,
             input_prompt,
@@ -246,7 +334,10 @@ class WanTI2V:
             guide_scale=5.0,
             n_prompt="",
             seed=-1,
-            offload_model=True):
+            offload_model=True,
+            callback=None,
+            callback_steps=1,
+            stream=False):
         r"""
         Generates video frames from text prompt using diffusion process.
 
@@ -271,6 +362,18 @@ class WanTI2V:
                 Random seed for noise generation. If -1, use random seed.
             offload_model (`bool`, *optional*, defaults to True):
                 If True, offloads models to CPU during generation to save VRAM
+            callback (callable, *optional*, defaults to None):
+                Called as `callback(step, timestep, latent)` with the predicted
+                clean latent every `callback_steps` steps, e.g. the callback of
+                a `LatentPreviewer` for progress previews.
+            callback_steps (`int`, *optional*, defaults to 1):
+                Sampling steps between two calls of `callback`.
+            stream (`bool`, *optional*, defaults to False):
+                Return an iterator over frame chunks [C, t, H, W] that decodes
+                the video while it is consumed, e.g. by `save_video`, so the
+                whole decoded video is never held in memory. With sequence
+                parallelism the video is decoded at once and is the only
+                chunk.
 
         Returns:
             torch.Tensor:
@@ -296,17 +399,21 @@ class WanTI2V:
         seed_g = torch.Generator(device=self.device)
         seed_g.manual_seed(seed)
 
-        if not self.t5_cpu:
-            self.text_encoder.model.to(self.device)
-            context = self.text_encoder([input_prompt], self.device)
-            context_null = self.text_encoder([n_prompt], self.device)
+        # cached prompts need neither the model nor its transfer to the GPU
+        if not self.t5_cpu and not self.text_encoder.is_cached(
+            [input_prompt, n_prompt]):
+            self.offload_pool.load(
+                self.text_encoder.model, self.device, stage='t5')
+            context, context_null = self.text_encoder(
+                [input_prompt, n_prompt], self.device)
             if offload_model:
-                self.text_encoder.model.cpu()
+                self.offload_pool.offload(self.text_encoder.model, stage='t5')
         else:
-            context = self.text_encoder([input_prompt], torch.device('cpu'))
-            context_null = self.text_encoder([n_prompt], torch.device('cpu'))
-            context = [t.to(self.device) for t in context]
-            context_null = [t.to(self.device) for t in context_null]
+            context, context_null = self.text_encoder(
+                [input_prompt, n_prompt], torch.device('cpu'))
+            context = context.to(self.device)
+            context_null = context_null.to(self.device)
+        context, context_null = [context], [context_null]
 
         noise = [
             torch.randn(
@@ -361,10 +468,10 @@ class WanTI2V:
             arg_null = {'context': context_null, 'seq_len': seq_len}
 
             if offload_model or self.init_on_cpu:
-                self.model.to(self.device)
+                self.offload_pool.load(self.model, self.device, stage='dit')
                 torch.cuda.empty_cache()
 
-            for _, t in enumerate(tqdm(timesteps)):
+            for step, t in enumerate(tqdm(timesteps)):
                 latent_model_input = latents
                 timestep = [t]
 
@@ -385,6 +492,12 @@ class WanTI2V:
                 noise_pred = noise_pred_uncond + guide_scale * (
                     noise_pred_cond - noise_pred_uncond)
 
+                if callback is not None and (step + 1) % callback_steps == 0:
+                    # flow matching, x_t = (1 - sigma) * x_0 + sigma * noise
+                    callback(
+                        step, t, latents[0] -
+                        t / self.num_train_timesteps * noise_pred)
+
                 temp_x0 = sample_scheduler.step(
                     noise_pred.unsqueeze(0),
                     t,
@@ -394,10 +507,18 @@ class WanTI2V:
                 latents = [temp_x0.squeeze(0)]
             x0 = latents
             if offload_model:
-                self.model.cpu()
+                self.offload_pool.offload(self.model, stage='dit')
                 torch.cuda.synchronize()
                 torch.cuda.empty_cache()
-            if self.rank == 0:
+            if self.sp_size > 1:
+                # latents are identical on all ranks, share the decode among them
+                videos = distributed_decode(self.vae, x0)
+                if stream and videos is not None:
+                    videos = [iter(videos)]
+            elif self.rank == 0 and stream:
+                # decoded while the caller consumes the chunks
+                videos = [self.vae.decode_stream(x0[0])]
+            elif self.rank == 0:
                 videos = self.vae.decode(x0)
 
         del noise, latents
@@ -405,6 +526,7 @@ class WanTI2V:
         if offload_model:
             gc.collect()
             torch.cuda.synchronize()
+        self.offload_pool.log_stats()
         if dist.is_initialized():
             dist.barrier()
 
@@ -421,7 +543,10 @@ class WanTI2V:
             guide_scale=5.0,
             n_prompt="",
             seed=-1,
-            offload_model=True):
+            offload_model=True,
+            callback=None,
+            callback_steps=1,
+            stream=False):
         r"""
         Generates video frames from input image and text prompt using diffusion process.
 
@@ -449,6 +574,18 @@ class WanTI2V:
                 Random seed for noise generation. If -1, use random seed
             offload_model (`bool`, *optional*, defaults to True):
                 If True, offloads models to CPU during generation to save VRAM
+            callback (callable, *optional*, defaults to None):
+                Called as `callback(step, timestep, latent)` with the predicted
+                clean latent every `callback_steps` steps, e.g. the callback of
+                a `LatentPreviewer` for progress previews.
+            callback_steps (`int`, *optional*, defaults to 1):
+                Sampling steps between two calls of `callback`.
+            stream (`bool`, *optional*, defaults to False):
+                Return an iterator over frame chunks [C, t, H, W] that decodes
+                the video while it is consumed, e.g. by `save_video`, so the
+                whole decoded video is never held in memory. With sequence
+                parallelism the video is decoded at once and is the only
+                chunk.
 
         Returns:
             torch.Tensor:
@@ -497,17 +634,21 @@ class WanTI2V:
             n_prompt = self.sample_neg_prompt
 
         # preprocess
-        if not self.t5_cpu:
-            self.text_encoder.model.to(self.device)
-            context = self.text_encoder([input_prompt], self.device)
-            context_null = self.text_encoder([n_prompt], self.device)
+        # cached prompts need neither the model nor its transfer to the GPU
+        if not self.t5_cpu and not self.text_encoder.is_cached(
+            [input_prompt, n_prompt]):
+            self.offload_pool.load(
+                self.text_encoder.model, self.device, stage='t5')
+            context, context_null = self.text_encoder(
+                [input_prompt, n_prompt], self.device)
             if offload_model:
-                self.text_encoder.model.cpu()
+                self.offload_pool.offload(self.text_encoder.model, stage='t5')
         else:
-            context = self.text_encoder([input_prompt], torch.device('cpu'))
-            context_null = self.text_encoder([n_prompt], torch.device('cpu'))
-            context = [t.to(self.device) for t in context]
-            context_null = [t.to(self.device) for t in context_null]
+            context, context_null = self.text_encoder(
+                [input_prompt, n_prompt], torch.device('cpu'))
+            context = context.to(self.device)
+            context_null = context_null.to(self.device)
+        context, context_null = [context], [context_null]
 
         z = self.vae.encode([img])
 
@@ -561,10 +702,10 @@ class WanTI2V:
             }
 
             if offload_model or self.init_on_cpu:
-                self.model.to(self.device)
+                self.offload_pool.load(self.model, self.device, stage='dit')
                 torch.cuda.empty_cache()
 
-            for _, t in enumerate(tqdm(timesteps)):
+            for step, t in enumerate(tqdm(timesteps)):
                 latent_model_input = [latent.to(self.device)]
                 timestep = [t]
 
@@ -588,6 +729,12 @@ class WanTI2V:
                 noise_pred = noise_pred_uncond + guide_scale * (
                     noise_pred_cond - noise_pred_uncond)
 
+                if callback is not None and (step + 1) % callback_steps == 0:
+                    # flow matching, x_t = (1 - sigma) * x_0 + sigma * noise
+                    callback(
+                        step, t, latent -
+                        t / self.num_train_timesteps * noise_pred)
+
                 temp_x0 = sample_scheduler.step(
                     noise_pred.unsqueeze(0),
                     t,
@@ -601,11 +748,19 @@ class WanTI2V:
                 del latent_model_input, timestep
 
             if offload_model:
-                self.model.cpu()
+                self.offload_pool.offload(self.model, stage='dit')
                 torch.cuda.synchronize()
                 torch.cuda.empty_cache()
 
-            if self.rank == 0:
+            if self.sp_size > 1:
+                # latents are identical on all ranks, share the decode among them
+                videos = distributed_decode(self.vae, x0)
+                if stream and videos is not None:
+                    videos = [iter(videos)]
+            elif self.rank == 0 and stream:
+                # decoded while the caller consumes the chunks
+                videos = [self.vae.decode_stream(x0[0])]
+            elif self.rank == 0:
                 videos = self.vae.decode(x0)
 
         del noise, latent, x0
@@ -613,6 +768,7 @@ class WanTI2V:
         if offload_model:
             gc.collect()
             torch.cuda.synchronize()
+        self.offload_pool.log_stats()
         if dist.is_initialized():
             dist.barrier()
 
@@ -0,0 +1,148 @@
+# Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
+"""
+Local stub of the DashScope text-generation API for testing and timing
+`DashScopePromptExpander` without an API key.
+
+The stub answers text and multimodal requests after `--latency` seconds with
+the prompt in upper case and fails a `--failure_rate` share of the requests
+with HTTP 429. `tests/test_dashscope.py` runs it in-process. With
+`--benchmark N` it extends N prompts through `extend_batch` against itself
+and reports the time, failures and the number of connections used.
+
+Usage:
+    python wan/utils/dashscope_stub.py --benchmark 200 --max_workers 16
+    python wan/utils/dashscope_stub.py --port 8123    # then
+    DASH_API_URL=http://127.0.0.1:8123/api/v1 DASH_API_KEY=stub python ...
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(
+    0, os.path.dirname(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__)))))
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    # keep-alive, so reused sessions are visible in `connections`
+    protocol_version = 'HTTP/1.1'
+    latency = 0.5
+    failure_rate = 0.0
+    # the first `fail_first` requests fail as well
+    fail_first = 0
+    connections = set()
+    requests = 0
+    lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, body):
+        data = json.dumps(body, ensure_ascii=False).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        with self.lock:
+            StubHandler.connections.add(self.client_address)
+            StubHandler.requests += 1
+            fail = StubHandler.requests <= StubHandler.fail_first
+        time.sleep(self.latency)
+        if not self.path.endswith(('/text-generation/generation',
+                                   '/multimodal-generation/generation')):
+            self._reply(404, {'message': f'unknown path {self.path}'})
+        elif fail or random.random() < self.failure_rate:
+            self._reply(429, {'code': 'Throttling', 'message': 'stub'})
+        else:
+            content = body['input']['messages'][-1]['content']
+            if isinstance(content, list):
+                # multimodal, text and image parts
+                content = [{'text': content[0]['text'].upper()}]
+            else:
+                content = content.upper()
+            self._reply(
+                200, {
+                    'output': {
+                        'choices': [{
+                            'finish_reason': 'stop',
+                            'message': {
+                                'role': 'assistant',
+                                'content': content
+                            }
+                        }]
+                    },
+                    'request_id': str(StubHandler.requests)
+                })
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(
+        description="Stub DashScope server for prompt extension")
+    parser.add_argument(
+        "--port", type=int, default=0, help="Port, a free one if 0.")
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.5,
+        help="Seconds before every answer.")
+    parser.add_argument(
+        "--failure_rate",
+        type=float,
+        default=0.0,
+        help="Share of requests answered with HTTP 429.")
+    parser.add_argument(
+        "--benchmark",
+        type=int,
+        default=None,
+        help="Extend this many prompts against the stub and exit.")
+    parser.add_argument(
+        "--max_workers",
+        type=int,
+        default=8,
+        help="Concurrent requests of the benchmark.")
+    parser.add_argument(
+        "--rate_limit",
+        type=float,
+        default=None,
+        help="Requests per second of the benchmark.")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = _parse_args()
+    StubHandler.latency = args.latency
+    StubHandler.failure_rate = args.failure_rate
+    server = ThreadingHTTPServer(('127.0.0.1', args.port), StubHandler)
+    server.daemon_threads = True
+    url = f"http://127.0.0.1:{server.server_address[1]}/api/v1"
+    if args.benchmark is None:
+        print(f"Serving the DashScope stub on {url}")
+        server.serve_forever()
+
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    os.environ['DASH_API_URL'] = url
+    from wan.utils.prompt_extend import DashScopePromptExpander
+    expander = DashScopePromptExpander(
+        api_key='stub',
+        task='t2v-A14B',
+        max_workers=args.max_workers,
+        rate_limit=args.rate_limit,
+        backoff=0.1)
+    prompts = [f'prompt {i}' for i in range(args.benchmark)]
+    start = time.perf_counter()
+    outputs = expander.extend_batch(prompts, seed=0)
+    elapsed = time.perf_counter() - start
+    failed = sum(not u.status for u in outputs)
+    print(f"{len(prompts)} prompts in {elapsed:.2f} s, {failed} failed, "
+          f"{StubHandler.requests} requests on "
+          f"{len(StubHandler.connections)} connections")
+    server.shutdown()
@@ -0,0 +1,120 @@
+# Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
+"""
+Fits the linear latent-to-RGB preview decoder (`LatentPreviewer`) to a VAE.
+
+The VAE runs on the CPU. Images given with `--images` are used as single-frame
+videos, and `--num_synthetic` smooth random colour videos are added, so the
+fit also works without any data at hand.
+
+Usage:
+    python wan/utils/fit_preview.py --vae 2.2 \
+        --vae_checkpoint ./Wan2.2-TI2V-5B/Wan2.2_VAE.pth \
+        --images ./examples/*.jpg --output ./wan2.2_preview.pt
+"""
+import argparse
+import logging
+import os
+import sys
+
+import torch
+import torch.nn.functional as F
+from PIL import Image
+
+sys.path.insert(
+    0, os.path.dirname(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__)))))
+
+from wan.modules.vae_preview import fit_previewer  # noqa: E402
+
+
+def load_image(path, size):
+    image = Image.open(path).convert('RGB').resize((size, size),
+                                                   Image.BICUBIC)
+    video = torch.frombuffer(bytearray(image.tobytes()), dtype=torch.uint8)
+    video = video.view(size, size, 3).permute(2, 0, 1)[:, None]
+    return video.float() / 127.5 - 1
+
+
+def synthetic_video(size, num_frames, generator):
+    """
+    Returns a smooth random colour video [3, num_frames, size, size].
+    """
+    grid = torch.rand(1, 3, 2, 4, 4, generator=generator) * 2 - 1
+    video = F.interpolate(
+        grid, size=(num_frames, size, size), mode='trilinear',
+        align_corners=True)[0]
+    return video.clamp_(-1, 1)
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(
+        description="Fit a latent-to-RGB preview decoder to a Wan VAE")
+    parser.add_argument(
+        "--vae",
+        type=str,
+        default="2.1",
+        choices=["2.1", "2.2"],
+        help="The VAE version.")
+    parser.add_argument(
+        "--vae_checkpoint",
+        type=str,
+        required=True,
+        help="Path of the VAE checkpoint.")
+    parser.add_argument(
+        "--images",
+        type=str,
+        nargs='*',
+        default=[],
+        help="Images to fit on.")
+    parser.add_argument(
+        "--num_synthetic",
+        type=int,
+        default=64,
+        help="Number of synthetic colour videos to fit on.")
+    parser.add_argument(
+        "--size",
+        type=int,
+        default=256,
+        help="Side length of the fitting videos.")
+    parser.add_argument(
+        "--frame_num",
+        type=int,
+        default=5,
+        help="Frames of the synthetic videos, should be 4n+1.")
+    parser.add_argument(
+        "--output",
+        type=str,
+        required=True,
+        help="Where to save the fitted previewer.")
+    parser.add_argument(
+        "--seed", type=int, default=0, help="Seed of the synthetic videos.")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="[%(asctime)s] %(levelname)s: %(message)s",
+        handlers=[logging.StreamHandler(stream=sys.stdout)])
+    args = _parse_args()
+
+    if args.vae == "2.1":
+        from wan.modules.vae2_1 import Wan2_1_VAE
+        vae = Wan2_1_VAE(vae_pth=args.vae_checkpoint, device='cpu')
+    else:
+        from wan.modules.vae2_2 import Wan2_2_VAE
+        vae = Wan2_2_VAE(vae_pth=args.vae_checkpoint, device='cpu')
+    assert args.size % vae.spatial_stride == 0, \
+        f"--size must be a multiple of {vae.spatial_stride}"
+
+    generator = torch.Generator().manual_seed(args.seed)
+    videos = [load_image(path, args.size) for path in args.images]
+    videos += [
+        synthetic_video(args.size, args.frame_num, generator)
+        for _ in range(args.num_synthetic)
+    ]
+    logging.info(f"Fitting the preview decoder on {len(videos)} videos.")
+
+    previewer = fit_previewer(vae, videos)
+    previewer.save(args.output)
+    logging.info(f"Saved the preview decoder to {args.output}.")
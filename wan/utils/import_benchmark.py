@@ -0,0 +1,110 @@
+# Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
+"""
+Import-time benchmark for the `wan` package.
+
+Every target is imported in a fresh interpreter under `python -X importtime`,
+the best wall time over `--repeat` runs is reported together with the most
+expensive modules of the fastest run.
+
+Usage:
+    python wan/utils/import_benchmark.py --targets wan t2v s2v --top 15
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+TARGETS = {
+    'wan': 'import wan',
+    'modules': 'import wan.modules',
+    't2v': 'import wan; wan.WanT2V',
+    'i2v': 'import wan; wan.WanI2V',
+    'ti2v': 'import wan; wan.WanTI2V',
+    's2v': 'import wan; wan.WanS2V',
+    'animate': 'import wan; wan.WanAnimate',
+    'generate': 'import generate',
+}
+
+REPO_ROOT = os.path.dirname(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def parse_importtime(stderr):
+    """
+    Parses `-X importtime` output into `(module, self_us, cumulative_us)`.
+    """
+    records = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue
+        records.append((fields[2].strip(), int(fields[0]), int(fields[1])))
+    return records
+
+
+def run_target(code, repeat=3):
+    """
+    Imports `code` in `repeat` fresh interpreters.
+
+    Returns:
+        `tuple[float, list]`: Best wall time in seconds and the parsed
+        importtime records of that run.
+    """
+    best_time, best_records = None, None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                                cwd=REPO_ROOT,
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE,
+                                text=True)
+        elapsed = time.perf_counter() - start
+        if result.returncode != 0:
+            raise RuntimeError(f"'{code}' failed:\n{result.stderr[-2000:]}")
+        if best_time is None or elapsed < best_time:
+            best_time, best_records = elapsed, parse_importtime(result.stderr)
+    return best_time, best_records
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(
+        description="Report the import cost of wan pipelines")
+    parser.add_argument(
+        "--targets",
+        type=str,
+        nargs='+',
+        default=list(TARGETS),
+        choices=list(TARGETS),
+        help="The imports to measure.")
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=3,
+        help="Number of fresh interpreters per target, the best is kept.")
+    parser.add_argument(
+        "--top",
+        type=int,
+        default=10,
+        help="Number of most expensive modules to list per target.")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = _parse_args()
+    summary = []
+    for name in args.targets:
+        wall, records = run_target(TARGETS[name], args.repeat)
+        summary.append((name, wall, len(records)))
+        print(f"\n== {name}: `{TARGETS[name]}` {wall:.3f}s wall, "
+              f"{len(records)} modules")
+        print(f"{'cumulative [ms]':>16} {'self [ms]':>10}  module")
+        for module, self_us, cum_us in sorted(
+                records, key=lambda r: r[2], reverse=True)[:args.top]:
+            print(f"{cum_us / 1e3:16.1f} {self_us / 1e3:10.1f}  {module}")
+
+    print(f"\n{'target':<10} {'wall [s]':>9} {'modules':>8}")
+    for name, wall, num_modules in summary:
+        print(f"{name:<10} {wall:9.3f} {num_modules:8d}")
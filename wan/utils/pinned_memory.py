@@ -0,0 +1,178 @@
+# Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
+import logging
+from collections import defaultdict
+
+import torch
+
+__all__ = ['PinnedMemoryPool']
+
+
+class PinnedMemoryPool:
+    """
+    Page-locked host arena for offloading models and large intermediates.
+
+    Offloaded parameters and buffers are parked in pinned host tensors that are
+    kept across offload cycles, so every swap is a DMA transfer on a dedicated
+    copy stream instead of a pageable `.cpu()` / `.to(device)`. With
+    `readonly=True` (frozen inference weights) the host copy stays valid while
+    the module is on the GPU, and offloading it again does not copy anything.
+    """
+
+    def __init__(self, readonly=True):
+        r"""
+        Args:
+            readonly (`bool`, *optional*, defaults to True):
+                Assume module weights are not modified while on the device and
+                skip the device-to-host copy when a valid host copy exists.
+        """
+        self.readonly = readonly
+        self._host = {}
+        self._streams = {}
+        self._pending = []
+        self.stats = defaultdict(lambda: defaultdict(int))
+
+    @staticmethod
+    def _tensors(module):
+        seen = set()
+        for m in module.modules():
+            for t in list(m._parameters.values()) + list(m._buffers.values()):
+                if t is not None and id(t) not in seen:
+                    seen.add(id(t))
+                    yield t
+
+    @staticmethod
+    def _moved(module):
+        # `t.data` bypasses `Module._apply`, run it with the identity so that
+        # modules caching device tensors (e.g. `T5RelativeEmbedding`) drop them
+        module._apply(lambda t: t)
+
+    def _copy_stream(self, device):
+        if device not in self._streams:
+            self._streams[device] = torch.cuda.Stream(device)
+        return self._streams[device]
+
+    def _host_copy(self, t):
+        entry = self._host.get(id(t))
+        if entry is None or entry[1].shape != t.shape or entry[
+                1].dtype != t.dtype:
+            return None
+        return entry[1]
+
+    def load(self, module, device, stage='default'):
+        """
+        Moves the parameters and buffers of `module` to `device`.
+        """
+        device = torch.device(device)
+        if device.type != 'cuda':
+            return module.to(device)
+        tensors = [t for t in self._tensors(module) if t.device.type == 'cpu']
+        if not tensors:
+            return module
+
+        hosts = []
+        for t in tensors:
+            host = self._host_copy(t)
+            if host is None or host.data_ptr() != t.data.data_ptr():
+                # pinned or shared (see SharedWeightStore) host memory is
+                # used in place, anything else gets a pinned copy
+                if t.data.is_pinned() or t.data.is_shared():
+                    host = t.data
+                else:
+                    host = t.data.pin_memory()
+                    # release the pageable original now rather than after
+                    # the whole module is pinned
+                    t.data = host
+                self._host[id(t)] = (t, host)
+            hosts.append(host)
+
+        current = torch.cuda.current_stream(device)
+        stream = self._copy_stream(device)
+        stream.wait_stream(current)
+        targets = [torch.empty_like(h, device=device) for h in hosts]
+        with torch.cuda.stream(stream):
+            for host, target in zip(hosts, targets):
+                target.copy_(host, non_blocking=True)
+            event = stream.record_event()
+        current.wait_event(event)
+
+        for t, target in zip(tensors, targets):
+            t.data = target
+        self._moved(module)
+        self.stats[stage]['h2d'] += sum(h.numel() * h.element_size()
+                                        for h in hosts)
+        return module
+
+    def offload(self, module, stage='default'):
+        """
+        Moves the parameters and buffers of `module` to pinned host memory.
+        """
+        tensors = [t for t in self._tensors(module) if t.device.type == 'cuda']
+        if not tensors:
+            return module
+        device = tensors[0].device
+
+        stream = self._copy_stream(device)
+        stream.wait_stream(torch.cuda.current_stream(device))
+        hosts, moved, reused = [], 0, 0
+        with torch.cuda.stream(stream):
+            for t in tensors:
+                host = self._host_copy(t)
+                nbytes = t.numel() * t.element_size()
+                if host is not None and self.readonly:
+                    reused += nbytes
+                else:
+                    if host is None:
+                        host = torch.empty(
+                            t.shape, dtype=t.dtype, pin_memory=True)
+                        self._host[id(t)] = (t, host)
+                    host.copy_(t.data, non_blocking=True)
+                    moved += nbytes
+                hosts.append(host)
+            event = stream.record_event()
+        # device memory is released right after, the copies must be done
+        event.synchronize()
+
+        for t, host in zip(tensors, hosts):
+            t.data = host
+        self._moved(module)
+        self.stats[stage]['d2h'] += moved
+        self.stats[stage]['reused'] += reused
+        return module
+
+    def to_host(self, tensor, stage='default'):
+        """
+        Starts an asynchronous copy of `tensor` into pinned host memory.
+        Call `synchronize` before reading the returned tensor.
+        """
+        if tensor.device.type != 'cuda':
+            return tensor
+        host = torch.empty(tensor.shape, dtype=tensor.dtype, pin_memory=True)
+        stream = self._copy_stream(tensor.device)
+        stream.wait_stream(torch.cuda.current_stream(tensor.device))
+        with torch.cuda.stream(stream):
+            host.copy_(tensor, non_blocking=True)
+            self._pending.append(stream.record_event())
+        tensor.record_stream(stream)
+        self.stats[stage]['d2h'] += tensor.numel() * tensor.element_size()
+        return host
+
+    def synchronize(self):
+        """
+        Waits for all copies started by `to_host`.
+        """
+        for event in self._pending:
+            event.synchronize()
+        self._pending.clear()
+
+    def log_stats(self, reset=True):
+        """
+        Logs the bytes moved per stage since the last reset.
+        """
+        for stage, stats in self.stats.items():
+            logging.info(
+                f"Offload [{stage}]: "
+                f"H2D {stats['h2d'] / 2**30:.2f} GiB, "
+                f"D2H {stats['d2h'] / 2**30:.2f} GiB, "
+                f"reused host copy {stats['reused'] / 2**30:.2f} GiB")
+        if reset:
+            self.stats.clear()
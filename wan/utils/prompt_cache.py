@@ -0,0 +1,85 @@
+# Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
+"""
+Persistent cache of prompt-extension results.
+
+An extended prompt only depends on the model, the system prompt, the prompt,
+the image, the target language and the seed. Entries are keyed on a hash of
+these, with the image entering by a hash of its content, and are stored as
+one JSON file each so that re-runs and retries skip the LLM call.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+
+from PIL import Image
+
+__all__ = ['PromptCache', 'image_digest']
+
+
+def image_digest(image):
+    """
+    Content hash of a `PIL.Image.Image` or an image file, None for None.
+    """
+    if image is None:
+        return None
+    h = hashlib.sha1()
+    if isinstance(image, Image.Image):
+        h.update(f'{image.mode}:{image.size}'.encode())
+        h.update(image.tobytes())
+    else:
+        with open(image, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                h.update(block)
+    return h.hexdigest()
+
+
+class PromptCache:
+
+    def __init__(self, root):
+        r"""
+        Args:
+            root (`str`):
+                Directory of the cached results.
+        """
+        self.root = root
+        self._entries = {}
+        os.makedirs(root, exist_ok=True)
+
+    @staticmethod
+    def key(*fields):
+        return hashlib.sha1(
+            json.dumps(fields, ensure_ascii=False).encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.root, key[:2], f'{key}.json')
+
+    def get(self, key):
+        """
+        Returns the fields of the result stored under `key` or None.
+        """
+        if key in self._entries:
+            return self._entries[key]
+        if not os.path.exists(self._path(key)):
+            return None
+        try:
+            with open(self._path(key), encoding='utf-8') as f:
+                value = json.load(f)
+        except Exception as e:
+            logging.warning(f"Ignoring unreadable prompt result {key}: {e}")
+            return None
+        self._entries[key] = value
+        return value
+
+    def put(self, key, value):
+        """
+        Stores the fields `value` of a successful result under `key`.
+        """
+        self._entries[key] = value
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(value, f, ensure_ascii=False)
+        os.replace(tmp, path)
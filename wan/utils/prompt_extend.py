@@ -1,16 +1,20 @@
 # Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
+import base64
+import io
 import json
 import logging
 import math
 import os
 import random
 import sys
-import tempfile
-from dataclasses import dataclass
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import asdict, dataclass
 from http import HTTPStatus
 from typing import Optional, Union
 
-import dashscope
+import requests
 import torch
 from PIL import Image
 
@@ -21,6 +25,7 @@ except ModuleNotFoundError:
     flash_attn_varlen_func = None  # in compatible with CPU machines
     FLASH_VER = None
 
+from .prompt_cache import PromptCache, image_digest
 from .system_prompt import *
 
 DEFAULT_SYS_PROMPTS = {
@@ -63,11 +68,36 @@ class PromptOutput(object):
 
 class PromptExpander:
 
-    def __init__(self, model_name, task, is_vl=False, device=0, **kwargs):
+    def __init__(self,
+                 model_name,
+                 task,
+                 is_vl=False,
+                 device=0,
+                 cache_dir=None,
+                 **kwargs):
         self.model_name = model_name
         self.task = task
         self.is_vl = is_vl
         self.device = device
+        self.cache = PromptCache(cache_dir) if cache_dir is not None else None
+
+    def _cache_key(self, prompt, system_prompt, tar_lang, image, seed):
+        if not self.is_vl:
+            image = None
+        return PromptCache.key(self.model_name, system_prompt, prompt,
+                               image_digest(image), tar_lang, seed)
+
+    def _cached(self, key):
+        if self.cache is None:
+            return None
+        fields = self.cache.get(key)
+        return None if fields is None else PromptOutput(**fields)
+
+    def _remember(self, key, output):
+        # failures are not cached, the next call retries them
+        if self.cache is not None and output.status:
+            self.cache.put(key, asdict(output))
+        return output
 
     def extend_with_img(self,
                         prompt,
@@ -103,15 +133,74 @@ class PromptExpander:
         if system_prompt is None:
             system_prompt = self.decide_system_prompt(
                 tar_lang=tar_lang, prompt=prompt)
+        # an unseeded extension is cached as such, not under its random seed
+        key = self._cache_key(prompt, system_prompt, tar_lang, image,
+                              seed if seed >= 0 else None)
         if seed < 0:
             seed = random.randint(0, sys.maxsize)
+        output = self._cached(key)
+        if output is not None:
+            return output
         if image is not None and self.is_vl:
-            return self.extend_with_img(
+            output = self.extend_with_img(
                 prompt, system_prompt, image=image, seed=seed, *args, **kwargs)
         elif not self.is_vl:
-            return self.extend(prompt, system_prompt, seed, *args, **kwargs)
+            output = self.extend(prompt, system_prompt, seed, *args, **kwargs)
         else:
             raise NotImplementedError
+        return self._remember(key, output)
+
+    def extend_batch(self,
+                     prompts,
+                     system_prompt=None,
+                     tar_lang="zh",
+                     images=None,
+                     seed=-1,
+                     callback=None):
+        """
+        Extends all `prompts`, with the matching entry of `images` for
+        prompt-image extension.
+
+        Args:
+            callback (`callable`, *optional*, defaults to None):
+                Called as `callback(index, output)` as soon as the prompt at
+                `index` is extended.
+
+        Returns:
+            `list[PromptOutput]`: The output of every prompt.
+        """
+        outputs = []
+        for i, prompt in enumerate(prompts):
+            output = self(
+                prompt,
+                system_prompt=system_prompt,
+                tar_lang=tar_lang,
+                image=None if images is None else images[i],
+                seed=seed)
+            if callback is not None:
+                callback(i, output)
+            outputs.append(output)
+        return outputs
+
+
+class _RateLimiter:
+    """
+    Spaces the starts of requests from all threads `1 / rate` seconds apart.
+    """
+
+    def __init__(self, rate=None):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        time.sleep(start - now)
 
 
 class DashScopePromptExpander(PromptExpander):
@@ -123,6 +212,11 @@ class DashScopePromptExpander(PromptExpander):
                  max_image_size=512 * 512,
                  retry_times=4,
                  is_vl=False,
+                 max_workers=8,
+                 rate_limit=None,
+                 backoff=1.0,
+                 max_backoff=30.0,
+                 timeout=60.0,
                  **kwargs):
         '''
         Args:
@@ -132,53 +226,90 @@ class DashScopePromptExpander(PromptExpander):
             max_image_size: The maximum size of the image; unit unspecified (e.g., pixels, KB). Please specify the unit based on actual usage.
             retry_times: Number of retry attempts in case of request failure.
             is_vl: A flag indicating whether the task involves visual-language processing.
+            max_workers: Number of prompts `extend_batch` extends concurrently.
+            rate_limit: Maximum number of requests per second, unlimited if None.
+            backoff: Upper bound in seconds of the random wait before the first retry, doubled on every further retry.
+            max_backoff: Cap of that bound in seconds.
+            timeout: Timeout of one request in seconds.
+            cache_dir: Directory persisting the extended prompts across runs, see `PromptCache`.
             **kwargs: Additional keyword arguments that can be passed to the function or method.
         '''
         if model_name is None:
             model_name = 'qwen-plus' if not is_vl else 'qwen-vl-max'
         super().__init__(model_name, task, is_vl, **kwargs)
-        if api_key is not None:
-            dashscope.api_key = api_key
-        elif 'DASH_API_KEY' in os.environ and os.environ[
-                'DASH_API_KEY'] is not None:
-            dashscope.api_key = os.environ['DASH_API_KEY']
-        else:
+        if api_key is None:
+            api_key = os.environ.get('DASH_API_KEY')
+        if api_key is None:
             raise ValueError("DASH_API_KEY is not set")
-        if 'DASH_API_URL' in os.environ and os.environ[
-                'DASH_API_URL'] is not None:
-            dashscope.base_http_api_url = os.environ['DASH_API_URL']
-        else:
-            dashscope.base_http_api_url = 'https://dashscope.aliyuncs.com/api/v1'
         self.api_key = api_key
+        self.base_url = os.environ.get(
+            'DASH_API_URL', 'https://dashscope.aliyuncs.com/api/v1').rstrip('/')
 
         self.max_image_size = max_image_size
         self.model = model_name
         self.retry_times = retry_times
+        self.max_workers = max_workers
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.rate_limiter = _RateLimiter(rate_limit)
+        # one keep-alive session per worker thread, sessions are not
+        # thread-safe
+        self._local = threading.local()
+
+    def _wait_before(self, attempt):
+        """
+        Rate limits every request and backs off exponentially with full
+        jitter before retries.
+        """
+        if attempt > 0:
+            time.sleep(
+                random.uniform(
+                    0, min(self.max_backoff,
+                           self.backoff * 2**(attempt - 1))))
+        self.rate_limiter.wait()
+
+    def _session(self):
+        if getattr(self._local, 'session', None) is None:
+            self._local.session = requests.Session()
+        return self._local.session
+
+    def _generation_call(self, messages, seed):
+        # the HTTP API on a reused keep-alive session, the SDK opens a new
+        # session for every call and cannot be given one
+        service = 'multimodal-generation' if self.is_vl else 'text-generation'
+        response = self._session().post(
+            f"{self.base_url}/services/aigc/{service}/generation",
+            headers={'Authorization': f'Bearer {self.api_key}'},
+            json={
+                'model': self.model,
+                'input': {
+                    'messages': messages
+                },
+                'parameters': {
+                    'seed': seed,
+                    'result_format': 'message'
+                },
+            },
+            timeout=self.timeout)
+        assert response.status_code == HTTPStatus.OK, \
+            f"{response.status_code}: {response.text}"
+        return response.json()
 
-    def extend(self, prompt, system_prompt, seed=-1, *args, **kwargs):
-        messages = [{
-            'role': 'system',
-            'content': system_prompt
-        }, {
-            'role': 'user',
-            'content': prompt
-        }]
-
+    def _extend(self, messages, prompt, system_prompt, seed):
         exception = None
-        for _ in range(self.retry_times):
+        for attempt in range(self.retry_times):
+            self._wait_before(attempt)
             try:
-                response = dashscope.Generation.call(
-                    self.model,
-                    messages=messages,
-                    seed=seed,
-                    result_format='message',  # set the result to be "message" format.
-                )
-                assert response.status_code == HTTPStatus.OK, response
-                expanded_prompt = response['output']['choices'][0]['message'][
+                response = self._generation_call(messages, seed)
+                content = response['output']['choices'][0]['message'][
                     'content']
+                if self.is_vl:
+                    # multimodal answers are a list of parts
+                    content = content[0]['text'].replace('\n', '\\n')
                 return PromptOutput(
                     status=True,
-                    prompt=expanded_prompt,
+                    prompt=content,
                     seed=seed,
                     system_prompt=system_prompt,
                     message=json.dumps(response, ensure_ascii=False))
@@ -191,6 +322,16 @@ class DashScopePromptExpander(PromptExpander):
             system_prompt=system_prompt,
             message=str(exception))
 
+    def extend(self, prompt, system_prompt, seed=-1, *args, **kwargs):
+        messages = [{
+            'role': 'system',
+            'content': system_prompt
+        }, {
+            'role': 'user',
+            'content': prompt
+        }]
+        return self._extend(messages, prompt, system_prompt, seed)
+
     def extend_with_img(self,
                         prompt,
                         system_prompt,
@@ -207,11 +348,11 @@ class DashScopePromptExpander(PromptExpander):
         resized_h = round(math.sqrt(area * aspect_ratio))
         resized_w = round(math.sqrt(area / aspect_ratio))
         image = image.resize((resized_w, resized_h))
-        with tempfile.NamedTemporaryFile(suffix='.png', delete=False) as f:
-            image.save(f.name)
-            fname = f.name
-            image_path = f"file://{f.name}"
-        prompt = f"{prompt}"
+        # sent inline, the HTTP API does not upload local files like the SDK
+        buffer = io.BytesIO()
+        image.save(buffer, format='PNG')
+        image_url = 'data:image/png;base64,' + base64.b64encode(
+            buffer.getvalue()).decode()
         messages = [
             {
                 'role': 'system',
@@ -224,39 +365,63 @@ class DashScopePromptExpander(PromptExpander):
                 'content': [{
                     "text": prompt
                 }, {
-                    "image": image_path
+                    "image": image_url
                 }]
             },
         ]
-        response = None
-        result_prompt = prompt
-        exception = None
-        status = False
-        for _ in range(self.retry_times):
-            try:
-                response = dashscope.MultiModalConversation.call(
-                    self.model,
-                    messages=messages,
-                    seed=seed,
-                    result_format='message',  # set the result to be "message" format.
-                )
-                assert response.status_code == HTTPStatus.OK, response
-                result_prompt = response['output']['choices'][0]['message'][
-                    'content'][0]['text'].replace('\n', '\\n')
-                status = True
-                break
-            except Exception as e:
-                exception = e
-        result_prompt = result_prompt.replace('\n', '\\n')
-        os.remove(fname)
-
-        return PromptOutput(
-            status=status,
-            prompt=result_prompt,
-            seed=seed,
-            system_prompt=system_prompt,
-            message=str(exception) if not status else json.dumps(
-                response, ensure_ascii=False))
+        return self._extend(messages, prompt, system_prompt, seed)
+
+    def extend_batch(self,
+                     prompts,
+                     system_prompt=None,
+                     tar_lang="zh",
+                     images=None,
+                     seed=-1,
+                     callback=None):
+        """
+        Extends `prompts` on `max_workers` threads, see
+        `PromptExpander.extend_batch`. The callback runs on the calling
+        thread in the order the prompts complete.
+        """
+        outputs = [None] * len(prompts)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = {
+                pool.submit(
+                    self,
+                    prompt,
+                    system_prompt=system_prompt,
+                    tar_lang=tar_lang,
+                    image=None if images is None else images[i],
+                    seed=seed): i for i, prompt in enumerate(prompts)
+            }
+            for future in as_completed(futures):
+                i = futures[future]
+                outputs[i] = future.result()
+                if callback is not None:
+                    callback(i, outputs[i])
+        return outputs
+
+
+class _FinishedRows:
+    """
+    Stopping criterion that never stops generation but reports every row of
+    the batch the step it emits an end-of-sequence token.
+    """
+
+    def __init__(self, eos_token_ids, prompt_len, on_finished):
+        self.eos_token_ids = eos_token_ids
+        self.prompt_len = prompt_len
+        self.on_finished = on_finished
+        self.finished = set()
+
+    def __call__(self, input_ids, scores, **kwargs):
+        last = input_ids[:, -1].tolist()
+        for i, token in enumerate(last):
+            if i not in self.finished and token in self.eos_token_ids:
+                self.finished.add(i)
+                self.on_finished(i, input_ids[i, self.prompt_len:])
+        return torch.zeros(
+            input_ids.shape[0], dtype=torch.bool, device=input_ids.device)
 
 
 class QwenPromptExpander(PromptExpander):
@@ -273,6 +438,9 @@ class QwenPromptExpander(PromptExpander):
                  task=None,
                  device=0,
                  is_vl=False,
+                 resident=False,
+                 batch_size=8,
+                 max_new_tokens=512,
                  **kwargs):
         '''
         Args:
@@ -288,6 +456,10 @@ class QwenPromptExpander(PromptExpander):
                 * You can also specify the model name from Hugging Face's model hub.
             task: Task name. This is required to determine the default system prompt.
             is_vl: A flag indicating whether the task involves visual-language processing.
+            resident: Keep the model on `device` instead of moving it there and back to the CPU on every call.
+            batch_size: Number of prompts generated together by `extend_batch`.
+            max_new_tokens: Maximum length of an extended prompt in tokens.
+            cache_dir: Directory persisting the extended prompts across runs, see `PromptCache`.
             **kwargs: Additional keyword arguments that can be passed to the function or method.
         '''
         if model_name is None:
@@ -316,6 +488,8 @@ class QwenPromptExpander(PromptExpander):
                 min_pixels=min_pixels,
                 max_pixels=max_pixels,
                 use_fast=True)
+            # batched generation continues every row right after its prompt
+            self.processor.tokenizer.padding_side = 'left'
             self.model = Qwen2_5_VLForConditionalGeneration.from_pretrained(
                 self.model_name,
                 torch_dtype=torch.bfloat16 if FLASH_VER == 2 else
@@ -332,48 +506,63 @@ class QwenPromptExpander(PromptExpander):
                 attn_implementation="flash_attention_2"
                 if FLASH_VER == 2 else None,
                 device_map="cpu")
-            self.tokenizer = AutoTokenizer.from_pretrained(self.model_name)
-
-    def extend(self, prompt, system_prompt, seed=-1, *args, **kwargs):
-        self.model = self.model.to(self.device)
-        messages = [{
+            self.tokenizer = AutoTokenizer.from_pretrained(
+                self.model_name, padding_side='left')
+
+        self.resident = resident
+        self.batch_size = batch_size
+        self.max_new_tokens = max_new_tokens
+        if resident:
+            self.model = self.model.to(self.device)
+
+    def _load(self):
+        if not self.resident:
+            self.model = self.model.to(self.device)
+
+    def _offload(self):
+        if not self.resident:
+            self.model = self.model.to("cpu")
+
+    def _generate(self, inputs, decode, callback=None):
+        """
+        Generates the continuations of the left-padded batch `inputs`.
+
+        Returns:
+            `list[str]`: The decoded continuation of every row.
+        """
+        from transformers import StoppingCriteriaList
+
+        prompt_len = inputs.input_ids.shape[1]
+        kwargs = {}
+        if callback is not None:
+            eos_token_ids = self.model.generation_config.eos_token_id
+            if isinstance(eos_token_ids, int):
+                eos_token_ids = [eos_token_ids]
+            stream = _FinishedRows(
+                set(eos_token_ids), prompt_len,
+                lambda i, ids: callback(i, decode(ids)))
+            kwargs['stopping_criteria'] = StoppingCriteriaList([stream])
+        generated_ids = self.model.generate(
+            **inputs, max_new_tokens=self.max_new_tokens, **kwargs)
+        results = [decode(ids[prompt_len:]) for ids in generated_ids]
+        if callback is not None:
+            # rows cut off by max_new_tokens never emitted an end token
+            for i, result in enumerate(results):
+                if i not in stream.finished:
+                    callback(i, result)
+        return results
+
+    def _text_messages(self, prompt, system_prompt):
+        return [{
             "role": "system",
             "content": system_prompt
         }, {
             "role": "user",
             "content": prompt
         }]
-        text = self.tokenizer.apply_chat_template(
-            messages, tokenize=False, add_generation_prompt=True)
-        model_inputs = self.tokenizer([text],
-                                      return_tensors="pt").to(self.model.device)
-
-        generated_ids = self.model.generate(**model_inputs, max_new_tokens=512)
-        generated_ids = [
-            output_ids[len(input_ids):] for input_ids, output_ids in zip(
-                model_inputs.input_ids, generated_ids)
-        ]
-
-        expanded_prompt = self.tokenizer.batch_decode(
-            generated_ids, skip_special_tokens=True)[0]
-        self.model = self.model.to("cpu")
-        return PromptOutput(
-            status=True,
-            prompt=expanded_prompt,
-            seed=seed,
-            system_prompt=system_prompt,
-            message=json.dumps({"content": expanded_prompt},
-                               ensure_ascii=False))
 
-    def extend_with_img(self,
-                        prompt,
-                        system_prompt,
-                        image: Union[Image.Image, str] = None,
-                        seed=-1,
-                        *args,
-                        **kwargs):
-        self.model = self.model.to(self.device)
-        messages = [{
+    def _image_messages(self, prompt, system_prompt, image):
+        return [{
             'role': 'system',
             'content': [{
                 "type": "text",
@@ -394,30 +583,135 @@ class QwenPromptExpander(PromptExpander):
             ],
         }]
 
-        # Preparation for inference
-        text = self.processor.apply_chat_template(
-            messages, tokenize=False, add_generation_prompt=True)
-        image_inputs, video_inputs = self.process_vision_info(messages)
-        inputs = self.processor(
-            text=[text],
-            images=image_inputs,
-            videos=video_inputs,
-            padding=True,
-            return_tensors="pt",
-        )
-        inputs = inputs.to(self.device)
-
-        # Inference: Generation of the output
-        generated_ids = self.model.generate(**inputs, max_new_tokens=512)
-        generated_ids_trimmed = [
-            out_ids[len(in_ids):]
-            for in_ids, out_ids in zip(inputs.input_ids, generated_ids)
+    def _extend_chunk(self, prompts, system_prompts, images, callback=None):
+        if images is None:
+            texts = [
+                self.tokenizer.apply_chat_template(
+                    self._text_messages(u, v),
+                    tokenize=False,
+                    add_generation_prompt=True)
+                for u, v in zip(prompts, system_prompts)
+            ]
+            inputs = self.tokenizer(
+                texts, padding=True, return_tensors="pt").to(self.device)
+            decode = lambda ids: self.tokenizer.decode(
+                ids, skip_special_tokens=True)
+        else:
+            messages = [
+                self._image_messages(u, v, w)
+                for u, v, w in zip(prompts, system_prompts, images)
+            ]
+            texts = [
+                self.processor.apply_chat_template(
+                    m, tokenize=False, add_generation_prompt=True)
+                for m in messages
+            ]
+            image_inputs, video_inputs = self.process_vision_info(messages)
+            inputs = self.processor(
+                text=texts,
+                images=image_inputs,
+                videos=video_inputs,
+                padding=True,
+                return_tensors="pt",
+            ).to(self.device)
+            decode = lambda ids: self.processor.decode(
+                ids,
+                skip_special_tokens=True,
+                clean_up_tokenization_spaces=False)
+        return self._generate(inputs, decode, callback)
+
+    def extend_batch(self,
+                     prompts,
+                     system_prompt=None,
+                     tar_lang="zh",
+                     images=None,
+                     seed=-1,
+                     callback=None):
+        """
+        Extends `prompts` in padded batches of `batch_size`, see
+        `PromptExpander.extend_batch`. The model is moved to the device once
+        for all prompts that are not cached.
+        """
+        assert images is None or self.is_vl, \
+            "Images need a vision-language model"
+        assert images is not None or not self.is_vl, \
+            "A vision-language model needs an image per prompt"
+        system_prompts = [
+            system_prompt if system_prompt is not None else
+            self.decide_system_prompt(tar_lang=tar_lang, prompt=u)
+            for u in prompts
+        ]
+        keys = [
+            self._cache_key(u, v, tar_lang, None if images is None else
+                            images[i], seed if seed >= 0 else None)
+            for i, (u, v) in enumerate(zip(prompts, system_prompts))
         ]
-        expanded_prompt = self.processor.batch_decode(
-            generated_ids_trimmed,
-            skip_special_tokens=True,
-            clean_up_tokenization_spaces=False)[0]
-        self.model = self.model.to("cpu")
+        if seed < 0:
+            seed = random.randint(0, sys.maxsize)
+
+        def output(i, expanded_prompt):
+            return PromptOutput(
+                status=True,
+                prompt=expanded_prompt,
+                seed=seed,
+                system_prompt=system_prompts[i],
+                message=json.dumps({"content": expanded_prompt},
+                                   ensure_ascii=False))
+
+        outputs = [self._cached(k) for k in keys]
+        for i, u in enumerate(outputs):
+            if u is not None and callback is not None:
+                callback(i, u)
+        todo = [i for i, u in enumerate(outputs) if u is None]
+        if not todo:
+            return outputs
+
+        self._load()
+        try:
+            for start in range(0, len(todo), self.batch_size):
+                chunk = todo[start:start + self.batch_size]
+                chunk_callback = None if callback is None else (
+                    lambda i, u, chunk=chunk: callback(
+                        chunk[i], output(chunk[i], u)))
+                results = self._extend_chunk(
+                    [prompts[i] for i in chunk],
+                    [system_prompts[i] for i in chunk],
+                    None if images is None else [images[i] for i in chunk],
+                    chunk_callback)
+                for i, u in zip(chunk, results):
+                    outputs[i] = self._remember(keys[i], output(i, u))
+        finally:
+            self._offload()
+        return outputs
+
+    def extend(self, prompt, system_prompt, seed=-1, *args, **kwargs):
+        self._load()
+        try:
+            expanded_prompt = self._extend_chunk([prompt], [system_prompt],
+                                                 None)[0]
+        finally:
+            self._offload()
+        return PromptOutput(
+            status=True,
+            prompt=expanded_prompt,
+            seed=seed,
+            system_prompt=system_prompt,
+            message=json.dumps({"content": expanded_prompt},
+                               ensure_ascii=False))
+
+    def extend_with_img(self,
+                        prompt,
+                        system_prompt,
+                        image: Union[Image.Image, str] = None,
+                        seed=-1,
+                        *args,
+                        **kwargs):
+        self._load()
+        try:
+            expanded_prompt = self._extend_chunk([prompt], [system_prompt],
+                                                 [image])[0]
+        finally:
+            self._offload()
         return PromptOutput(
             status=True,
             prompt=expanded_prompt,
@@ -0,0 +1,122 @@
+# Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
+"""
+Benchmark of the T5 encoder attention.
+
+A randomly initialized umt5-xxl encoder (with `--layers` blocks) runs on
+random, partly padded token ids with the SDPA attention and cached relative
+position bias, and with the einsum reference that recomputes the bias on
+every forward. The best time over `--repeat` runs and the maximum absolute
+difference of the two outputs on the valid tokens are reported.
+
+Usage:
+    python wan/utils/t5_benchmark.py --device cuda --dtype bf16 \
+        --batch_size 2 --seq_len 128 256 512
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+
+import torch
+
+sys.path.insert(
+    0, os.path.dirname(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__)))))
+
+from wan.modules.t5 import (  # noqa: E402
+    T5Attention, T5RelativeEmbedding, umt5_xxl,
+)
+
+DTYPES = {
+    'fp32': torch.float32,
+    'bf16': torch.bfloat16,
+    'fp16': torch.float16,
+}
+
+
+@torch.no_grad()
+def run(model, ids, mask, use_sdpa, repeat):
+    """
+    Runs `model` with the SDPA or the einsum attention.
+
+    Returns:
+        `tuple[torch.Tensor, float]`: The float32 output and the best seconds.
+    """
+    T5Attention.use_sdpa = use_sdpa
+    T5RelativeEmbedding.cache_size = 4 if use_sdpa else 0
+    best = float('inf')
+    for _ in range(repeat):
+        if ids.device.type == 'cuda':
+            torch.cuda.synchronize(ids.device)
+        start = time.perf_counter()
+        out = model(ids, mask)
+        if ids.device.type == 'cuda':
+            torch.cuda.synchronize(ids.device)
+        best = min(best, time.perf_counter() - start)
+    return out.float(), best
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(
+        description="Compare the SDPA and einsum T5 attention")
+    parser.add_argument(
+        "--layers",
+        type=int,
+        default=4,
+        help="Number of encoder blocks, umt5-xxl has 24.")
+    parser.add_argument(
+        "--batch_size", type=int, default=2, help="Number of sequences.")
+    parser.add_argument(
+        "--seq_len",
+        type=int,
+        nargs='+',
+        default=[128, 512],
+        help="Sequence lengths to benchmark.")
+    parser.add_argument(
+        "--device", type=str, default="cpu", help="Device to run on.")
+    parser.add_argument(
+        "--dtype",
+        type=str,
+        default="fp32",
+        choices=list(DTYPES),
+        help="Precision of the encoder.")
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="Runs per configuration.")
+    parser.add_argument(
+        "--seed", type=int, default=0, help="Seed of weights and inputs.")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="[%(asctime)s] %(levelname)s: %(message)s",
+        handlers=[logging.StreamHandler(stream=sys.stdout)])
+    args = _parse_args()
+    device = torch.device(args.device)
+    torch.manual_seed(args.seed)
+
+    # a small vocabulary, the embedding table does not affect attention
+    model = umt5_xxl(
+        encoder_only=True,
+        vocab_size=1024,
+        encoder_layers=args.layers,
+        dtype=DTYPES[args.dtype],
+        device=device).eval().requires_grad_(False)
+    logging.info(f"Built a {args.layers}-block umt5-xxl encoder on {device}.")
+
+    print(f"{'seq_len':>7} {'einsum [s]':>10} {'sdpa [s]':>9} "
+          f"{'speedup':>7} {'max abs':>9}")
+    for seq_len in args.seq_len:
+        ids = torch.randint(1, 1024, (args.batch_size, seq_len), device=device)
+        # every other sequence is padded to half of the length
+        mask = torch.ones_like(ids)
+        mask[1::2, seq_len // 2:] = 0
+
+        ref, ref_time = run(model, ids, mask, False, args.repeat)
+        out, sdpa_time = run(model, ids, mask, True, args.repeat)
+        valid = mask.bool()
+        max_abs = (out[valid] - ref[valid]).abs().max().item()
+        print(f"{seq_len:>7} {ref_time:10.3f} {sdpa_time:9.3f} "
+              f"{ref_time / sdpa_time:6.2f}x {max_abs:9.4f}")
@@ -0,0 +1,116 @@
+# Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
+"""
+Fidelity check of the int8 CPU T5 (`T5EncoderModel.quantize`).
+
+The prompts are encoded on the CPU with the bf16 checkpoint, the encoder is
+quantized in place and the prompts are encoded again. The mean and minimum
+per-token cosine similarity of every prompt against bf16 are reported
+together with the encoding times. Exits with an error if a prompt falls
+below `--min_cosine`.
+
+Usage:
+    python wan/utils/t5_quantize.py --ckpt_dir ./Wan2.2-T2V-A14B \
+        --threads 16 --min_cosine 0.99
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+
+import torch
+import torch.nn.functional as F
+
+sys.path.insert(
+    0, os.path.dirname(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__)))))
+
+from wan.configs import WAN_CONFIGS  # noqa: E402
+from wan.modules.t5 import T5EncoderModel  # noqa: E402
+
+PROMPTS = [
+    "Two anthropomorphic cats in comfy boxing gear and bright gloves fight "
+    "intensely on a spotlighted stage.",
+    "Summer beach vacation style, a white cat wearing sunglasses sits on a "
+    "surfboard.",
+    "一只红色的狐狸在雪地里奔跑，镜头跟随，电影感光影。",
+]
+
+
+@torch.no_grad()
+def encode(text_encoder, prompts):
+    """
+    Returns the embedding of every prompt in float32 and the seconds taken.
+    """
+    start = time.perf_counter()
+    context = text_encoder(prompts, torch.device('cpu'))
+    return [u.float() for u in context], time.perf_counter() - start
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(
+        description="Compare the int8 CPU T5 embeddings against bf16")
+    parser.add_argument(
+        "--ckpt_dir",
+        type=str,
+        required=True,
+        help="The path to the checkpoint directory.")
+    parser.add_argument(
+        "--task",
+        type=str,
+        default="t2v-A14B",
+        choices=list(WAN_CONFIGS.keys()),
+        help="The task whose T5 checkpoint and tokenizer are used.")
+    parser.add_argument(
+        "--prompts",
+        type=str,
+        nargs='+',
+        default=PROMPTS,
+        help="The prompts to compare on.")
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=None,
+        help="Number of threads of the CPU T5, all cores by default.")
+    parser.add_argument(
+        "--min_cosine",
+        type=float,
+        default=None,
+        help="Fail if a prompt is below this minimum token cosine.")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="[%(asctime)s] %(levelname)s: %(message)s",
+        handlers=[logging.StreamHandler(stream=sys.stdout)])
+    args = _parse_args()
+    cfg = WAN_CONFIGS[args.task]
+
+    text_encoder = T5EncoderModel(
+        text_len=cfg.text_len,
+        dtype=cfg.t5_dtype,
+        device=torch.device('cpu'),
+        checkpoint_path=os.path.join(args.ckpt_dir, cfg.t5_checkpoint),
+        tokenizer_path=os.path.join(args.ckpt_dir, cfg.t5_tokenizer),
+        cache_size=0)
+    text_encoder.set_num_threads(args.threads)
+
+    reference, ref_time = encode(text_encoder, args.prompts)
+    text_encoder.quantize()
+    context, int8_time = encode(text_encoder, args.prompts)
+    print(f"bf16 {ref_time:.3f} s, int8 {int8_time:.3f} s, "
+          f"{ref_time / int8_time:.2f}x")
+
+    print(f"{'prompt':<6} {'tokens':>6} {'mean cos':>8} {'min cos':>8}")
+    failed = []
+    for i, (u, v) in enumerate(zip(context, reference)):
+        cos = F.cosine_similarity(u, v, dim=-1)
+        print(f"{i:<6} {len(cos):>6} {cos.mean().item():8.4f} "
+              f"{cos.min().item():8.4f}")
+        if args.min_cosine is not None and cos.min().item() < args.min_cosine:
+            failed.append(str(i))
+
+    if failed:
+        sys.exit(f"Below {args.min_cosine} cosine: prompts {', '.join(failed)}")
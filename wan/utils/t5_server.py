@@ -0,0 +1,101 @@
+# Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
+"""
+Runs the node-local text-encoding service (`wan.distributed.t5_service`).
+
+Usage:
+    python wan/utils/t5_server.py --ckpt_dir ./Wan2.2-T2V-A14B \
+        --device cuda:0 --address /tmp/wan_t5.sock \
+        --cache_dir ./t5_cache
+"""
+import argparse
+import logging
+import os
+import sys
+
+import torch
+
+sys.path.insert(
+    0, os.path.dirname(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__)))))
+
+from wan.configs import WAN_CONFIGS  # noqa: E402
+from wan.distributed.t5_service import T5Server  # noqa: E402
+from wan.modules.t5 import T5EncoderModel  # noqa: E402
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(
+        description="Serve T5 prompt embeddings to the Wan pipelines")
+    parser.add_argument(
+        "--ckpt_dir",
+        type=str,
+        required=True,
+        help="The path to the checkpoint directory.")
+    parser.add_argument(
+        "--task",
+        type=str,
+        default="t2v-A14B",
+        choices=list(WAN_CONFIGS.keys()),
+        help="The task whose T5 checkpoint and tokenizer are served.")
+    parser.add_argument(
+        "--device", type=str, default="cpu", help="Device to encode on.")
+    parser.add_argument(
+        "--address",
+        type=str,
+        default="/tmp/wan_t5.sock",
+        help="Unix socket to listen on.")
+    parser.add_argument(
+        "--max_batch",
+        type=int,
+        default=16,
+        help="Maximum number of texts encoded in one forward.")
+    parser.add_argument(
+        "--max_wait",
+        type=float,
+        default=0.01,
+        help="Seconds to wait for further requests to batch with.")
+    parser.add_argument(
+        "--cache_dir",
+        type=str,
+        default=None,
+        help="Directory persisting the prompt embeddings across runs.")
+    parser.add_argument(
+        "--int8",
+        action="store_true",
+        default=False,
+        help="Quantize the linear layers to int8, CPU only.")
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=None,
+        help="Number of threads on the CPU, all cores by default.")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="[%(asctime)s] %(levelname)s: %(message)s",
+        handlers=[logging.StreamHandler(stream=sys.stdout)])
+    args = _parse_args()
+    cfg = WAN_CONFIGS[args.task]
+    device = torch.device(args.device)
+
+    text_encoder = T5EncoderModel(
+        text_len=cfg.text_len,
+        dtype=cfg.t5_dtype,
+        device=device,
+        checkpoint_path=os.path.join(args.ckpt_dir, cfg.t5_checkpoint),
+        tokenizer_path=os.path.join(args.ckpt_dir, cfg.t5_tokenizer))
+    if args.cache_dir is not None:
+        text_encoder.enable_disk_cache(args.cache_dir)
+    if args.int8:
+        text_encoder.quantize()
+    text_encoder.set_num_threads(args.threads)
+
+    T5Server(
+        text_encoder,
+        device,
+        address=args.address,
+        max_batch=args.max_batch,
+        max_wait=args.max_wait).serve_forever()
@@ -0,0 +1,106 @@
+# Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
+"""
+Micro-benchmark of prompt cleaning and tokenization.
+
+`--num_prompts` prompts, of which `--unique` are distinct, are cleaned and
+tokenized the way the T5 encoder does it. Reported per 1k prompts are the
+uncached per-text cleaning, the memoized cleaning, and the tokenization
+with a cold and with a warm token-id cache.
+
+Usage:
+    python wan/utils/tokenizer_benchmark.py \
+        --tokenizer ./Wan2.2-T2V-A14B/google/umt5-xxl
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(
+    0, os.path.dirname(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__)))))
+
+from wan.modules.tokenizers import (  # noqa: E402
+    HuggingfaceTokenizer, basic_clean, clean_text, whitespace_clean,
+)
+
+WORDS = ('a cat on a surfboard at sunset, the camera slowly pans over '
+         'waves &amp; sand while  soft light reflects on the water, '
+         'cinematic, 4k, highly detailed').split(' ')
+
+
+def make_prompts(num_prompts, unique, seed):
+    rng = random.Random(seed)
+    pool = [
+        ' '.join(rng.choice(WORDS) for _ in range(rng.randint(20, 80)))
+        for _ in range(unique)
+    ]
+    return [rng.choice(pool) for _ in range(num_prompts)]
+
+
+def timed(fn):
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(
+        description="Time the cleaning and tokenization of prompts")
+    parser.add_argument(
+        "--tokenizer",
+        type=str,
+        required=True,
+        help="Name or path of the tokenizer, e.g. google/umt5-xxl.")
+    parser.add_argument(
+        "--num_prompts", type=int, default=1000, help="Number of prompts.")
+    parser.add_argument(
+        "--unique",
+        type=int,
+        default=100,
+        help="Number of distinct prompts among them.")
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        default=2,
+        help="Prompts per tokenizer call, 2 for a prompt and its negative.")
+    parser.add_argument(
+        "--seq_len", type=int, default=512, help="Padded token length.")
+    parser.add_argument(
+        "--seed", type=int, default=0, help="Seed of the prompts.")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = _parse_args()
+    prompts = make_prompts(args.num_prompts, args.unique, args.seed)
+    batches = [
+        prompts[i:i + args.batch_size]
+        for i in range(0, len(prompts), args.batch_size)
+    ]
+    scale = 1000 / len(prompts) * 1000
+    tokenizer = HuggingfaceTokenizer(
+        name=args.tokenizer, seq_len=args.seq_len, clean='whitespace')
+
+    def tokenize():
+        for batch in batches:
+            tokenizer(batch, return_mask=True, add_special_tokens=True)
+
+    results = [
+        ('clean, uncached',
+         timed(lambda: [whitespace_clean(basic_clean(u)) for u in prompts])),
+        ('clean, memoized', timed(
+            lambda: [clean_text(u, 'whitespace') for u in prompts])),
+    ]
+    clean_text.cache_clear()
+    tokenizer.cache_size = 0
+    results.append(('tokenize, uncached', timed(tokenize)))
+    clean_text.cache_clear()
+    tokenizer.cache_size = 256
+    results.append(('tokenize, cold cache', timed(tokenize)))
+    results.append(('tokenize, warm cache', timed(tokenize)))
+
+    print(f"{'':<22} {'ms / 1k prompts':>15}")
+    for name, seconds in results:
+        print(f"{name:<22} {seconds * scale:15.1f}")
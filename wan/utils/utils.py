@@ -1,17 +1,20 @@
 # Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
 import argparse
 import binascii
+import itertools
 import logging
 import os
 import os.path as osp
 import shutil
 import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 import imageio
 import torch
 import torchvision
 
-__all__ = ['save_video', 'save_image', 'str2bool']
+__all__ = ['save_video', 'save_image', 'str2bool', 'load_in_parallel']
 
 
 def rand_name(length=8, suffix=''):
@@ -94,27 +97,33 @@ def save_video(tensor,
                nrow=8,
                normalize=True,
                value_range=(-1, 1)):
+    """
+    Saves a [B, C, T, H, W] tensor as a video grid. `tensor` may also be an
+    iterable of such tensors holding consecutive frame chunks (e.g. from
+    `decode_stream`), which are written as they arrive.
+    """
     # cache file
     cache_file = osp.join('/tmp', rand_name(
         suffix=suffix)) if save_file is None else save_file
+    chunks = [tensor] if isinstance(tensor, torch.Tensor) else tensor
 
     # save to cache
     try:
-        # preprocess
-        tensor = tensor.clamp(min(value_range), max(value_range))
-        tensor = torch.stack([
-            torchvision.utils.make_grid(
-                u, nrow=nrow, normalize=normalize, value_range=value_range)
-            for u in tensor.unbind(2)
-        ],
-                             dim=1).permute(1, 2, 3, 0)
-        tensor = (tensor * 255).type(torch.uint8).cpu()
-
         # write video
         writer = imageio.get_writer(
             cache_file, fps=fps, codec='libx264', quality=8)
-        for frame in tensor.numpy():
-            writer.append_data(frame)
+        for chunk in chunks:
+            # preprocess
+            chunk = chunk.clamp(min(value_range), max(value_range))
+            chunk = torch.stack([
+                torchvision.utils.make_grid(
+                    u, nrow=nrow, normalize=normalize, value_range=value_range)
+                for u in chunk.unbind(2)
+            ],
+                                dim=1).permute(1, 2, 3, 0)
+            chunk = (chunk * 255).type(torch.uint8).cpu()
+            for frame in chunk.numpy():
+                writer.append_data(frame)
         writer.close()
     except Exception as e:
         logging.info(f'save_video failed, error: {e}')
@@ -169,6 +178,116 @@ def str2bool(v):
         raise argparse.ArgumentTypeError('Boolean value expected (True/False)')
 
 
+def load_in_parallel(loaders, parallel=True, device=None):
+    """
+    Runs pipeline component loaders concurrently on a thread pool.
+
+    Checkpoint reads, deserialization and host-to-device copies of different
+    components overlap, since torch releases the GIL for all of them.
+
+    Args:
+        loaders (`dict[str, callable]`):
+            Component name to a zero-argument function returning the component.
+        parallel (`bool`, *optional*, defaults to True):
+            If False, run the loaders one after another in the given order.
+        device (`torch.device`, *optional*, defaults to None):
+            CUDA device made current in the loader threads, the current device
+            is per thread and would otherwise be cuda:0.
+
+    Returns:
+        `dict[str, Any]`: Component name to loaded component.
+    """
+
+    def _timed(name, loader):
+        if device is not None and torch.device(device).type == 'cuda':
+            torch.cuda.set_device(device)
+        start = time.perf_counter()
+        component = loader()
+        elapsed = time.perf_counter() - start
+        logging.info(f"Loaded {name} in {elapsed:.2f}s")
+        return component, elapsed
+
+    start = time.perf_counter()
+    if parallel and len(loaders) > 1:
+        with ThreadPoolExecutor(
+                max_workers=len(loaders),
+                thread_name_prefix='wan_loader') as executor:
+            futures = {
+                name: executor.submit(_timed, name, loader)
+                for name, loader in loaders.items()
+            }
+            results = {name: f.result() for name, f in futures.items()}
+    else:
+        results = {
+            name: _timed(name, loader) for name, loader in loaders.items()
+        }
+    total = sum(elapsed for _, elapsed in results.values())
+    logging.info(f"Loaded {len(loaders)} components in "
+                 f"{time.perf_counter() - start:.2f}s "
+                 f"(sum of component times {total:.2f}s)")
+    return {name: component for name, (component, _) in results.items()}
+
+
+def configure_pipeline(pipeline, args):
+    """
+    Applies the T5 and VAE options of `generate.py` and `generate_ray.py`
+    shared by all pipelines.
+    """
+    from ..configs import SIZE_CONFIGS
+
+    if args.t5_cache_dir is not None:
+        pipeline.text_encoder.enable_disk_cache(args.t5_cache_dir)
+    if args.t5_int8:
+        pipeline.text_encoder.quantize()
+    if args.t5_threads is not None:
+        pipeline.text_encoder.set_num_threads(args.t5_threads)
+    if args.vae_dtype is not None or args.vae_channels_last:
+        pipeline.vae.set_precision(
+            getattr(torch, args.vae_dtype or "float32"),
+            channels_last=args.vae_channels_last)
+    if args.vae_tile_size is not None:
+        pipeline.vae.enable_tiling(args.vae_tile_size, args.vae_tile_overlap)
+    # only Animate and S2V encode long conditioning videos
+    if args.vae_encode_segment is not None and ("animate" in args.task or
+                                                "s2v" in args.task):
+        pipeline.vae.enable_segmented_encode(args.vae_encode_segment,
+                                             args.vae_encode_warmup)
+    if args.vae_warmup_sizes is not None:
+        # let the warm-up cache the autotuned cuDNN plans of these shapes
+        torch.backends.cudnn.benchmark = True
+        pipeline.vae.warmup([
+            SIZE_CONFIGS[size] for size in args.vae_warmup_sizes or [args.size]
+        ])
+
+def preview_callback(args, fps, rank=0):
+    """
+    Returns the sampling callback of `generate.py` and `generate_ray.py` that
+    writes a preview of the predicted video to `args.preview_dir` every
+    `args.preview_steps` steps on rank 0, None without `--preview_dir`.
+    """
+    if args.preview_dir is None or rank != 0:
+        return None
+    from ..modules.vae_preview import LatentPreviewer
+
+    assert args.preview_weights is not None, \
+        "--preview_dir needs --preview_weights from wan/utils/fit_preview.py"
+    previewer = LatentPreviewer.load(args.preview_weights)
+    os.makedirs(args.preview_dir, exist_ok=True)
+    # numbered across the clips of S2V and Animate
+    count = itertools.count()
+
+    def write(step, preview):
+        save_video(
+            preview[None],
+            save_file=osp.join(args.preview_dir,
+                               f"preview_{next(count):04d}_step_{step + 1:03d}"
+                               ".mp4"),
+            fps=fps,
+            nrow=1)
+
+    return previewer.callback(write)
+
+
 def masks_like(tensor, zero=False, generator=None, p=0.2):
     assert isinstance(tensor, list)
     out1 = [torch.ones(u.shape, dtype=u.dtype, device=u.device) for u in tensor]
@@ -0,0 +1,197 @@
+# Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
+"""
+Accuracy harness for the reduced-precision VAE modes (`set_precision`).
+
+Random latents are decoded in float32 and in every requested mode, and the
+PSNR and maximum absolute error of each mode against float32 are reported
+together with the decode time. Runs on the CPU by default. Exits with an
+error if a mode falls below `--min_psnr`.
+
+With `--segmented_encode SEGMENT WARMUP` a random video of the latent shape is
+also encoded in segments (`enable_segmented_encode`) and the error of its
+latent against the sequential encode is reported.
+
+Usage:
+    python wan/utils/vae_accuracy.py --vae 2.1 \
+        --vae_checkpoint ./Wan2.2-T2V-A14B/Wan2.1_VAE.pth \
+        --modes bf16 bf16_channels_last --latent_shape 3 16 16
+"""
+import argparse
+import copy
+import logging
+import math
+import os
+import sys
+import time
+
+import torch
+
+sys.path.insert(
+    0, os.path.dirname(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__)))))
+
+MODES = {
+    'bf16': (torch.bfloat16, False),
+    'bf16_channels_last': (torch.bfloat16, True),
+    'fp16': (torch.float16, False),
+    'fp16_channels_last': (torch.float16, True),
+}
+
+
+@torch.no_grad()
+def decode(vae, z, device):
+    """
+    Decodes `z` [B, C, T, H, W] with `vae` in its current precision.
+
+    Returns:
+        `tuple[torch.Tensor, float]`: The float32 video and the seconds taken.
+    """
+    with torch.autocast(
+            device_type=device.type,
+            dtype=vae.dtype,
+            enabled=vae.dtype != torch.float32):
+        if device.type == 'cuda':
+            torch.cuda.synchronize(device)
+        start = time.perf_counter()
+        video = vae.model.decode(z, vae.scale).float().clamp_(-1, 1)
+        if device.type == 'cuda':
+            torch.cuda.synchronize(device)
+    return video, time.perf_counter() - start
+
+
+def compare(video, reference):
+    """
+    Returns the PSNR in dB (for the [-1, 1] range) and the maximum absolute
+    error of `video` against `reference`.
+    """
+    mse = (video - reference).pow(2).mean().item()
+    psnr = math.inf if mse == 0 else 10 * math.log10(4 / mse)
+    return psnr, (video - reference).abs().max().item()
+
+
+@torch.no_grad()
+def segmented_encode_error(vae, video, segment_latents, warmup_latents):
+    """
+    Encodes `video` [C, T, H, W] sequentially and in segments.
+
+    Returns:
+        `tuple[float, float]`: The maximum absolute error of the segmented
+        latent and that error relative to the largest latent value.
+    """
+    vae.disable_segmented_encode()
+    reference = vae.encode([video])[0]
+    vae.enable_segmented_encode(segment_latents, warmup_latents)
+    latent = vae.encode([video])[0]
+    vae.disable_segmented_encode()
+    max_abs = (latent - reference).abs().max().item()
+    return max_abs, max_abs / reference.abs().max().item()
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(
+        description="Compare reduced-precision VAE decoding against float32")
+    parser.add_argument(
+        "--vae",
+        type=str,
+        default="2.1",
+        choices=["2.1", "2.2"],
+        help="The VAE version.")
+    parser.add_argument(
+        "--vae_checkpoint",
+        type=str,
+        required=True,
+        help="Path of the VAE checkpoint.")
+    parser.add_argument(
+        "--modes",
+        type=str,
+        nargs='+',
+        default=['bf16', 'bf16_channels_last'],
+        choices=list(MODES),
+        help="The modes to compare against float32.")
+    parser.add_argument(
+        "--latent_shape",
+        type=int,
+        nargs=3,
+        default=[3, 16, 16],
+        help="Frames, height and width of the random latents.")
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        default=1,
+        help="Number of random latents.")
+    parser.add_argument(
+        "--device", type=str, default="cpu", help="Device to decode on.")
+    parser.add_argument(
+        "--min_psnr",
+        type=float,
+        default=None,
+        help="Fail if a mode is below this PSNR in dB.")
+    parser.add_argument(
+        "--seed", type=int, default=0, help="Seed of the random latents.")
+    parser.add_argument(
+        "--segmented_encode",
+        type=int,
+        nargs=2,
+        default=None,
+        metavar=("SEGMENT", "WARMUP"),
+        help="Also compare segmented against sequential encoding with these "
+        "segment and warm-up lengths in latent frames.")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="[%(asctime)s] %(levelname)s: %(message)s",
+        handlers=[logging.StreamHandler(stream=sys.stdout)])
+    args = _parse_args()
+    device = torch.device(args.device)
+
+    if args.vae == "2.1":
+        from wan.modules.vae2_1 import Wan2_1_VAE
+        vae = Wan2_1_VAE(vae_pth=args.vae_checkpoint, device=device)
+    else:
+        from wan.modules.vae2_2 import Wan2_2_VAE
+        vae = Wan2_2_VAE(vae_pth=args.vae_checkpoint, device=device)
+
+    generator = torch.Generator().manual_seed(args.seed)
+    z = torch.randn(
+        args.batch_size,
+        vae.model.z_dim,
+        *args.latent_shape,
+        generator=generator).to(device)
+
+    reference, ref_time = decode(vae, z, device)
+    print(f"{'mode':<20} {'PSNR [dB]':>10} {'max abs':>9} {'time [s]':>9}")
+    print(f"{'fp32':<20} {math.inf:10.2f} {0.0:9.4f} {ref_time:9.3f}")
+
+    failed = []
+    for mode in args.modes:
+        dtype, channels_last = MODES[mode]
+        # converting the weights back from half precision would be lossy
+        mode_vae = copy.deepcopy(vae)
+        mode_vae.set_precision(dtype, channels_last=channels_last)
+        video, mode_time = decode(mode_vae, z, device)
+        psnr, max_abs = compare(video, reference)
+        print(f"{mode:<20} {psnr:10.2f} {max_abs:9.4f} {mode_time:9.3f}")
+        if args.min_psnr is not None and psnr < args.min_psnr:
+            failed.append(mode)
+        del mode_vae, video
+
+    if args.segmented_encode is not None:
+        frames, height, width = args.latent_shape
+        video = torch.rand(
+            3,
+            1 + 4 * (frames - 1),
+            height * vae.spatial_stride,
+            width * vae.spatial_stride,
+            generator=generator).to(device) * 2 - 1
+        max_abs, rel = segmented_encode_error(vae, video,
+                                              *args.segmented_encode)
+        start, _ = vae._tail_start(video.shape[1], 1)
+        print(f"segmented encode {args.segmented_encode}: max abs latent "
+              f"error {max_abs:.4g} ({rel:.2%} of the largest latent), exact "
+              f"from a warm-up of {start} latents")
+
+    if failed:
+        sys.exit(f"Below {args.min_psnr} dB PSNR: {', '.join(failed)}")